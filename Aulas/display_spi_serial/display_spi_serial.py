@@ -206,12 +206,13 @@ def create_display_spi_serial() -> Module:
                         lcd_cs_r(Int(1, 1, 10)),
                         lcd_rs_r(Int(1, 1, 10)),
                         bit_loop(Int(0, bit_loop.width, 10)),
-                        pixel_cnt(pixel_cnt+Int(1, pixel_cnt.width, 10)),
+                        EmbeddedCode('// the RAMWR window wraps, so keep taking frames'),
                         If(pixel_cnt == Int(32400-1, pixel_cnt.width, 10))(
-                            init_state(INIT_DONE)
+                            pixel_cnt(Int(0, pixel_cnt.width, 10)),
                         ).Else(
-                            init_state(INIT_WAIT_SERIAL)
-                        )
+                            pixel_cnt(pixel_cnt+Int(1, pixel_cnt.width, 10)),
+                        ),
+                        init_state(INIT_WAIT_SERIAL)
                     ).Else(
                         spi_data(Cat(spi_data[0:7], Int(1, 1, 10))),
                         bit_loop(bit_loop + Int(1, bit_loop.width, 10)),
@@ -1,69 +1,68 @@
-from pyftdi.ftdi import Ftdi
-import asyncio
-import pyftdi.serialext
+import os
+import sys
 import time
-import threading
+import asyncio
+import argparse
+import numpy as np
 from PIL import Image
-from math import ceil, log2
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'sw'))
+from uart_interface import UartInterface
+
+# FT2232 TX buffer size; each write is sized to fill it once
+FT2232_FIFO_SIZE = 4096
 
 
-class UartInterface:
-    def __init__(self):
-        self.stop_flag = False
-        self.start_flag = False
-        self.queue = asyncio.Queue()
-        self.listener = threading.Thread(
-            target=self.listener_routine, args=[1,])
-        self.port = pyftdi.serialext.serial_for_url(
-            'ftdi://ftdi:2232:1/2', baudrate=3000000, bytesize=8, parity='N', stopbits=1, timeout=0.001)
+def create_args():
+    parser = argparse.ArgumentParser('display_spi_serial_exec -h')
+    parser.add_argument(
+        '-i', '--image', help='240x135 image to stream', type=str,
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'teste_.bmp'))
+    parser.add_argument(
+        '-n', '--frames', help='Number of frames to stream', type=int, default=1)
+    parser.add_argument(
+        '-c', '--chunk', help='Bytes per USB write', type=int, default=FT2232_FIFO_SIZE)
+    parser.add_argument(
+        '-u', '--url', help='Serial port url', type=str, default='ftdi://ftdi:2232:1/2')
+    parser.add_argument(
+        '-b', '--baudrate', help='Serial baudrate', type=int, default=3000000)
+    return parser.parse_args()
 
-    def listener_routine(self, name):
-        data = None
-        while not self.stop_flag:
-            data = self.port.read()
-            if data != b'':
-                pass  # print(int.from_bytes(data))
-            time.sleep(0.01)
 
-    def start_listener(self):
-        self.stop_flag = False
-        self.start_flag = True
-        self.port.reset_input_buffer()
-        self.port.reset_output_buffer()
-        #Stime.sleep(0.005)
-        self.listener.start()
+def rgb565_frame(im: Image.Image) -> bytes:
+    rgb = np.asarray(im.convert('RGB'), dtype=np.uint16)
+    pixels = ((rgb[:, :, 0] >> 3) << 11) | (
+        (rgb[:, :, 1] >> 2) << 5) | (rgb[:, :, 2] >> 3)
+    # Pixels are sent column by column (x outer, y inner), like the old
+    # getpixel loop. display_spi_serial shifts each received byte into
+    # pixel[15:8], so the low byte has to go first to reach the LCD MSB first.
+    return pixels.T.astype('<u2').tobytes()
 
-    def stop_listener(self):
-        self.stop_flag = True
 
-    def send_data(self, data):
-        self.port.write(data)
+async def main():
+    args = create_args()
+    im = Image.open(args.image)
+    im.load()
+    frame = rgb565_frame(im)
 
+    # the transport splits each frame into write_chunk sized writes
+    u = UartInterface(url=args.url, baudrate=args.baudrate,
+                      framed=False, write_chunk=args.chunk)
+    await u.start_listener()
 
-u = UartInterface()
-u.start_listener()
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        u.send_many([frame])
+    elapsed = time.perf_counter() - start
 
-im = Image.open(
-    "/home/jeronimo/Documentos/GIT/tang_nano_9k_riscv_monitor/teste_.bmp")
-im.load()
-height, widht = im.size
+    link_fps = args.baudrate / 10 / len(frame)
+    print('%d frames of %d bytes in %.3f s: %.2f fps (link limit %.2f fps)' % (
+        args.frames, len(frame), elapsed, args.frames / elapsed, link_fps))
 
-for row in range(height):
-    for col in range(widht):
-        a = im.getpixel((row, col))
-        nr = int((a[0]/255)*32)
-        ng = int((a[1]/255)*64)
-        nb = int((a[2]/255)*32)
-        h = 0x00  # (nr << 11) | (ng << 5) | nr
-        h_lsb =0x1f
-        ''' 11111 111111 11111 '''
-        h_msb = (h >> 8) & 0xff
-        u.send_data(h_msb.to_bytes(1))
-        #time.sleep(0.005)
-        u.send_data(h_lsb.to_bytes(1))
-        #time.sleep(0.005)
-        # u.send_data(int.to_bytes(0x0))
+    await asyncio.sleep(0.1)
+    u.stop_listener()
 
 
-time.sleep(1)
-u.stop_listener()
+if __name__ == '__main__':
+    asyncio.run(main())
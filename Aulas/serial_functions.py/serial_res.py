@@ -1,61 +1,42 @@
-from pyftdi.ftdi import Ftdi
+import os
+import sys
 import asyncio
-import pyftdi.serialext
-import time
-import random
-import threading
-
-
-class UartInterface:
-    def __init__(self):
-        self.stop_flag = False
-        self.start_flag = False
-        self.queue = asyncio.Queue()
-        self.listener = threading.Thread(
-            target=self.listener_routine, args=[1,])
-        self.port = pyftdi.serialext.serial_for_url(
-            'ftdi://ftdi:2232:1/2', baudrate=3000000, bytesize=8, parity='N', stopbits=1, timeout=0.001)
-
-    def listener_routine(self, name):
-        data = None
-        while not self.stop_flag:
-            data = self.port.read()
-            if data != b'':
-                ret = int.from_bytes(data)
-                # if ret == 0:
-                # print('Par')
-                # else:
-                print(ret)
-
-            time.sleep(0.01)
-
-    def start_listener(self):
-        self.stop_flag = False
-        self.start_flag = True
-        self.port.reset_input_buffer()
-        self.port.reset_output_buffer()
-        time.sleep(0.005)
-        self.listener.start()
-
-    def stop_listener(self):
-        self.stop_flag = True
-
-    def send_data(self, data):
-        self.port.write(data)
-
-
-u = UartInterface()
-u.start_listener()
-
-n = 0
-print("Digite a quantidade de valores a serem enviados (max 255): ")
-n = int(input())
-u.send_data(int.to_bytes(n))
-for i in range(n):
-    print("Digite o %d valor (max 255): " % (i+1))
-    val = int(input())
-    u.send_data(val.to_bytes(1))
-#u.send_data(int.to_bytes(val))
-print()
-time.sleep(1)
-u.stop_listener()
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'sw'))
+from uart_interface import UartInterface
+
+
+async def printer(u: UartInterface):
+    while True:
+        for ret in await u.get_frame():
+            # if ret == 0:
+            # print('Par')
+            # else:
+            print(ret)
+
+
+async def main():
+    u = UartInterface(framed=False)
+    await u.start_listener()
+    task = asyncio.create_task(printer(u))
+    loop = asyncio.get_running_loop()
+
+    n = 0
+    print("Digite a quantidade de valores a serem enviados (max 255): ")
+    n = int(await loop.run_in_executor(None, input))
+    values = [int.to_bytes(n)]
+    for i in range(n):
+        print("Digite o %d valor (max 255): " % (i+1))
+        val = int(await loop.run_in_executor(None, input))
+        values.append(val.to_bytes(1))
+    u.send_many(values)
+    print()
+    await asyncio.sleep(1)
+
+    task.cancel()
+    u.stop_listener()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
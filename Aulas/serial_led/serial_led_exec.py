@@ -1,50 +1,33 @@
-from pyftdi.ftdi import Ftdi
+import os
+import sys
 import asyncio
-import pyftdi.serialext
-import time,random
-import threading
-
-
-class UartInterface:
-    def __init__(self):
-        self.stop_flag = False
-        self.start_flag = False
-        self.queue = asyncio.Queue()
-        self.listener = threading.Thread(target=self.listener_routine, args=[1,])
-        self.port = pyftdi.serialext.serial_for_url(
-            'ftdi://ftdi:2232:1/2', baudrate=3000000, bytesize=8, parity='N', stopbits=1, timeout=0.001)
-
-    def listener_routine(self, name):
-        data = None
-        while not self.stop_flag:
-            data = self.port.read()
-            if data != b'':
-                print(int.from_bytes(data))
-            time.sleep(0.01)
-
-
-    def start_listener(self):
-        self.stop_flag = False
-        self.start_flag = True
-        self.port.reset_input_buffer()
-        self.port.reset_output_buffer()
-        time.sleep(0.005)
-        self.listener.start()
-
-    def stop_listener(self):
-        self.stop_flag = True
-
-    def send_data(self, data):
-        self.port.write(data)
-
-
-u = UartInterface()
-u.start_listener()
-
-op = 0
-while op < 64:
-    print("Digite um número entre 0 e 63 (maior que 63 pra sair): ")
-    op = int(input())
-    u.send_data(int.to_bytes(op))
-
-u.stop_listener()
\ No newline at end of file
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'sw'))
+from uart_interface import UartInterface
+
+
+async def printer(u: UartInterface):
+    while True:
+        for b in await u.get_frame():
+            print(b)
+
+
+async def main():
+    u = UartInterface(framed=False)
+    await u.start_listener()
+    task = asyncio.create_task(printer(u))
+    loop = asyncio.get_running_loop()
+
+    op = 0
+    while op < 64:
+        print("Digite um número entre 0 e 63 (maior que 63 pra sair): ")
+        op = int(await loop.run_in_executor(None, input))
+        u.send_data(int.to_bytes(op))
+
+    task.cancel()
+    u.stop_listener()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
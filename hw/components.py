@@ -1,9 +1,14 @@
 from veriloggen import *
 from math import ceil, log2
+from functools import reduce
 from riscv import Riscv
 
 import util as _u
 
+# the phase accumulator moves a bit edge by up to one clock, so below this
+# many clocks per bit the uart stops sampling reliably
+MIN_CLOCKS_PER_BIT = 4
+
 
 class Components:
     _instance = None
@@ -14,15 +19,50 @@ class Components:
             ram_depth: int = 5,
             inst_ram_depth: int = 6,
             serial_width: int = 8,
-            fifo_depth: int = 2
+            fifo_depth: int = 2,
+            sys_clock: float = 27.0,
+            baudrate: float = 3.0,
+            tx_fifo_depth: int = 8,
+            trace_depth: int = 10
     ):
         self.data_width = data_width
         self.ram_depth = ram_depth
         self.inst_ram_depth = inst_ram_depth
         self.serial_width = 8
         self.fifo_depth = 2
+        # MHz and Mbaud, as the uart bit timing needs them
+        self.sys_clock = sys_clock
+        self.baudrate = baudrate
+        if sys_clock / baudrate < MIN_CLOCKS_PER_BIT:
+            raise ValueError('%gMbaud needs at least %gMHz (%d clocks per bit), the clock is %gMHz' % (
+                baudrate, baudrate * MIN_CLOCKS_PER_BIT, MIN_CLOCKS_PER_BIT, sys_clock))
+        self.phase_bits = 16
+        # depth bits of the tx fifo; 8 holds a whole wide dump and, with the
+        # registered read of the fifo, maps to a BSRAM block
+        self.tx_fifo_depth = tx_fifo_depth
+        # depth bits of the trace buffer, 12 bytes an entry
+        self.trace_depth = trace_depth
         self.cache = {}
 
+    def crc8_terms(self, poly: int = 0x07) -> list:
+        # bit j of the CRC-8 after one more byte (MSB first, no reflection)
+        # as the set of old crc ('c', i) and data ('d', i) bits it xors
+        c = [{('c', i)} for i in range(8)]
+        for i in reversed(range(8)):
+            fb = c[7] ^ {('d', i)}
+            c = [(c[j - 1] if j else set()) ^ (fb if poly >> j & 1 else set()) for j in range(8)]
+        return c
+
+    def crc8_update(self, crc, data):
+        bits = [reduce(Xor, [crc[i] if k == 'c' else data[i] for k, i in sorted(terms)])
+                for terms in self.crc8_terms()]
+        return Cat(*reversed(bits))
+
+    def crc8_byte(self, data: int) -> int:
+        # crc of a single byte starting from 0, for constants
+        return sum(1 << j for j, terms in enumerate(self.crc8_terms())
+                   if sum(data >> i & 1 for k, i in terms if k == 'd') & 1)
+
     def create_fifo(self) -> Module:
         data_width = self.data_width
         fifo_depth = self.fifo_depth
@@ -56,6 +96,12 @@ class Components:
 
         mem = m.Reg('mem', FIFO_WIDTH, Power(2, FIFO_DEPTH_BITS))
 
+        m.EmbeddedCode('// a write into a full fifo and a read from an empty one are dropped')
+        we_ok = m.Wire('we_ok')
+        re_ok = m.Wire('re_ok')
+        we_ok.assign(AndList(we, ~full))
+        re_ok.assign(AndList(re, ~empty))
+
         m.Always(Posedge(clk))(
             If(rst)(
                 empty(1),
@@ -66,7 +112,7 @@ class Components:
                 write_pointer(0),
                 data_count(0)
             ).Else(
-                Case(Cat(we, re))(
+                Case(Cat(we_ok, re_ok))(
                     When(3)(
                         read_pointer(read_pointer + 1),
                         write_pointer(write_pointer + 1),
@@ -111,7 +157,7 @@ class Components:
                 out_valid(0)
             ).Else(
                 out_valid(0),
-                If(we == 1)(
+                If(we_ok)(
                     mem[write_pointer](in_data)
                 ),
                 If(re == 1)(
@@ -123,6 +169,10 @@ class Components:
         self.cache[name] = m
         return m
 
+    def baud_inc(self) -> int:
+        # bits per clock as a PHASE_BITS fraction
+        return round(self.baudrate / self.sys_clock * 2 ** self.phase_bits)
+
     def create_uart_tx(self) -> Module:
         name = "uart_tx"
         if name in self.cache.keys():
@@ -135,29 +185,23 @@ class Components:
         tx = m.OutputReg('tx')
         tx_bsy = m.OutputReg('tx_bsy')
 
-        SYSCLOCK = 27.0
-        BAUDRATE = 3.0
-        m.EmbeddedCode('// %dMHz' % SYSCLOCK)
-        m.EmbeddedCode('// %dMbps' % BAUDRATE)
-
-        CLKPERFRM = m.Localparam('CLKPERFRM', int(SYSCLOCK/BAUDRATE)*10)
-        m.EmbeddedCode('// bit order is lsb-msb')
-        TBITAT = m.Localparam('TBITAT', 1)
-        m.EmbeddedCode('// START bit')
-        BIT0AT = m.Localparam('BIT0AT', int(SYSCLOCK/BAUDRATE*1)+1)
-        BIT1AT = m.Localparam('BIT1AT', int(SYSCLOCK/BAUDRATE*2)+1)
-        BIT2AT = m.Localparam('BIT2AT', int(SYSCLOCK/BAUDRATE*3)+1)
-        BIT3AT = m.Localparam('BIT3AT', int(SYSCLOCK/BAUDRATE*4)+1)
-        BIT4AT = m.Localparam('BIT4AT', int(SYSCLOCK/BAUDRATE*5)+1)
-        BIT5AT = m.Localparam('BIT5AT', int(SYSCLOCK/BAUDRATE*6)+1)
-        BIT6AT = m.Localparam('BIT6AT', int(SYSCLOCK/BAUDRATE*7)+1)
-        BIT7AT = m.Localparam('BIT7AT', int(SYSCLOCK/BAUDRATE*8)+1)
-        PBITAT = m.Localparam('PBITAT', int(SYSCLOCK/BAUDRATE*9)+1)
-        m.EmbeddedCode('// STOP bit')
+        phase_bits = self.phase_bits
+        m.EmbeddedCode('// %gMHz' % self.sys_clock)
+        m.EmbeddedCode('// %gMbps' % self.baudrate)
+        m.EmbeddedCode('// Bit times come from a phase accumulator that adds BAUD_INC/2^%d' % phase_bits)
+        m.EmbeddedCode('// of a bit per clock: every edge is within one clock of where it')
+        m.EmbeddedCode('// belongs, also when the baudrate does not divide the clock')
+        BAUD_INC = m.Localparam('BAUD_INC', Int(self.baud_inc(), phase_bits + 1, 10), phase_bits + 1)
 
         m.EmbeddedCode('')
         m.EmbeddedCode('// tx flow control ')
-        tx_cnt = m.Reg('tx_cnt', ceil(log2(CLKPERFRM.value))+1)
+        phase = m.Reg('phase', phase_bits)
+        phase_next = m.Wire('phase_next', phase_bits + 1)
+        bit_tick = m.Wire('bit_tick')
+        m.EmbeddedCode('// bit periods done: 0 START, 1-8 data lsb-msb, 9 STOP')
+        bit_idx = m.Reg('bit_idx', 4)
+        phase_next.assign(phase + BAUD_INC)
+        bit_tick.assign(phase_next[phase_bits])
 
         m.EmbeddedCode('')
         m.EmbeddedCode('// buffer')
@@ -165,7 +209,7 @@ class Components:
         frame_begin = m.Wire('frame_begin')
         frame_end = m.Wire('frame_end')
         frame_begin.assign(Uand(Cat(send_trig, ~tx_bsy)))
-        frame_end.assign(Uand(Cat(tx_bsy, tx_cnt == CLKPERFRM)))
+        frame_end.assign(Uand(Cat(tx_bsy, bit_tick, bit_idx == Int(9, bit_idx.width, 10))))
 
         m.Always(Posedge(clk))(
             If(rst)(
@@ -179,18 +223,24 @@ class Components:
 
         m.Always(Posedge(clk))(
             If(rst)(
-                tx_cnt(Int(0, tx_cnt.width, 10))
-            ).Elif(frame_end)(
-                tx_cnt(Int(0, tx_cnt.width, 10))
+                phase(Int(0, phase.width, 10)),
+                bit_idx(Int(0, bit_idx.width, 10))
+            ).Elif(frame_begin)(
+                phase(Int(0, phase.width, 10)),
+                bit_idx(Int(0, bit_idx.width, 10))
             ).Elif(tx_bsy)(
-                tx_cnt.inc()
+                phase(phase_next[0:phase_bits]),
+                If(bit_tick)(
+                    bit_idx.inc()
+                )
             )
         )
 
+        m.EmbeddedCode('// the byte is taken when the frame starts')
         m.Always(Posedge(clk))(
             If(rst)(
                 data2send(Int(0, data2send.width, 10))
-            ).Else(
+            ).Elif(frame_begin)(
                 data2send(send_data)
             )
         )
@@ -198,41 +248,16 @@ class Components:
         m.Always(Posedge(clk))(
             If(rst)(
                 tx(Int(1, 1, 2))
-            ).Elif(tx_bsy)(
-                Case(tx_cnt)(
-                    When(TBITAT)(
-                        tx(Int(0, 1, 2))
-                    ),
-                    When(BIT0AT)(
-                        tx(data2send[0])
-                    ),
-                    When(BIT1AT)(
-                        tx(data2send[1])
-                    ),
-                    When(BIT2AT)(
-                        tx(data2send[2])
-                    ),
-                    When(BIT3AT)(
-                        tx(data2send[3])
-                    ),
-                    When(BIT4AT)(
-                        tx(data2send[4])
-                    ),
-                    When(BIT5AT)(
-                        tx(data2send[5])
-                    ),
-                    When(BIT6AT)(
-                        tx(data2send[6])
-                    ),
-                    When(BIT7AT)(
-                        tx(data2send[7])
-                    ),
-                    When(PBITAT)(
-                        tx(Int(0, 1, 2))
-                    ),
+            ).Elif(frame_begin)(
+                EmbeddedCode('// START bit'),
+                tx(Int(0, 1, 2))
+            ).Elif(AndList(tx_bsy, bit_tick))(
+                If(bit_idx < Int(8, bit_idx.width, 10))(
+                    tx(data2send[bit_idx[0:3]])
+                ).Else(
+                    EmbeddedCode('// STOP bit, then idle'),
+                    tx(Int(1, 1, 2))
                 )
-            ).Else(
-                tx(Int(1, 1, 2))
             )
         )
 
@@ -252,33 +277,30 @@ class Components:
         data_valid = m.OutputReg('data_valid')
         data_out = m.OutputReg('data_out', 8)
 
-        SYSCLOCK = 27.0
-        BAUDRATE = 3.0
-        m.EmbeddedCode('// %dMHz' % SYSCLOCK)
-        m.EmbeddedCode('// %dMbits' % BAUDRATE)
-
-        SYNC_DELAY = 2  # m.Localparam('SYNC_DELAY', 2)
-        CLKPERFRM = m.Localparam('CLKPERFRM', int(
-            SYSCLOCK/BAUDRATE*9.8)-SYNC_DELAY)
-        m.EmbeddedCode('// bit order is lsb-msb')
-        TBITAT = m.Localparam('TBITAT', int(SYSCLOCK/BAUDRATE*0.8)-SYNC_DELAY)
-        m.EmbeddedCode('// START BIT')
-        BIT0AT = m.Localparam('BIT0AT', int(SYSCLOCK/BAUDRATE*1.5)-SYNC_DELAY)
-        BIT1AT = m.Localparam('BIT1AT', int(SYSCLOCK/BAUDRATE*2.5)-SYNC_DELAY)
-        BIT2AT = m.Localparam('BIT2AT', int(SYSCLOCK/BAUDRATE*3.5)-SYNC_DELAY)
-        BIT3AT = m.Localparam('BIT3AT', int(SYSCLOCK/BAUDRATE*4.5)-SYNC_DELAY)
-        BIT4AT = m.Localparam('BIT4AT', int(SYSCLOCK/BAUDRATE*5.5)-SYNC_DELAY)
-        BIT5AT = m.Localparam('BIT5AT', int(SYSCLOCK/BAUDRATE*6.5)-SYNC_DELAY)
-        BIT6AT = m.Localparam('BIT6AT', int(SYSCLOCK/BAUDRATE*7.5)-SYNC_DELAY)
-        BIT7AT = m.Localparam('BIT7AT', int(SYSCLOCK/BAUDRATE*8.5)-SYNC_DELAY)
-        PBITAT = m.Localparam('PBITAT', int(SYSCLOCK/BAUDRATE*9.2)-SYNC_DELAY)
-        m.EmbeddedCode('// STOP bit')
-        BLK_TIMEOUT = m.Localparam('BLK_TIMEOUT', BIT1AT)
+        phase_bits = self.phase_bits
+        m.EmbeddedCode('// %gMHz' % self.sys_clock)
+        m.EmbeddedCode('// %gMbits' % self.baudrate)
+        m.EmbeddedCode('// Same phase accumulator as uart_tx. It starts half a bit (plus the')
+        m.EmbeddedCode('// edge detect delay) ahead, so every tick falls in the middle of a bit')
+        SYNC_DELAY = 1
+        baud_inc = self.baud_inc()
+        BAUD_INC = m.Localparam('BAUD_INC', Int(baud_inc, phase_bits + 1, 10), phase_bits + 1)
+        PHASE_START = m.Localparam('PHASE_START', Int(
+            min(2 ** phase_bits - 1, 2 ** (phase_bits - 1) + SYNC_DELAY * baud_inc), phase_bits, 10), phase_bits)
+        m.EmbeddedCode('// idle bit times after a frame that end a block')
+        BLK_TIMEOUT = m.Localparam('BLK_TIMEOUT', Int(2, 2, 10), 2)
         m.EmbeddedCode('// this depends on your USB UART chip')
 
         m.EmbeddedCode('')
         m.EmbeddedCode('// rx flow control')
-        rx_cnt = m.Reg('rx_cnt', ceil(log2(CLKPERFRM.value))+1)
+        phase = m.Reg('phase', phase_bits)
+        phase_next = m.Wire('phase_next', phase_bits + 1)
+        bit_tick = m.Wire('bit_tick')
+        m.EmbeddedCode('// bit being sampled: 0 START, 1-8 data lsb-msb, 9 STOP')
+        bit_idx = m.Reg('bit_idx', 4)
+        idle_cnt = m.Reg('idle_cnt', 2)
+        phase_next.assign(phase + BAUD_INC)
+        bit_tick.assign(phase_next[phase_bits])
 
         m.EmbeddedCode('')
         m.EmbeddedCode('//logic rx_sync')
@@ -287,7 +309,6 @@ class Components:
         frame_begin = m.Wire('frame_begin')
         frame_end = m.Wire('frame_end')
         start_invalid = m.Wire('start_invalid')
-        stop_invalid = m.Wire('stop_invalid')
 
         m.Always(Posedge(clk))(
             If(rst)(
@@ -299,47 +320,51 @@ class Components:
 
         m.EmbeddedCode('// negative edge detect')
         frame_begin.assign(Uand(Cat(~rx_bsy, ~rx, rx_hold)))
-        m.EmbeddedCode('// final count')
-        frame_end.assign(Uand(Cat(rx_bsy, rx_cnt == CLKPERFRM)))
-        m.EmbeddedCode('// START bit must be low  for 80% of the bit duration')
-        start_invalid.assign(Uand(Cat(rx_bsy, rx_cnt < TBITAT, rx)))
-        m.EmbeddedCode('// STOP  bit must be high for 80% of the bit duration')
-        stop_invalid.assign(Uand(Cat(rx_bsy, rx_cnt > PBITAT, ~rx)))
+        m.EmbeddedCode('// middle of the STOP bit')
+        frame_end.assign(Uand(Cat(rx_bsy, bit_tick, bit_idx == Int(9, bit_idx.width, 10))))
+        m.EmbeddedCode('// START bit must still be low in its middle')
+        start_invalid.assign(Uand(Cat(rx_bsy, bit_tick, bit_idx == Int(0, bit_idx.width, 10), rx)))
 
         m.Always(Posedge(clk))(
             If(rst)(
                 rx_bsy(Int(0, 1, 2))
             ).Elif(frame_begin)(
                 rx_bsy(Int(1, 1, 2))
-            ).Elif(Uor(Cat(start_invalid, stop_invalid)))(
-                rx_bsy(Int(0, 1, 2))
-            ).Elif(frame_end)(
+            ).Elif(Uor(Cat(start_invalid, frame_end)))(
                 rx_bsy(Int(0, 1, 2))
             )
         )
 
-        m.EmbeddedCode('// count if frame is valid or until the timeout')
+        m.EmbeddedCode('// the accumulator also times the idle line until the timeout')
         m.Always(Posedge(clk))(
             If(rst)(
-                rx_cnt(Int(0, rx_cnt.width, 10))
+                phase(Int(0, phase.width, 10)),
+                bit_idx(Int(0, bit_idx.width, 10)),
+                idle_cnt(Int(0, idle_cnt.width, 10))
             ).Elif(frame_begin)(
-                rx_cnt(Int(0, rx_cnt.width, 10))
-            ).Elif(Uor(Cat(start_invalid, stop_invalid, frame_end)))(
-                rx_cnt(Int(0, rx_cnt.width, 10))
+                phase(PHASE_START),
+                bit_idx(Int(0, bit_idx.width, 10)),
+                idle_cnt(Int(0, idle_cnt.width, 10))
+            ).Elif(rx_bsy)(
+                phase(phase_next[0:phase_bits]),
+                If(bit_tick)(
+                    bit_idx.inc()
+                )
             ).Elif(~timeout)(
-                rx_cnt.inc()
-            ).Else(
-                rx_cnt(Int(0, rx_cnt.width, 10))
+                phase(phase_next[0:phase_bits]),
+                If(bit_tick)(
+                    idle_cnt.inc()
+                )
             )
         )
 
-        m.EmbeddedCode('// this just stops the rx_cnt')
+        m.EmbeddedCode('// this just stops the idle count')
         m.Always(Posedge(clk))(
             If(rst)(
                 timeout(Int(0, 1, 2))
             ).Elif(frame_begin)(
                 timeout(Int(0, 1, 2))
-            ).Elif(Uand(Cat(~rx_bsy, rx_cnt == BLK_TIMEOUT)))(
+            ).Elif(Uand(Cat(~rx_bsy, bit_tick, idle_cnt == BLK_TIMEOUT - 1)))(
                 timeout(Int(1, 1, 2))
             )
         )
@@ -348,55 +373,32 @@ class Components:
         m.Always(Posedge(clk))(
             If(rst)(
                 block_timeout(Int(0, 1, 2))
-            ).Elif(Uand(Cat(~rx_bsy, rx_cnt == BLK_TIMEOUT)))(
+            ).Elif(Uand(Cat(~rx_bsy, ~timeout, bit_tick, idle_cnt == BLK_TIMEOUT - 1)))(
                 block_timeout(Int(1, 1, 2))
             ).Else(
                 block_timeout(Int(0, 1, 2))
             )
         )
 
-        m.EmbeddedCode('// this pulses upon completion of a clean frame')
+        m.EmbeddedCode('// this pulses upon completion of a clean frame:')
+        m.EmbeddedCode('// STOP bit must be high in its middle')
         m.Always(Posedge(clk))(
             If(rst)(
                 data_valid(Int(0, 1, 2))
             ).Elif(frame_end)(
-                data_valid(Int(1, 1, 2))
+                data_valid(rx)
             ).Else(
                 data_valid(Int(0, 1, 2))
             )
         )
 
-        m.EmbeddedCode('// rx data control')
+        m.EmbeddedCode('// rx data control, shifted in lsb first')
         m.Always(Posedge(clk))(
             If(rst)(
                 data_out(Int(0, data_out.width, 10))
-            ).Elif(rx_bsy)(
-                Case(rx_cnt)(
-                    When(BIT0AT)(
-                        data_out[0](rx)
-                    ),
-                    When(BIT1AT)(
-                        data_out[1](rx)
-                    ),
-                    When(BIT2AT)(
-                        data_out[2](rx)
-                    ),
-                    When(BIT3AT)(
-                        data_out[3](rx)
-                    ),
-                    When(BIT4AT)(
-                        data_out[4](rx)
-                    ),
-                    When(BIT5AT)(
-                        data_out[5](rx)
-                    ),
-                    When(BIT6AT)(
-                        data_out[6](rx)
-                    ),
-                    When(BIT7AT)(
-                        data_out[7](rx)
-                    ),
-                )
+            ).Elif(AndList(rx_bsy, bit_tick, bit_idx != Int(0, bit_idx.width, 10),
+                           bit_idx != Int(9, bit_idx.width, 10)))(
+                data_out(Cat(rx, data_out[1:8]))
             )
         )
 
@@ -406,8 +408,15 @@ class Components:
     def create_io_riscv_controller(self) -> Module:
         data_width = self.data_width
         fifo_depth = self.fifo_depth
-        riscv = Riscv()
+        riscv = Riscv(clock_enable=True)
         monitor_tam = 32
+        rx_fifo_depth_bits = 5
+        tx_fifo_depth_bits = self.tx_fifo_depth
+        trace_depth_bits = self.trace_depth
+        n_breakpoints = 4
+        n_watchpoints = 4
+        # payload bytes of a frame, so that a whole frame fits in the rx fifo
+        frame_max = 2 ** rx_fifo_depth_bits - 4
 
         name = "io_riscv_controller"
         if name in self.cache.keys():
@@ -420,8 +429,11 @@ class Components:
         tx = m.Output('tx')
         tx_bsy = m.Output('tx_bsy')
 
+        m.EmbeddedCode('// The core runs on clk and moves on the clocks risc_ce is set:')
+        m.EmbeddedCode('// single risc_pulse steps and every clock of a run')
         risc_rst = m.Reg('risc_rst')
-        risc_clk = m.Reg('risc_clk')
+        risc_pulse = m.Reg('risc_pulse')
+        risc_ce = m.Wire('risc_ce')
 
         m.EmbeddedCode('')
         m.EmbeddedCode('// Instantiate the RX controller')
@@ -434,39 +446,294 @@ class Components:
         tx_send_trig = m.Reg('send_trig')
         tx_send_data = m.Reg('send_data', 8)
 
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Instantiate the TX fifo')
+        tx_fifo_we = m.Wire('tx_fifo_we')
+        tx_fifo_in_data = m.Wire('tx_fifo_in_data', 8)
+        tx_fifo_re = m.Wire('tx_fifo_re')
+        tx_fifo_out_valid = m.Wire('tx_fifo_out_valid')
+        tx_fifo_out_data = m.Wire('tx_fifo_out_data', 8)
+        tx_fifo_empty = m.Wire('tx_fifo_empty')
+        tx_fifo_full = m.Wire('tx_fifo_full')
+        tx_fifo_almostfull = m.Wire('tx_fifo_almostfull')
+        m.EmbeddedCode('// The FSM pushes with send_trig, one byte per clock while not almost')
+        m.EmbeddedCode('// full: the push it starts lands a clock later, behind the one in flight.')
+        m.EmbeddedCode('// A byte is popped when uart_tx is idle and the last one popped')
+        m.EmbeddedCode('// (out_valid, the send_trig of uart_tx) has already started')
+        tx_fifo_we.assign(tx_send_trig)
+        tx_fifo_in_data.assign(tx_send_data)
+        tx_fifo_re.assign(AndList(~tx_fifo_empty, ~tx_bsy, ~tx_fifo_out_valid))
+
         m.EmbeddedCode('')
         m.EmbeddedCode('// Instantiate the RX fifo')
         rx_fifo_we = m.Wire('rx_fifo_we')
         rx_fifo_in_data = m.Wire('rx_fifo_in_data', 8)
-        rx_fifo_re = m.Reg('rx_fifo_re')
+        rx_fifo_re = m.Wire('rx_fifo_re')
         rx_fifo_out_valid = m.Wire('rx_fifo_out_valid')
         rx_fifo_out_data = m.Wire('rx_fifo_out_data', 8)
         rx_fifo_empty = m.Wire('rx_fifo_empty')
+        rx_fifo_full = m.Wire('rx_fifo_full')
+        rx_fifo_count = m.Wire('rx_fifo_count', rx_fifo_depth_bits + 1)
         m.EmbeddedCode('// The Rx fifo is controlled by the uart_rx module')
         rx_fifo_we.assign(rx_data_valid)
         rx_fifo_in_data.assign(rx_data_out)
+        m.EmbeddedCode('// Credits: free fifo slots the host may still fill.')
+        m.EmbeddedCode('// rx_overflow is sticky until it is reported by a CREDIT reply')
+        rx_fifo_free = m.Wire('rx_fifo_free', 8)
+        rx_overflow = m.Reg('rx_overflow')
+        rx_fifo_free.assign(Int(2 ** rx_fifo_depth_bits, 8, 10) - rx_fifo_count)
         m.EmbeddedCode('')
 
         m.EmbeddedCode('// Config and read data from riscv')
-        monitor_addr = m.Reg('monitor_addr', 8)
+        m.EmbeddedCode('// monitor_addr is a register number or a data memory byte address')
+        monitor_addr = m.Reg('monitor_addr', 32)
+        mem_cnt = m.Reg('mem_cnt', 6)
+        m.EmbeddedCode('// a risc_pulse pulse with monitor_write_on set stores monitor_data')
+        m.EmbeddedCode('// instead of executing')
+        monitor_write_on = m.Reg('monitor_write_on')
+        monitor_write_inst = m.Reg('monitor_write_inst')
+        monitor_data = m.Reg('monitor_data', 32)
+        write_cnt = m.Reg('write_cnt', 8)
+        write_total = m.Reg('write_total', 8)
         monitor_read_on = m.Reg('config_on')
-        mem_dataout = m.Wire('mem_dataout', 8)
-        reg_dataout = m.Wire('reg_dataout', 8)
+        mem_dataout = m.Wire('mem_dataout', 32)
+        reg_dataout = m.Wire('reg_dataout', 32)
 
         m.EmbeddedCode('')
         '''
             PC->board
             0x00    reset 8b
             0x01    exec clock - 8b + n_clocks
-            
+            0x02    credit - reply [2][free rx fifo slots][bit0: rx overflow]
+            0x03    dump registers without clocking
+            0x04    run - 8b + n_clocks 32b (LE), then dump registers
+            0x05    set breakpoint - 8b + idx 8b (bit7 enable) + addr 32b, no reply
+            0x06    run until breakpoint - 8b + max clocks 32b, reply
+                    [9][reason][pc 32b][clocks 32b]; reason bit0 breakpoint,
+                    bits 7:4 breakpoints hit
+            0x07    set watchpoint - 8b + idx 8b + addr 32b, no reply
+                    idx bit7 enable, bit4 mem write, bit5 mem read,
+                    bit6 register write (addr = register number)
+                    run until stops before the access: reason bit1,
+                    bits 7:4 watchpoints hit
+            0x08    dump mode - 8b + mode 8b, no reply. mode bit0: register
+                    dumps become [4 + n][written regs bitmap 32b][n values],
+                    all registers count as written right after the command.
+                    mode bit1: values are 32b LE and register dumps end
+                    with the pc (32 regs: [132][regs][pc])
+            0x09    read memory - 8b + byte addr 32b + n words 8b (n < 64),
+                    reply [4n][n words 32b LE]
+            0x0a    write memory - 8b + target 8b (0 inst, 1 data) + byte addr 32b
+                    + n words 8b + n words 32b LE, reply [1][n]
+            0x0b    set trigger - 8b + mode 8b + pc 32b + post 16b, no reply.
+                    mode bit0 arms the trace: it is cleared and every clock the
+                    core executes is recorded. bit1 triggers on the pc, bit2 on
+                    a breakpoint or watchpoint hit, neither on the first clock.
+                    post clocks after the trigger (itself included) recording
+                    stops, post 0 never. mode without bit0 just stops it
+            0x0c    read trace - 8b + first entry 16b + n entries 8b (n <= 20),
+                    oldest entry is 0, reply [4 + 12n][entries recorded 16b]
+                    [bit0 recording, bit1 triggered][0][n x pc, inst, writeback
+                    value 32b LE]
+            0x0d    read counters - 8b + flags 8b (bit0 clear after the read),
+                    reply [48][cycles][instret][branches taken][loads][stores]
+                    [stalls], 64b LE each
+            0x0e    run free - 8b, no reply. The core runs until a breakpoint or
+                    watchpoint, halt, or a command that uses the core: every
+                    command but credit, set bp/wp, dump mode, set trigger,
+                    read counters, run free, halt and status halts it first
+            0x0f    halt - 8b, stops a free run, reply as status
+            0x10    status - 8b, reply [9][reason][pc 32b][clocks 32b] as run
+                    until, reason bit3 still running, clocks since run free
+
+            Framed: the first 0xa5 byte switches to frames until the next rst
+            PC->board   [0xa5][seq][len, bit7 resync][len bytes: one command][crc]
+            board->PC   [0xa5][seq][status][reply or [0]][crc]
+            crc is CRC-8 (x^8+x^2+x+1, init 0) of every byte before it. The
+            frame is buffered and checked before the command runs. status 0
+            ack: seq is the command's. status 1 bad crc or length, 2 seq is
+            not the expected one: nothing ran, seq is the expected one.
+            resync makes the board take the frame seq as the expected one.
+            Bytes outside a frame are dropped.
+
         '''
         m.EmbeddedCode('// PC to board protocol')
         PROT_PC_B_RESET = m.Localparam('PROT_PC_B_RESET', Int(0, 8, 16), 8)
         PROT_PC_B_CLOCK = m.Localparam('PROT_PC_B_CLOCK', Int(1, 8, 16), 8)
+        PROT_PC_B_CREDIT = m.Localparam('PROT_PC_B_CREDIT', Int(2, 8, 16), 8)
+        PROT_PC_B_DUMP = m.Localparam('PROT_PC_B_DUMP', Int(3, 8, 16), 8)
+        PROT_PC_B_RUN = m.Localparam('PROT_PC_B_RUN', Int(4, 8, 16), 8)
+        PROT_PC_B_SET_BP = m.Localparam('PROT_PC_B_SET_BP', Int(5, 8, 16), 8)
+        PROT_PC_B_RUN_UNTIL = m.Localparam('PROT_PC_B_RUN_UNTIL', Int(6, 8, 16), 8)
+        PROT_PC_B_SET_WP = m.Localparam('PROT_PC_B_SET_WP', Int(7, 8, 16), 8)
+        PROT_PC_B_DUMP_MODE = m.Localparam('PROT_PC_B_DUMP_MODE', Int(8, 8, 16), 8)
+        PROT_PC_B_READ_MEM = m.Localparam('PROT_PC_B_READ_MEM', Int(9, 8, 16), 8)
+        PROT_PC_B_WRITE_MEM = m.Localparam('PROT_PC_B_WRITE_MEM', Int(10, 8, 16), 8)
+        PROT_PC_B_SET_TRIGGER = m.Localparam('PROT_PC_B_SET_TRIGGER', Int(11, 8, 16), 8)
+        PROT_PC_B_READ_TRACE = m.Localparam('PROT_PC_B_READ_TRACE', Int(12, 8, 16), 8)
+        PROT_PC_B_READ_COUNTERS = m.Localparam('PROT_PC_B_READ_COUNTERS', Int(13, 8, 16), 8)
+        PROT_PC_B_RUN_FREE = m.Localparam('PROT_PC_B_RUN_FREE', Int(14, 8, 16), 8)
+        PROT_PC_B_HALT = m.Localparam('PROT_PC_B_HALT', Int(15, 8, 16), 8)
+        PROT_PC_B_STATUS = m.Localparam('PROT_PC_B_STATUS', Int(16, 8, 16), 8)
+        FRAME_SYNC = m.Localparam('FRAME_SYNC', Int(0xa5, 8, 16), 8)
+        FRAME_SYNC_CRC = m.Localparam('FRAME_SYNC_CRC', Int(self.crc8_byte(0xa5), 8, 16), 8)
+        FRAME_MAX = m.Localparam('FRAME_MAX', Int(frame_max, 6, 10), 6)
+        FRAME_ACK = m.Localparam('FRAME_ACK', Int(0, 8, 16), 8)
+        FRAME_NAK_CRC = m.Localparam('FRAME_NAK_CRC', Int(1, 8, 16), 8)
+        FRAME_NAK_SEQ = m.Localparam('FRAME_NAK_SEQ', Int(2, 8, 16), 8)
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Framed mode. Commands read their bytes through cmd_*: from the rx')
+        m.EmbeddedCode('// fifo, or from frame_buf once a frame passed its crc (frame_on)')
+        prot_framed = m.Reg('prot_framed')
+        frame_on = m.Reg('frame_on')
+        frame_done = m.Reg('frame_done')
+        frame_buf = m.Reg('frame_buf', 8, 2 ** rx_fifo_depth_bits)
+        frame_wr = m.Reg('frame_wr', 6)
+        frame_rd = m.Reg('frame_rd', rx_fifo_depth_bits)
+        frame_len = m.Reg('frame_len', 6)
+        frame_seq = m.Reg('frame_seq', 8)
+        frame_resync = m.Reg('frame_resync')
+        frame_out_valid = m.Reg('frame_out_valid')
+        frame_out_data = m.Reg('frame_out_data', 8)
+        rx_seq = m.Reg('rx_seq', 8)
+        rx_crc = m.Reg('rx_crc', 8)
+        tx_crc = m.Reg('tx_crc', 8)
+        tx_body = m.Reg('tx_body')
+        cmd_re = m.Reg('cmd_re')
+        cmd_empty = m.Wire('cmd_empty')
+        cmd_valid = m.Wire('cmd_valid')
+        cmd_data = m.Wire('cmd_data', 8)
+        rx_byte = m.Wire('rx_byte', 8)
+        rx_crc_next = m.Wire('rx_crc_next', 8)
+        tx_crc_next = m.Wire('tx_crc_next', 8)
+        m.EmbeddedCode('// reads past the end of a short frame return stale bytes instead of')
+        m.EmbeddedCode('// waiting for ones that never come')
+        cmd_empty.assign(AndList(~frame_on, rx_fifo_empty))
+        cmd_valid.assign(Mux(frame_on, frame_out_valid, rx_fifo_out_valid))
+        cmd_data.assign(Mux(frame_on, frame_out_data, rx_fifo_out_data))
+        rx_fifo_re.assign(AndList(cmd_re, ~frame_on))
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Command arguments are shifted in from the top: after n bytes')
+        m.EmbeddedCode('// the little endian value sits in arg_data[63:64-8*n]')
+        arg_data = m.Reg('arg_data', 64)
+        arg_cnt = m.Reg('arg_cnt', 4)
+        run_cnt = m.Reg('run_cnt', 32)
+        run_steps = m.Reg('run_steps', 32)
+        rx_byte.assign(arg_data[56:64])
+        rx_crc_next.assign(self.crc8_update(rx_crc, rx_byte))
+        tx_crc_next.assign(self.crc8_update(tx_crc, tx_send_data))
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Registers written since the last delta dump, marked on the clock')
+        m.EmbeddedCode('// the core writes them; the reset clock writes the bank too')
+        dump_delta = m.Reg('dump_delta')
+        dump_wide = m.Reg('dump_wide')
+        reg_dirty = m.Reg('reg_dirty', 32)
+        delta_mask = m.Reg('delta_mask', 32)
+        dirty_count = m.Wire('dirty_count', 8)
+        dirty_count.assign(sum([reg_dirty[i] for i in range(32)], Int(0, 8, 10)))
+        delta_tam = m.Wire('delta_tam', 8)
+        delta_tam.assign(Mux(dump_wide, (dirty_count << 2) + Int(8, 8, 10), dirty_count + Int(4, 8, 10)))
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// PC breakpoints, compared against the pc the next clock executes')
+        riscv_pc = m.Wire('riscv_pc', 32)
+        bp_addr = m.Reg('bp_addr', 32, n_breakpoints)
+        bp_en = m.Reg('bp_en', n_breakpoints)
+        bp_hit = m.Wire('bp_hit', n_breakpoints)
+        bp_hit.assign(Cat(*[AndList(bp_en[i], bp_addr[i] == riscv_pc)
+                            for i in reversed(range(n_breakpoints))]))
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Watchpoints on the accesses of the instruction the next clock executes.')
+        riscv_regwrite = m.Wire('riscv_regwrite')
+        riscv_rd = m.Wire('riscv_rd', 5)
+        riscv_memread = m.Wire('riscv_memread')
+        riscv_memwrite = m.Wire('riscv_memwrite')
+        riscv_maddr = m.Wire('riscv_maddr', 32)
+        wp_addr = m.Reg('wp_addr', 32, n_watchpoints)
+        wp_mem_write = m.Reg('wp_mem_write', n_watchpoints)
+        wp_mem_read = m.Reg('wp_mem_read', n_watchpoints)
+        wp_reg_write = m.Reg('wp_reg_write', n_watchpoints)
+        wp_hit = m.Wire('wp_hit', n_watchpoints)
+        wp_hit.assign(Cat(*[OrList(
+            AndList(wp_mem_write[i], riscv_memwrite, (wp_addr[i] >> 2) == (riscv_maddr >> 2)),
+            AndList(wp_mem_read[i], riscv_memread, (wp_addr[i] >> 2) == (riscv_maddr >> 2)),
+            AndList(wp_reg_write[i], riscv_regwrite, wp_addr[i] == Cat(Int(0, 27, 10), riscv_rd)))
+            for i in reversed(range(n_watchpoints))]))
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Trace buffer: a ring of {writeback value, inst, pc} of the clocks the')
+        m.EmbeddedCode('// core executes, written on the clock it executes; reads are registered')
+        m.EmbeddedCode('// so the ring can sit in BSRAM')
+        riscv_inst = m.Wire('riscv_inst', 32)
+        riscv_writedata = m.Wire('riscv_writedata', 32)
+        riscv_step = m.Wire('riscv_step')
+        trace_mem = m.Reg('trace_mem', 96, 2 ** trace_depth_bits)
+        trace_out = m.Reg('trace_out', 96)
+        trace_we = m.Wire('trace_we')
+        trace_wr = m.Reg('trace_wr', trace_depth_bits)
+        trace_rd = m.Reg('trace_rd', trace_depth_bits)
+        trace_count = m.Reg('trace_count', trace_depth_bits + 1)
+        trace_left = m.Reg('trace_left', 8)
+        trace_on = m.Reg('trace_on')
+        trace_triggered = m.Reg('trace_triggered')
+        trace_mode = m.Reg('trace_mode', 8)
+        trace_pc = m.Reg('trace_pc', 32)
+        trace_post = m.Reg('trace_post', 16)
+        trace_hit = m.Wire('trace_hit')
+        m.EmbeddedCode('// a risc_ce clock that executes an instruction')
+        riscv_step.assign(AndList(risc_ce, ~risc_rst, ~monitor_write_on))
+        trace_we.assign(AndList(riscv_step, trace_on))
+        trace_hit.assign(OrList(AndList(trace_mode[1], trace_pc == riscv_pc),
+                                AndList(trace_mode[2], Uor(Cat(bp_hit, wp_hit)))))
+        m.Always(Posedge(clk))(
+            If(trace_we)(
+                trace_mem[trace_wr](Cat(riscv_writedata, riscv_inst, riscv_pc))
+            ),
+            trace_out(trace_mem[trace_rd])
+        )
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Performance counters, 64 bits like mcycle/minstret: controller clocks')
+        m.EmbeddedCode('// the core spent running, instructions executed, taken branches, loads,')
+        m.EmbeddedCode('// stores, and running clocks that executed nothing. A read sends perf_snap,')
+        m.EmbeddedCode('// taken on one clock, since a free run keeps counting while it goes out')
+        perf_names = ['cycles', 'instret', 'branches', 'loads', 'stores', 'stalls']
+        perf_cnt = m.Reg('perf_cnt', 64, len(perf_names))
+        perf_snap = m.Reg('perf_snap', 64, len(perf_names))
+        perf_idx = m.Reg('perf_idx', 3)
+        riscv_branch_taken = m.Wire('riscv_branch_taken')
+        core_busy = m.Wire('core_busy')
+        PERF_CYCLES, PERF_INSTRET, PERF_BRANCHES, PERF_LOADS, PERF_STORES, PERF_STALLS = range(len(perf_names))
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Free run: the core executes every clock next to the FSM, which keeps')
+        m.EmbeddedCode('// taking the commands that leave the core alone (cmd_passive). A command')
+        m.EmbeddedCode('// that halts the core finds the step of its decode clock done.')
+        m.EmbeddedCode('// free_stop: the next step would run into a breakpoint or watchpoint.')
+        m.EmbeddedCode('// run_steps counts the instructions run')
+        free_run = m.Reg('free_run')
+        halt_reason = m.Reg('halt_reason', 8)
+        cmd_passive = m.Wire('cmd_passive')
+        core_hit = m.Wire('core_hit')
+        free_stop = m.Wire('free_stop')
+        core_hit.assign(Uor(Cat(bp_hit, wp_hit)))
+        free_stop.assign(AndList(free_run, core_hit, run_steps != Int(0, run_steps.width, 10)))
+
+        m.EmbeddedCode('')
+        m.EmbeddedCode('// Short replies are shifted out LSB first, tam byte included.')
+        m.EmbeddedCode('// tx_ready: the tx fifo still has room for a byte pushed this clock')
+        reply_data = m.Reg('reply_data', 96)
+        reply_cnt = m.Reg('reply_cnt', 4)
+        tx_ready = m.Wire('tx_ready')
+        tx_ready.assign(~tx_fifo_almostfull)
 
         m.EmbeddedCode('')
         m.EmbeddedCode('// IO and protocol controller')
-        fsm_io = m.Reg('fsm_io', 4)
+        fsm_io = m.Reg('fsm_io', 6)
         FSM_IDLE = m.Localparam(
             'FSM_IDLE', Int(0, fsm_io.width, 16), fsm_io.width)
         FSM_DECODE_PROTOCOL = m.Localparam(
@@ -487,36 +754,290 @@ class Components:
             'FSM_SEND_MEM_DATA', Int(8, fsm_io.width, 16), fsm_io.width)
         FSM_SEND_MEM_BYTES = m.Localparam(
             'FSM_SEND_MEM_BYTES', Int(9, fsm_io.width, 16), fsm_io.width)
+        FSM_SEND_REPLY = m.Localparam(
+            'FSM_SEND_REPLY', Int(10, fsm_io.width, 16), fsm_io.width)
+        FSM_READ_ARG = m.Localparam(
+            'FSM_READ_ARG', Int(11, fsm_io.width, 16), fsm_io.width)
+        FSM_WAIT_ARG = m.Localparam(
+            'FSM_WAIT_ARG', Int(12, fsm_io.width, 16), fsm_io.width)
+        FSM_RUN_LOAD = m.Localparam(
+            'FSM_RUN_LOAD', Int(13, fsm_io.width, 16), fsm_io.width)
+        FSM_RUN = m.Localparam(
+            'FSM_RUN', Int(14, fsm_io.width, 16), fsm_io.width)
+        FSM_SET_BP = m.Localparam(
+            'FSM_SET_BP', Int(15, fsm_io.width, 16), fsm_io.width)
+        FSM_RUN_UNTIL_LOAD = m.Localparam(
+            'FSM_RUN_UNTIL_LOAD', Int(16, fsm_io.width, 16), fsm_io.width)
+        FSM_RUN_UNTIL = m.Localparam(
+            'FSM_RUN_UNTIL', Int(17, fsm_io.width, 16), fsm_io.width)
+        FSM_SET_WP = m.Localparam(
+            'FSM_SET_WP', Int(18, fsm_io.width, 16), fsm_io.width)
+        FSM_SET_DUMP_MODE = m.Localparam(
+            'FSM_SET_DUMP_MODE', Int(19, fsm_io.width, 16), fsm_io.width)
+        FSM_DELTA_LATCH = m.Localparam(
+            'FSM_DELTA_LATCH', Int(20, fsm_io.width, 16), fsm_io.width)
+        FSM_DELTA_SCAN = m.Localparam(
+            'FSM_DELTA_SCAN', Int(21, fsm_io.width, 16), fsm_io.width)
+        FSM_DELTA_BYTES = m.Localparam(
+            'FSM_DELTA_BYTES', Int(22, fsm_io.width, 16), fsm_io.width)
+        FSM_WRITE_MEM = m.Localparam(
+            'FSM_WRITE_MEM', Int(23, fsm_io.width, 16), fsm_io.width)
+        FSM_WRITE_WORD = m.Localparam(
+            'FSM_WRITE_WORD', Int(24, fsm_io.width, 16), fsm_io.width)
+        FSM_WRITE_PULSE = m.Localparam(
+            'FSM_WRITE_PULSE', Int(25, fsm_io.width, 16), fsm_io.width)
+        FSM_WRITE_NEXT = m.Localparam(
+            'FSM_WRITE_NEXT', Int(26, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_SEQ = m.Localparam(
+            'FSM_FRAME_SEQ', Int(27, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_LEN = m.Localparam(
+            'FSM_FRAME_LEN', Int(28, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_DATA = m.Localparam(
+            'FSM_FRAME_DATA', Int(29, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_STORE = m.Localparam(
+            'FSM_FRAME_STORE', Int(30, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_CHECK = m.Localparam(
+            'FSM_FRAME_CHECK', Int(31, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_EXEC = m.Localparam(
+            'FSM_FRAME_EXEC', Int(32, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_END = m.Localparam(
+            'FSM_FRAME_END', Int(33, fsm_io.width, 16), fsm_io.width)
+        FSM_FRAME_CRC = m.Localparam(
+            'FSM_FRAME_CRC', Int(34, fsm_io.width, 16), fsm_io.width)
+        FSM_SET_TRIGGER = m.Localparam(
+            'FSM_SET_TRIGGER', Int(35, fsm_io.width, 16), fsm_io.width)
+        FSM_TRACE_TAM = m.Localparam(
+            'FSM_TRACE_TAM', Int(36, fsm_io.width, 16), fsm_io.width)
+        FSM_TRACE_DATA = m.Localparam(
+            'FSM_TRACE_DATA', Int(37, fsm_io.width, 16), fsm_io.width)
+        FSM_TRACE_WORD = m.Localparam(
+            'FSM_TRACE_WORD', Int(38, fsm_io.width, 16), fsm_io.width)
+        FSM_COUNTERS_TAM = m.Localparam(
+            'FSM_COUNTERS_TAM', Int(39, fsm_io.width, 16), fsm_io.width)
+        FSM_COUNTERS_DATA = m.Localparam(
+            'FSM_COUNTERS_DATA', Int(40, fsm_io.width, 16), fsm_io.width)
+        FSM_STATUS = m.Localparam(
+            'FSM_STATUS', Int(41, fsm_io.width, 16), fsm_io.width)
+        reply_next = m.Reg('reply_next', fsm_io.width)
+        arg_next = m.Reg('arg_next', fsm_io.width)
+        core_busy.assign(OrList(fsm_io == FSM_RUN, fsm_io == FSM_RUN_UNTIL, free_run, riscv_step))
+        m.EmbeddedCode('// runs step every clock; run until and free run stop before a breakpoint')
+        m.EmbeddedCode('// or watchpoint, except on the first step, which may leave the last one')
+        risc_ce.assign(OrList(
+            risc_pulse,
+            AndList(fsm_io == FSM_RUN, run_cnt != Int(0, run_cnt.width, 10)),
+            AndList(fsm_io == FSM_RUN_UNTIL, run_cnt != Int(0, run_cnt.width, 10),
+                    ~AndList(core_hit, run_steps != Int(0, run_steps.width, 10))),
+            AndList(free_run, ~free_stop)))
+        cmd_passive.assign(OrList(*[cmd_data == p for p in [
+            PROT_PC_B_CREDIT, PROT_PC_B_SET_BP, PROT_PC_B_SET_WP, PROT_PC_B_DUMP_MODE,
+            PROT_PC_B_SET_TRIGGER, PROT_PC_B_READ_COUNTERS, PROT_PC_B_RUN_FREE,
+            PROT_PC_B_HALT, PROT_PC_B_STATUS]]))
 
         m.Always(Posedge(clk))(
             If(rst)(
                 fsm_io(FSM_IDLE),
-                rx_fifo_re(Int(0, 1, 2)),
-                risc_clk(Int(0, 1, 2)),
+                cmd_re(Int(0, 1, 2)),
+                risc_pulse(Int(0, 1, 2)),
                 risc_rst(Int(0, 1, 2)),
                 tx_send_trig(Int(0, 1, 2)),
                 monitor_read_on(Int(0, 1, 2)),
+                monitor_write_on(Int(0, 1, 2)),
+                rx_overflow(Int(0, 1, 2)),
+                bp_en(Int(0, n_breakpoints, 10)),
+                wp_mem_write(Int(0, n_watchpoints, 10)),
+                wp_mem_read(Int(0, n_watchpoints, 10)),
+                wp_reg_write(Int(0, n_watchpoints, 10)),
+                dump_delta(Int(0, 1, 2)),
+                dump_wide(Int(0, 1, 2)),
+                reg_dirty(Int(0, 32, 10)),
+                reply_next(FSM_IDLE),
+                prot_framed(Int(0, 1, 2)),
+                frame_on(Int(0, 1, 2)),
+                frame_out_valid(Int(0, 1, 2)),
+                tx_body(Int(0, 1, 2)),
+                rx_seq(Int(0, 8, 10)),
+                trace_on(Int(0, 1, 2)),
+                trace_count(Int(0, trace_count.width, 10)),
+                trace_wr(Int(0, trace_depth_bits, 10)),
+                [perf_cnt[i](Int(0, 64, 10)) for i in range(len(perf_names))],
+                free_run(Int(0, 1, 2)),
+                halt_reason(Int(0, 8, 10)),
             ).Else(
-                rx_fifo_re(Int(0, 1, 2)),
-                risc_clk(Int(0, 1, 2)),
+                cmd_re(Int(0, 1, 2)),
+                risc_pulse(Int(0, 1, 2)),
                 risc_rst(Int(0, 1, 2)),
                 tx_send_trig(Int(0, 1, 2)),
+                frame_out_valid(Int(0, 1, 2)),
+                If(AndList(cmd_re, frame_on))(
+                    frame_out_data(frame_buf[frame_rd]),
+                    frame_out_valid(Int(1, 1, 2)),
+                    frame_rd(frame_rd + Int(1, frame_rd.width, 10))
+                ),
+                EmbeddedCode('// every byte sent is in the reply crc, which is cleared when the'),
+                EmbeddedCode('// header goes out'),
+                If(tx_send_trig)(
+                    tx_crc(tx_crc_next),
+                    If(frame_on)(
+                        tx_body(Int(1, 1, 2))
+                    )
+                ),
+                If(AndList(risc_ce, ~monitor_write_on, riscv_regwrite))(
+                    reg_dirty[riscv_rd](Int(1, 1, 2))
+                ),
+                If(trace_we)(
+                    trace_wr(trace_wr + Int(1, trace_depth_bits, 10)),
+                    If(~trace_count[trace_depth_bits])(
+                        trace_count(trace_count + Int(1, trace_count.width, 10))
+                    ),
+                    If(OrList(trace_triggered, trace_hit))(
+                        trace_triggered(Int(1, 1, 2)),
+                        If(trace_post == Int(1, 16, 10))(
+                            trace_on(Int(0, 1, 2))
+                        ),
+                        If(trace_post != Int(0, 16, 10))(
+                            trace_post(trace_post - Int(1, 16, 10))
+                        )
+                    )
+                ),
+                If(core_busy)(
+                    perf_cnt[PERF_CYCLES](perf_cnt[PERF_CYCLES] + Int(1, 64, 10)),
+                    If(riscv_step)(
+                        perf_cnt[PERF_INSTRET](perf_cnt[PERF_INSTRET] + Int(1, 64, 10)),
+                        If(riscv_branch_taken)(
+                            perf_cnt[PERF_BRANCHES](perf_cnt[PERF_BRANCHES] + Int(1, 64, 10))
+                        ),
+                        If(riscv_memread)(
+                            perf_cnt[PERF_LOADS](perf_cnt[PERF_LOADS] + Int(1, 64, 10))
+                        ),
+                        If(riscv_memwrite)(
+                            perf_cnt[PERF_STORES](perf_cnt[PERF_STORES] + Int(1, 64, 10))
+                        )
+                    ).Else(
+                        perf_cnt[PERF_STALLS](perf_cnt[PERF_STALLS] + Int(1, 64, 10))
+                    )
+                ),
+                If(free_run)(
+                    If(free_stop)(
+                        free_run(Int(0, 1, 2)),
+                        halt_reason(Cat(bp_hit | wp_hit, Int(0, 2, 10), Uor(wp_hit), Uor(bp_hit)))
+                    ).Else(
+                        run_steps(run_steps + Int(1, run_steps.width, 10))
+                    )
+                ),
                 Case(fsm_io)(
                     When(FSM_IDLE)(
-                        If(~rx_fifo_empty)(
-                            rx_fifo_re(Int(1, 1, 2)),
+                        If(frame_on)(
+                            EmbeddedCode('// one command per frame'),
+                            If(frame_done)(
+                                fsm_io(FSM_FRAME_END)
+                            ).Else(
+                                cmd_re(Int(1, 1, 2)),
+                                frame_done(Int(1, 1, 2)),
+                                fsm_io(FSM_DECODE_PROTOCOL)
+                            )
+                        ).Elif(~rx_fifo_empty)(
+                            cmd_re(Int(1, 1, 2)),
                             fsm_io(FSM_DECODE_PROTOCOL)
                         )
                     ),
                     When(FSM_DECODE_PROTOCOL)(
-                        If(rx_fifo_out_valid)(
-                            Case(rx_fifo_out_data)(
+                        If(AndList(cmd_valid, ~frame_on, cmd_data == FRAME_SYNC))(
+                            prot_framed(Int(1, 1, 2)),
+                            rx_crc(FRAME_SYNC_CRC),
+                            arg_cnt(Int(1, arg_cnt.width, 10)),
+                            arg_next(FSM_FRAME_SEQ),
+                            fsm_io(FSM_READ_ARG)
+                        ).Elif(AndList(cmd_valid, ~frame_on, prot_framed))(
+                            fsm_io(FSM_IDLE)
+                        ).Elif(cmd_valid)(
+                            If(AndList(free_run, ~cmd_passive, ~free_stop))(
+                                free_run(Int(0, 1, 2)),
+                                halt_reason(Int(0, 8, 10))
+                            ),
+                            Case(cmd_data)(
                                 When(PROT_PC_B_RESET)(
                                     fsm_io(FSM_RESET)
                                 ),
                                 When(PROT_PC_B_CLOCK)(
                                     fsm_io(FSM_EXEC_CLOCK)
                                 ),
+                                When(PROT_PC_B_DUMP)(
+                                    fsm_io(FSM_SEND_REG_TAM)
+                                ),
+                                When(PROT_PC_B_RUN)(
+                                    arg_cnt(Int(4, arg_cnt.width, 10)),
+                                    arg_next(FSM_RUN_LOAD),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_SET_BP)(
+                                    arg_cnt(Int(5, arg_cnt.width, 10)),
+                                    arg_next(FSM_SET_BP),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_RUN_UNTIL)(
+                                    arg_cnt(Int(4, arg_cnt.width, 10)),
+                                    arg_next(FSM_RUN_UNTIL_LOAD),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_SET_WP)(
+                                    arg_cnt(Int(5, arg_cnt.width, 10)),
+                                    arg_next(FSM_SET_WP),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_DUMP_MODE)(
+                                    arg_cnt(Int(1, arg_cnt.width, 10)),
+                                    arg_next(FSM_SET_DUMP_MODE),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_READ_MEM)(
+                                    arg_cnt(Int(5, arg_cnt.width, 10)),
+                                    arg_next(FSM_SEND_MEM_TAM),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_WRITE_MEM)(
+                                    arg_cnt(Int(6, arg_cnt.width, 10)),
+                                    arg_next(FSM_WRITE_MEM),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_SET_TRIGGER)(
+                                    arg_cnt(Int(7, arg_cnt.width, 10)),
+                                    arg_next(FSM_SET_TRIGGER),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_READ_TRACE)(
+                                    arg_cnt(Int(3, arg_cnt.width, 10)),
+                                    arg_next(FSM_TRACE_TAM),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_READ_COUNTERS)(
+                                    arg_cnt(Int(1, arg_cnt.width, 10)),
+                                    arg_next(FSM_COUNTERS_TAM),
+                                    fsm_io(FSM_READ_ARG)
+                                ),
+                                When(PROT_PC_B_RUN_FREE)(
+                                    free_run(Int(1, 1, 2)),
+                                    halt_reason(Int(0, 8, 10)),
+                                    run_steps(Int(0, run_steps.width, 10)),
+                                    fsm_io(FSM_IDLE)
+                                ),
+                                When(PROT_PC_B_HALT)(
+                                    free_run(Int(0, 1, 2)),
+                                    If(AndList(free_run, ~free_stop))(
+                                        halt_reason(Int(0, 8, 10))
+                                    ),
+                                    fsm_io(FSM_STATUS)
+                                ),
+                                When(PROT_PC_B_STATUS)(
+                                    fsm_io(FSM_STATUS)
+                                ),
+                                When(PROT_PC_B_CREDIT)(
+                                    reply_data(Cat(Int(0, 40, 10), Int(0, 7, 10), rx_overflow,
+                                                   rx_fifo_free, Int(2, 8, 10))),
+                                    reply_cnt(Int(3, reply_cnt.width, 10)),
+                                    rx_overflow(Int(0, 1, 2)),
+                                    fsm_io(FSM_SEND_REPLY)
+                                ),
                                 When()(
                                     fsm_io(FSM_IDLE)
                                 ),
@@ -525,17 +1046,20 @@ class Components:
                     ),
                     When(FSM_RESET)(
                         risc_rst(Int(1, 1, 2)),
-                        risc_clk(Int(1, 1, 2)),
+                        risc_pulse(Int(1, 1, 2)),
                         fsm_io(FSM_IDLE)
                     ),
                     When(FSM_EXEC_CLOCK)(
-                        risc_clk(Int(1, 1, 2)),
+                        risc_pulse(Int(1, 1, 2)),
                         fsm_io(FSM_SEND_REG_TAM)
                     ),
                     When(FSM_SEND_REG_TAM)(
-                        If(~tx_bsy)(
+                        If(dump_delta)(
+                            fsm_io(FSM_DELTA_LATCH)
+                        ).Elif(tx_ready)(
                             tx_send_trig(Int(1, 1, 2)),
-                            tx_send_data(Int(monitor_tam, 8, 10)),
+                            tx_send_data(Mux(dump_wide, Int(monitor_tam * 4 + 4, 8, 10),
+                                             Int(monitor_tam, 8, 10))),
                             monitor_addr(Int(0, monitor_addr.width, 10)),
                             fsm_io(FSM_SEND_REG_DATA)
                         ),
@@ -543,31 +1067,50 @@ class Components:
                     When(FSM_SEND_REG_DATA)(
                         If(monitor_addr == monitor_tam)(
                             monitor_read_on(Int(0, 1, 2)),
-                            fsm_io(FSM_IDLE)
+                            If(dump_wide)(
+                                reply_data(Cat(Int(0, 64, 10), riscv_pc)),
+                                reply_cnt(Int(4, reply_cnt.width, 10)),
+                                fsm_io(FSM_SEND_REPLY)
+                            ).Else(
+                                fsm_io(FSM_IDLE)
+                            )
                         ).Else(
                             monitor_read_on(Int(1, 1, 2)),
                             fsm_io(FSM_SEND_REG_BYTES)
                         )
                     ),
                     When(FSM_SEND_REG_BYTES)(
-                        If(~tx_bsy)(
+                        If(dump_wide)(
+                            EmbeddedCode('// SEND_REPLY shifts the word out and comes back'),
                             monitor_addr(monitor_addr +
                                          Int(1, monitor_addr.width, 10)),
-                            tx_send_trig(1),
-                            tx_send_data(reg_dataout),
-                            fsm_io(FSM_SEND_REG_DATA)
+                            reply_data(Cat(Int(0, 64, 10), reg_dataout)),
+                            reply_cnt(Int(4, reply_cnt.width, 10)),
+                            reply_next(FSM_SEND_REG_DATA),
+                            fsm_io(FSM_SEND_REPLY)
+                        ).Elif(tx_ready)(
+                            EmbeddedCode('// reg_dataout follows monitor_addr: a byte per clock'),
+                            monitor_addr(monitor_addr +
+                                         Int(1, monitor_addr.width, 10)),
+                            tx_send_trig(Int(1, 1, 2)),
+                            tx_send_data(reg_dataout[0:8]),
+                            If(monitor_addr == monitor_tam - 1)(
+                                fsm_io(FSM_SEND_REG_DATA)
+                            )
                         ),
                     ),
                     When(FSM_SEND_MEM_TAM)(
-                        If(~tx_bsy)(
+                        EmbeddedCode('// arguments: addr in arg_data[55:24], n words in arg_data[63:56]'),
+                        If(tx_ready)(
                             tx_send_trig(Int(1, 1, 2)),
-                            tx_send_data(Int(monitor_tam, 8, 10)),
-                            monitor_addr(Int(0, monitor_addr.width, 10)),
+                            tx_send_data(Cat(arg_data[56:62], Int(0, 2, 10))),
+                            monitor_addr(arg_data[24:56]),
+                            mem_cnt(arg_data[56:62]),
                             fsm_io(FSM_SEND_MEM_DATA)
                         ),
                     ),
                     When(FSM_SEND_MEM_DATA)(
-                        If(monitor_addr == monitor_tam)(
+                        If(mem_cnt == Int(0, mem_cnt.width, 10))(
                             monitor_read_on(Int(0, 1, 2)),
                             fsm_io(FSM_IDLE)
                         ).Else(
@@ -576,17 +1119,332 @@ class Components:
                         )
                     ),
                     When(FSM_SEND_MEM_BYTES)(
-                        If(~tx_bsy)(
-                            monitor_addr(monitor_addr +
-                                         Int(1, monitor_addr.width, 10)),
-                            tx_send_trig(1),
-                            tx_send_data(mem_dataout),
-                            fsm_io(FSM_SEND_MEM_DATA)
+                        monitor_addr(monitor_addr + Int(4, monitor_addr.width, 10)),
+                        mem_cnt(mem_cnt - Int(1, mem_cnt.width, 10)),
+                        reply_data(Cat(Int(0, 64, 10), mem_dataout)),
+                        reply_cnt(Int(4, reply_cnt.width, 10)),
+                        reply_next(FSM_SEND_MEM_DATA),
+                        fsm_io(FSM_SEND_REPLY)
+                    ),
+                    When(FSM_SEND_REPLY)(
+                        If(tx_ready)(
+                            tx_send_trig(Int(1, 1, 2)),
+                            tx_send_data(reply_data[0:8]),
+                            reply_data(reply_data >> 8),
+                            reply_cnt(reply_cnt - Int(1, reply_cnt.width, 10)),
+                            If(reply_cnt == Int(1, reply_cnt.width, 10))(
+                                fsm_io(reply_next),
+                                reply_next(FSM_IDLE)
+                            )
+                        ),
+                    ),
+                    When(FSM_READ_ARG)(
+                        If(~cmd_empty)(
+                            cmd_re(Int(1, 1, 2)),
+                            fsm_io(FSM_WAIT_ARG)
+                        )
+                    ),
+                    When(FSM_WAIT_ARG)(
+                        If(cmd_valid)(
+                            arg_data(Cat(cmd_data, arg_data[8:arg_data.width])),
+                            arg_cnt(arg_cnt - Int(1, arg_cnt.width, 10)),
+                            If(arg_cnt == Int(1, arg_cnt.width, 10))(
+                                fsm_io(arg_next)
+                            ).Else(
+                                fsm_io(FSM_READ_ARG)
+                            )
+                        )
+                    ),
+                    When(FSM_RUN_LOAD)(
+                        run_cnt(arg_data[32:64]),
+                        fsm_io(FSM_RUN)
+                    ),
+                    When(FSM_RUN)(
+                        EmbeddedCode('// risc_ce steps the core on every clock run_cnt is not 0'),
+                        If(run_cnt == Int(0, run_cnt.width, 10))(
+                            fsm_io(FSM_SEND_REG_TAM)
+                        ).Else(
+                            run_cnt(run_cnt - Int(1, run_cnt.width, 10))
+                        )
+                    ),
+                    When(FSM_SET_BP)(
+                        bp_addr[arg_data[24:24 + ceil(log2(n_breakpoints))]](arg_data[32:64]),
+                        bp_en[arg_data[24:24 + ceil(log2(n_breakpoints))]](arg_data[31]),
+                        fsm_io(FSM_IDLE)
+                    ),
+                    When(FSM_SET_WP)(
+                        wp_addr[arg_data[24:24 + ceil(log2(n_watchpoints))]](arg_data[32:64]),
+                        wp_mem_write[arg_data[24:24 + ceil(log2(n_watchpoints))]](
+                            AndList(arg_data[31], arg_data[28])),
+                        wp_mem_read[arg_data[24:24 + ceil(log2(n_watchpoints))]](
+                            AndList(arg_data[31], arg_data[29])),
+                        wp_reg_write[arg_data[24:24 + ceil(log2(n_watchpoints))]](
+                            AndList(arg_data[31], arg_data[30])),
+                        fsm_io(FSM_IDLE)
+                    ),
+                    When(FSM_SET_DUMP_MODE)(
+                        dump_delta(arg_data[56]),
+                        dump_wide(arg_data[57]),
+                        reg_dirty(Int(2 ** 32 - 1, 32, 16)),
+                        fsm_io(FSM_IDLE)
+                    ),
+                    When(FSM_DELTA_LATCH)(
+                        EmbeddedCode('// a cycle after the last step reg_dirty is up to date'),
+                        delta_mask(reg_dirty),
+                        reg_dirty(Int(0, 32, 10)),
+                        reply_data(Cat(Int(0, 56, 10), reg_dirty, delta_tam)),
+                        reply_cnt(Int(5, reply_cnt.width, 10)),
+                        reply_next(FSM_DELTA_SCAN),
+                        monitor_addr(Int(0, monitor_addr.width, 10)),
+                        fsm_io(FSM_SEND_REPLY)
+                    ),
+                    When(FSM_DELTA_SCAN)(
+                        If(monitor_addr == monitor_tam)(
+                            monitor_read_on(Int(0, 1, 2)),
+                            If(dump_wide)(
+                                reply_data(Cat(Int(0, 64, 10), riscv_pc)),
+                                reply_cnt(Int(4, reply_cnt.width, 10)),
+                                fsm_io(FSM_SEND_REPLY)
+                            ).Else(
+                                fsm_io(FSM_IDLE)
+                            )
+                        ).Elif(delta_mask[monitor_addr[0:5]])(
+                            monitor_read_on(Int(1, 1, 2)),
+                            fsm_io(FSM_DELTA_BYTES)
+                        ).Else(
+                            monitor_addr(monitor_addr + Int(1, monitor_addr.width, 10))
+                        )
+                    ),
+                    When(FSM_DELTA_BYTES)(
+                        If(dump_wide)(
+                            monitor_addr(monitor_addr + Int(1, monitor_addr.width, 10)),
+                            reply_data(Cat(Int(0, 64, 10), reg_dataout)),
+                            reply_cnt(Int(4, reply_cnt.width, 10)),
+                            reply_next(FSM_DELTA_SCAN),
+                            fsm_io(FSM_SEND_REPLY)
+                        ).Elif(tx_ready)(
+                            monitor_addr(monitor_addr + Int(1, monitor_addr.width, 10)),
+                            tx_send_trig(Int(1, 1, 2)),
+                            tx_send_data(reg_dataout[0:8]),
+                            fsm_io(FSM_DELTA_SCAN)
+                        )
+                    ),
+                    When(FSM_WRITE_MEM)(
+                        EmbeddedCode('// target arg_data[23:16], addr arg_data[55:24], n words arg_data[63:56]'),
+                        monitor_write_inst(arg_data[16:24] == Int(0, 8, 10)),
+                        monitor_addr(arg_data[24:56]),
+                        write_cnt(arg_data[56:64]),
+                        write_total(arg_data[56:64]),
+                        If(arg_data[56:64] == Int(0, 8, 10))(
+                            reply_data(Cat(Int(0, 80, 10), Int(1, 8, 10))),
+                            reply_cnt(Int(2, reply_cnt.width, 10)),
+                            fsm_io(FSM_SEND_REPLY)
+                        ).Else(
+                            arg_cnt(Int(4, arg_cnt.width, 10)),
+                            arg_next(FSM_WRITE_WORD),
+                            fsm_io(FSM_READ_ARG)
+                        )
+                    ),
+                    When(FSM_WRITE_WORD)(
+                        monitor_data(arg_data[32:64]),
+                        monitor_write_on(Int(1, 1, 2)),
+                        fsm_io(FSM_WRITE_PULSE)
+                    ),
+                    When(FSM_WRITE_PULSE)(
+                        risc_pulse(Int(1, 1, 2)),
+                        fsm_io(FSM_WRITE_NEXT)
+                    ),
+                    When(FSM_WRITE_NEXT)(
+                        monitor_write_on(Int(0, 1, 2)),
+                        monitor_addr(monitor_addr + Int(4, monitor_addr.width, 10)),
+                        write_cnt(write_cnt - Int(1, write_cnt.width, 10)),
+                        If(write_cnt == Int(1, write_cnt.width, 10))(
+                            reply_data(Cat(Int(0, 80, 10), write_total, Int(1, 8, 10))),
+                            reply_cnt(Int(2, reply_cnt.width, 10)),
+                            fsm_io(FSM_SEND_REPLY)
+                        ).Else(
+                            arg_cnt(Int(4, arg_cnt.width, 10)),
+                            arg_next(FSM_WRITE_WORD),
+                            fsm_io(FSM_READ_ARG)
+                        )
+                    ),
+                    When(FSM_RUN_UNTIL_LOAD)(
+                        run_cnt(arg_data[32:64]),
+                        run_steps(Int(0, run_steps.width, 10)),
+                        fsm_io(FSM_RUN_UNTIL)
+                    ),
+                    When(FSM_RUN_UNTIL)(
+                        EmbeddedCode('// the first clock may leave a breakpoint the last run stopped on;'),
+                        EmbeddedCode('// risc_ce steps the core on the clocks that take the Else'),
+                        If(AndList(core_hit, run_steps != Int(0, run_steps.width, 10)))(
+                            reply_data(Cat(run_steps, riscv_pc, bp_hit | wp_hit, Int(0, 2, 10),
+                                           Uor(wp_hit), Uor(bp_hit), Int(9, 8, 10))),
+                            reply_cnt(Int(10, reply_cnt.width, 10)),
+                            fsm_io(FSM_SEND_REPLY)
+                        ).Elif(run_cnt == Int(0, run_cnt.width, 10))(
+                            reply_data(Cat(run_steps, riscv_pc, Int(0, 8, 10), Int(9, 8, 10))),
+                            reply_cnt(Int(10, reply_cnt.width, 10)),
+                            fsm_io(FSM_SEND_REPLY)
+                        ).Else(
+                            run_cnt(run_cnt - Int(1, run_cnt.width, 10)),
+                            run_steps(run_steps + Int(1, run_steps.width, 10))
+                        )
+                    ),
+                    When(FSM_SET_TRIGGER)(
+                        EmbeddedCode('// mode arg_data[15:8], pc arg_data[47:16], post arg_data[63:48]'),
+                        trace_mode(arg_data[8:16]),
+                        trace_pc(arg_data[16:48]),
+                        trace_post(arg_data[48:64]),
+                        trace_on(arg_data[8]),
+                        If(arg_data[8])(
+                            trace_wr(Int(0, trace_depth_bits, 10)),
+                            trace_count(Int(0, trace_count.width, 10)),
+                            trace_triggered(~Uor(arg_data[9:11]))
                         ),
+                        fsm_io(FSM_IDLE)
+                    ),
+                    When(FSM_TRACE_TAM)(
+                        EmbeddedCode('// first entry arg_data[55:40], n arg_data[63:56]; the oldest'),
+                        EmbeddedCode('// entry is trace_count entries behind trace_wr'),
+                        trace_rd(trace_wr - trace_count[0:trace_depth_bits] + arg_data[40:40 + trace_depth_bits]),
+                        trace_left(arg_data[56:64]),
+                        reply_data(Cat(Int(0, 64, 10), Int(0, 6, 10), trace_triggered, trace_on,
+                                       Int(0, 16 - trace_count.width, 10), trace_count,
+                                       (arg_data[56:64] << 3) + (arg_data[56:64] << 2) + Int(4, 8, 10))),
+                        reply_cnt(Int(5, reply_cnt.width, 10)),
+                        reply_next(FSM_TRACE_DATA),
+                        fsm_io(FSM_SEND_REPLY)
+                    ),
+                    When(FSM_TRACE_DATA)(
+                        EmbeddedCode('// trace_out reads trace_rd in the next clock'),
+                        If(trace_left == Int(0, 8, 10))(
+                            fsm_io(FSM_IDLE)
+                        ).Else(
+                            fsm_io(FSM_TRACE_WORD)
+                        )
+                    ),
+                    When(FSM_TRACE_WORD)(
+                        trace_rd(trace_rd + Int(1, trace_depth_bits, 10)),
+                        trace_left(trace_left - Int(1, 8, 10)),
+                        reply_data(trace_out),
+                        reply_cnt(Int(12, reply_cnt.width, 10)),
+                        reply_next(FSM_TRACE_DATA),
+                        fsm_io(FSM_SEND_REPLY)
+                    ),
+                    When(FSM_STATUS)(
+                        reply_data(Cat(run_steps, riscv_pc, halt_reason[4:8], free_run,
+                                       halt_reason[0:3], Int(9, 8, 10))),
+                        reply_cnt(Int(10, reply_cnt.width, 10)),
+                        fsm_io(FSM_SEND_REPLY)
+                    ),
+                    When(FSM_COUNTERS_TAM)(
+                        perf_idx(Int(0, perf_idx.width, 10)),
+                        [perf_snap[i](perf_cnt[i]) for i in range(len(perf_names))],
+                        EmbeddedCode('// cleared on the clock of the snapshot'),
+                        If(arg_data[56])(
+                            [perf_cnt[i](Int(0, 64, 10)) for i in range(len(perf_names))]
+                        ),
+                        reply_data(Int(8 * len(perf_names), reply_data.width, 10)),
+                        reply_cnt(Int(1, reply_cnt.width, 10)),
+                        reply_next(FSM_COUNTERS_DATA),
+                        fsm_io(FSM_SEND_REPLY)
+                    ),
+                    When(FSM_COUNTERS_DATA)(
+                        If(perf_idx == len(perf_names))(
+                            fsm_io(FSM_IDLE)
+                        ).Else(
+                            perf_idx(perf_idx + Int(1, perf_idx.width, 10)),
+                            reply_data(Cat(Int(0, 32, 10), perf_snap[perf_idx])),
+                            reply_cnt(Int(8, reply_cnt.width, 10)),
+                            reply_next(FSM_COUNTERS_DATA),
+                            fsm_io(FSM_SEND_REPLY)
+                        )
+                    ),
+                    When(FSM_FRAME_SEQ)(
+                        frame_seq(rx_byte),
+                        rx_crc(rx_crc_next),
+                        arg_cnt(Int(1, arg_cnt.width, 10)),
+                        arg_next(FSM_FRAME_LEN),
+                        fsm_io(FSM_READ_ARG)
+                    ),
+                    When(FSM_FRAME_LEN)(
+                        rx_crc(rx_crc_next),
+                        frame_resync(rx_byte[7]),
+                        frame_len(rx_byte[0:6]),
+                        frame_wr(Int(0, frame_wr.width, 10)),
+                        If(OrList(rx_byte[0:6] == Int(0, 6, 10), rx_byte[0:6] > FRAME_MAX))(
+                            tx_crc(Int(0, 8, 10)),
+                            tx_body(Int(0, 1, 2)),
+                            reply_data(Cat(Int(0, 72, 10), FRAME_NAK_CRC, rx_seq, FRAME_SYNC)),
+                            reply_cnt(Int(3, reply_cnt.width, 10)),
+                            reply_next(FSM_FRAME_END),
+                            fsm_io(FSM_SEND_REPLY)
+                        ).Else(
+                            fsm_io(FSM_FRAME_DATA)
+                        )
+                    ),
+                    When(FSM_FRAME_DATA)(
+                        arg_cnt(Int(1, arg_cnt.width, 10)),
+                        arg_next(Mux(frame_wr == frame_len, FSM_FRAME_CHECK, FSM_FRAME_STORE)),
+                        fsm_io(FSM_READ_ARG)
+                    ),
+                    When(FSM_FRAME_STORE)(
+                        frame_buf[frame_wr[0:rx_fifo_depth_bits]](rx_byte),
+                        rx_crc(rx_crc_next),
+                        frame_wr(frame_wr + Int(1, frame_wr.width, 10)),
+                        fsm_io(FSM_FRAME_DATA)
+                    ),
+                    When(FSM_FRAME_CHECK)(
+                        EmbeddedCode('// rx_byte is the crc byte of the frame'),
+                        EmbeddedCode('// a new header: no body has gone out behind it yet'),
+                        tx_crc(Int(0, 8, 10)),
+                        tx_body(Int(0, 1, 2)),
+                        reply_cnt(Int(3, reply_cnt.width, 10)),
+                        fsm_io(FSM_SEND_REPLY),
+                        If(rx_byte != rx_crc)(
+                            reply_data(Cat(Int(0, 72, 10), FRAME_NAK_CRC, rx_seq, FRAME_SYNC)),
+                            reply_next(FSM_FRAME_END)
+                        ).Elif(AndList(frame_seq != rx_seq, ~frame_resync))(
+                            reply_data(Cat(Int(0, 72, 10), FRAME_NAK_SEQ, rx_seq, FRAME_SYNC)),
+                            reply_next(FSM_FRAME_END)
+                        ).Else(
+                            rx_seq(frame_seq + Int(1, 8, 10)),
+                            reply_data(Cat(Int(0, 72, 10), FRAME_ACK, frame_seq, FRAME_SYNC)),
+                            reply_next(FSM_FRAME_EXEC)
+                        )
+                    ),
+                    When(FSM_FRAME_EXEC)(
+                        frame_on(Int(1, 1, 2)),
+                        frame_done(Int(0, 1, 2)),
+                        frame_rd(Int(0, frame_rd.width, 10)),
+                        fsm_io(FSM_IDLE)
+                    ),
+                    When(FSM_FRAME_END)(
+                        EmbeddedCode('// commands without a reply, and naks, answer with tam 0'),
+                        frame_on(Int(0, 1, 2)),
+                        If(tx_body)(
+                            fsm_io(FSM_FRAME_CRC)
+                        ).Else(
+                            reply_data(Int(0, reply_data.width, 10)),
+                            reply_cnt(Int(1, reply_cnt.width, 10)),
+                            reply_next(FSM_FRAME_CRC),
+                            fsm_io(FSM_SEND_REPLY)
+                        )
+                    ),
+                    When(FSM_FRAME_CRC)(
+                        EmbeddedCode('// ~send_trig: the crc has taken in the last byte pushed'),
+                        If(AndList(tx_ready, ~tx_send_trig))(
+                            tx_send_trig(Int(1, 1, 2)),
+                            tx_send_data(tx_crc),
+                            fsm_io(FSM_IDLE)
+                        )
                     ),
                     When()(
                         fsm_io(FSM_IDLE)
                     )
+                ),
+                If(AndList(rx_fifo_we, rx_fifo_full))(
+                    rx_overflow(Int(1, 1, 2))
                 )
             )
         )
@@ -594,7 +1452,7 @@ class Components:
         m_aux = self.create_fifo()
         par = [
             ('FIFO_WIDTH', 8),
-            ('FIFO_DEPTH_BITS', 5)
+            ('FIFO_DEPTH_BITS', rx_fifo_depth_bits)
         ]
         con = [
             ('clk', clk),
@@ -604,10 +1462,30 @@ class Components:
             ('re', rx_fifo_re),
             ('out_valid', rx_fifo_out_valid),
             ('out_data', rx_fifo_out_data),
-            ('empty', rx_fifo_empty)
+            ('empty', rx_fifo_empty),
+            ('full', rx_fifo_full),
+            ('data_count', rx_fifo_count)
         ]
         m.Instance(m_aux, 'rx_%s' % m_aux.name, par, con)
 
+        par = [
+            ('FIFO_WIDTH', 8),
+            ('FIFO_DEPTH_BITS', tx_fifo_depth_bits)
+        ]
+        con = [
+            ('clk', clk),
+            ('rst', rst),
+            ('we', tx_fifo_we),
+            ('in_data', tx_fifo_in_data),
+            ('re', tx_fifo_re),
+            ('out_valid', tx_fifo_out_valid),
+            ('out_data', tx_fifo_out_data),
+            ('empty', tx_fifo_empty),
+            ('full', tx_fifo_full),
+            ('almostfull', tx_fifo_almostfull)
+        ]
+        m.Instance(m_aux, 'tx_%s' % m_aux.name, par, con)
+
         m_aux = self.create_uart_rx()
         par = []
         con = [
@@ -626,8 +1504,8 @@ class Components:
         con = [
             ('clk', clk),
             ('rst', rst),
-            ('send_trig', tx_send_trig),
-            ('send_data', tx_send_data),
+            ('send_trig', tx_fifo_out_valid),
+            ('send_data', tx_fifo_out_data),
             ('tx', tx),
             ('tx_bsy', tx_bsy),
         ]
@@ -636,12 +1514,25 @@ class Components:
         aux = riscv.get_riscv()
         par = []
         con = [
-            ('clk', risc_clk),
+            ('clk', clk),
+            ('ce', risc_ce),
             ('rst', risc_rst),
             ('monitor_read_on', monitor_read_on),
+            ('monitor_write_on', monitor_write_on),
+            ('monitor_write_inst', monitor_write_inst),
             ('monitor_addr', monitor_addr),
+            ('monitor_data', monitor_data),
             ('mem_dataout', mem_dataout),
             ('reg_dataout', reg_dataout),
+            ('pc', riscv_pc),
+            ('inst', riscv_inst),
+            ('writedata', riscv_writedata),
+            ('branch_taken', riscv_branch_taken),
+            ('regwrite', riscv_regwrite),
+            ('rd', riscv_rd),
+            ('memread', riscv_memread),
+            ('memwrite', riscv_memwrite),
+            ('maddr', riscv_maddr),
         ]
 
         m.Instance(aux, aux.name, par, con)
@@ -1,6 +1,7 @@
+import argparse
 from veriloggen import *
 import util as _u
-from components import Components
+from components import Components, MIN_CLOCKS_PER_BIT
 
 
 class Interface:
@@ -12,16 +13,47 @@ class Interface:
             serial_width:int=8,
             ram_depth: int = 5,
             inst_ram_depth: int = 6,
+            baudrate: float = 3.0,
+            pll_clock: float = None,
+            tx_fifo_depth: int = 8,
+            trace_depth: int = 10
     ):
         self.data_width = data_width
         self.ram_depth = ram_depth
         self.inst_ram_depth = inst_ram_depth
         self.serial_width = serial_width
         self.fifo_depth = 2
+        # Mbaud, and the MHz an rPLL should make of the 27 MHz crystal
+        # (None: no PLL, everything runs at 27 MHz)
+        self.baudrate = baudrate
+        self.pll_clock = pll_clock
+        self.crystal = 27.0
+        self.tx_fifo_depth = tx_fifo_depth
+        self.trace_depth = trace_depth
 
     def get(self):
         return self.__create_interface()
 
+    def pll_dividers(self, target: float) -> tuple:
+        '''
+            GW1NR-9 rPLL: clkout = fclkin * (FBDIV_SEL + 1) / (IDIV_SEL + 1),
+            fclkin / (IDIV_SEL + 1) >= 3 MHz, clkout * ODIV_SEL in 400..1200 MHz.
+            Returns (IDIV_SEL, FBDIV_SEL, ODIV_SEL, clkout) closest to target
+        '''
+        best = None
+        for idiv in range(64):
+            if self.crystal / (idiv + 1) < 3.0:
+                break
+            for fbdiv in range(64):
+                clkout = self.crystal * (fbdiv + 1) / (idiv + 1)
+                odiv = [d for d in (2, 4, 8, 16, 32, 48, 64, 80, 96, 112, 128)
+                        if 400.0 <= clkout * d <= 1200.0]
+                if not odiv or clkout > 600.0:
+                    continue
+                if best is None or abs(clkout - target) < abs(best[3] - target):
+                    best = (idiv, fbdiv, odiv[0], clkout)
+        return best
+
     '''
     led[0] - rx
     led[1] - rx_bsy
@@ -37,7 +69,6 @@ class Interface:
         ram_depth = self.ram_depth
         inst_ram_depth = self.inst_ram_depth
         fifo_depth = self.fifo_depth
-        comp = Components()
 
         m = Module(
             "tang_nano_9k_riscv_monitor")
@@ -47,10 +78,65 @@ class Interface:
         led = m.Output('led', 6)
         uart_tx = m.Output('uart_tx')
 
+        sys_clk = clk
+        sys_clock = self.crystal
+        pll_lock = None
+        if self.pll_clock is not None:
+            idiv, fbdiv, odiv, sys_clock = self.pll_dividers(self.pll_clock)
+            m.EmbeddedCode('// rPLL: %gMHz = 27MHz * %d / %d' % (sys_clock, fbdiv + 1, idiv + 1))
+            sys_clk = m.Wire('sys_clk')
+            pll_lock = m.Wire('pll_lock')
+            par = [
+                ('FCLKIN', '27'),
+                ('DYN_IDIV_SEL', 'false'),
+                ('IDIV_SEL', idiv),
+                ('DYN_FBDIV_SEL', 'false'),
+                ('FBDIV_SEL', fbdiv),
+                ('DYN_ODIV_SEL', 'false'),
+                ('ODIV_SEL', odiv),
+                ('PSDA_SEL', '0000'),
+                ('DYN_DA_EN', 'true'),
+                ('DUTYDA_SEL', '1000'),
+                ('CLKOUT_FT_DIR', Int(1, 1, 2)),
+                ('CLKOUTP_FT_DIR', Int(1, 1, 2)),
+                ('CLKOUT_DLY_STEP', 0),
+                ('CLKOUTP_DLY_STEP', 0),
+                ('CLKFB_SEL', 'internal'),
+                ('CLKOUT_BYPASS', 'false'),
+                ('CLKOUTP_BYPASS', 'false'),
+                ('CLKOUTD_BYPASS', 'false'),
+                ('DYN_SDIV_SEL', 2),
+                ('CLKOUTD_SRC', 'CLKOUT'),
+                ('CLKOUTD3_SRC', 'CLKOUT'),
+                ('DEVICE', 'GW1NR-9C'),
+            ]
+            con = [
+                ('CLKOUT', sys_clk),
+                ('LOCK', pll_lock),
+                ('RESET', Int(0, 1, 2)),
+                ('RESET_P', Int(0, 1, 2)),
+                ('CLKIN', clk),
+                ('CLKFB', Int(0, 1, 2)),
+                ('FBDSEL', Int(0, 6, 10)),
+                ('IDSEL', Int(0, 6, 10)),
+                ('ODSEL', Int(0, 6, 10)),
+                ('PSDA', Int(0, 4, 10)),
+                ('DUTYDA', Int(0, 4, 10)),
+                ('FDLY', Int(0, 4, 10)),
+            ]
+            m.Instance(StubModule('rPLL'), 'pll', par, con)
+            m.EmbeddedCode('')
+        comp = Components(sys_clock=sys_clock, baudrate=self.baudrate,
+                          tx_fifo_depth=self.tx_fifo_depth, trace_depth=self.trace_depth)
+
         m.EmbeddedCode('// Reset signal control')
         rst = m.Wire('rst')
         running = m.Wire('running')
-        rst.assign(~btn_rst)
+        if pll_lock is None:
+            rst.assign(~btn_rst)
+        else:
+            m.EmbeddedCode('// held in reset until the PLL locked')
+            rst.assign(OrList(~btn_rst, ~pll_lock))
         running.assign(~rst)
 
         m.EmbeddedCode('')
@@ -84,8 +170,8 @@ class Interface:
         m_aux = comp.create_io_riscv_controller()
         par = []
         con = [
-            ('clk', clk),
-            ('rst', ~btn_rst),
+            ('clk', sys_clk),
+            ('rst', rst),
             ('rx', uart_rx),
             ('rx_bsy', rx_bsy),
             ('tx', uart_tx),
@@ -97,7 +183,28 @@ class Interface:
         return m
 
 
-interface = Interface()
+def create_args():
+    parser = argparse.ArgumentParser('interface -h')
+    parser.add_argument(
+        '-b', '--baudrate', help='UART Mbaud (the FT2232H takes 3, 6 and 12). The clock needs %d '
+        'cycles per bit: 27MHz goes up to 6, 12 needs -c 48 or more' % MIN_CLOCKS_PER_BIT, type=float, default=3.0)
+    parser.add_argument(
+        '-c', '--pll_clock', help='Run the design from an rPLL at about this MHz', type=float, default=None)
+    parser.add_argument(
+        '-t', '--tx_fifo_depth', help='TX fifo depth bits', type=int, default=8)
+    parser.add_argument(
+        '-T', '--trace_depth', help='Trace buffer depth bits (12 bytes an entry)', type=int, default=10)
+    args = parser.parse_args()
+    sys_clock = args.pll_clock if args.pll_clock is not None else 27.0
+    if sys_clock / args.baudrate < MIN_CLOCKS_PER_BIT:
+        parser.error('%gMbaud needs -c %g or more (%d clocks per bit)' % (
+            args.baudrate, args.baudrate * MIN_CLOCKS_PER_BIT, MIN_CLOCKS_PER_BIT))
+    return args
+
+
+args = create_args()
+interface = Interface(baudrate=args.baudrate, pll_clock=args.pll_clock,
+                      tx_fifo_depth=args.tx_fifo_depth, trace_depth=args.trace_depth)
 _int = interface.get()
 _int.to_verilog("riscv.v")
 # _int.to_verilog("./"+_int.name + ".v")
@@ -7,13 +7,29 @@ class Riscv:
     _instance = None
 
     def __init__(
-        self, data_width: int = 32, ram_depth: int = 5, inst_ram_depth: int = 6
+        self, data_width: int = 32, ram_depth: int = 5, inst_ram_depth: int = 6,
+        clock_enable: bool = False
     ):
         self.data_width = data_width
         self.ram_depth = ram_depth
         self.inst_ram_depth = inst_ram_depth
+        # with clock_enable every module with state gets a ce input and only
+        # moves on the clk edges that have it set, so the core can run on the
+        # system clock instead of a clock made out of logic
+        self.clock_enable = clock_enable
         self.cache = {}
 
+    def create_ce(self, m: Module):
+        if self.clock_enable:
+            return m.Input('ce')
+        return None
+
+    def ce_con(self, ce) -> list:
+        return [] if ce is None else [('ce', ce)]
+
+    def enabled(self, ce, statement):
+        return statement if ce is None else If(ce)(statement)
+
     def get_riscv(
         self, data_width: int = 32, ram_depth: int = 5, inst_ram_depth: int = 6
     ):
@@ -30,24 +46,34 @@ class Riscv:
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.create_ce(m)
         rst = m.Input("rst")
 
         monitor_read_on = m.Input('monitor_read_on')
         monitor_write_on = m.Input('monitor_write_on')
-        monitor_addr = m.Input('monitor_addr', 8)
-        mem_dataout = m.Output('mem_dataout', 8)
-        reg_dataout = m.Output('reg_dataout', 8)
+        monitor_write_inst = m.Input('monitor_write_inst')
+        monitor_addr = m.Input('monitor_addr', data_width)
+        monitor_data = m.Input('monitor_data', data_width)
+        mem_dataout = m.Output('mem_dataout', data_width)
+        reg_dataout = m.Output('reg_dataout', data_width)
+        m.EmbeddedCode('// debug: address of the instruction the next clock executes')
+        m.EmbeddedCode('// and the accesses it is going to make')
+        pc = m.Output('pc', data_width)
+        regwrite = m.Output('regwrite')
+        rd = m.Output('rd', 5)
+        m.EmbeddedCode('// and the instruction word and the value it writes back')
+        inst = m.Output('inst', data_width)
+        writedata = m.Output('writedata', data_width)
+        branch_taken = m.Output('branch_taken')
 
-        writedata = m.Wire('writedata', data_width)
-        inst = m.Wire('inst', data_width)
         sigext = m.Wire('sigext', data_width)
         data1 = m.Wire('data1', data_width)
         data2 = m.Wire('data2', data_width)
         aluout = m.Wire('aluout', data_width)
         readdata = m.Wire('readdata', data_width)
         zero = m.Wire('zero')
-        memread = m.Wire('memread')
-        memwrite = m.Wire('memwrite')
+        memread = m.Output('memread')
+        memwrite = m.Output('memwrite')
         memtoreg = m.Wire('memtoreg')
         branch = m.Wire('branch')
         alusrc = m.Wire('alusrc')
@@ -58,14 +84,20 @@ class Riscv:
             '// adaptacao para a interface serial controlar a execução do riscV')
         m.EmbeddedCode('// estágio de memoria')
         mrd = m.Wire('mrd')
-        maddr = m.Wire('maddr', data_width)
+        maddr = m.Output('maddr', data_width)
         mrd.assign(Uor(Cat(memread, monitor_read_on)))
-        maddr.assign(Mux(monitor_read_on, Cat(
-            Int(0, 24, 10), monitor_addr), aluout))
-        mem_dataout.assign(readdata[0:8])
+        maddr.assign(Mux(Uor(Cat(monitor_read_on, monitor_write_on)), monitor_addr, aluout))
+        mem_dataout.assign(readdata)
+        m.EmbeddedCode('// com monitor_write_on um pulso de clk grava monitor_data na memoria')
+        m.EmbeddedCode('// de instrucoes ou de dados; pc e banco de registradores ficam parados')
+        mwr = m.Wire('mwr')
+        mwdata = m.Wire('mwdata', data_width)
+        mwr.assign(Mux(monitor_write_on, ~monitor_write_inst, memwrite))
+        mwdata.assign(Mux(monitor_write_on, monitor_data, data2))
         m.EmbeddedCode('//*')
         m.EmbeddedCode('// estágio de decode')
-        reg_dataout.assign(data1[0:8])
+        reg_dataout.assign(data1)
+        branch_taken.assign(AndList(branch, zero))
         m.EmbeddedCode('//*')
         m.EmbeddedCode('//*****')
 
@@ -77,8 +109,13 @@ class Riscv:
             ('zero', zero),
             ('branch', branch),
             ('sigext', sigext),
-            ('inst', inst)
-        ]
+            ('inst', inst),
+            ('pc', pc),
+            ('monitor_write_on', monitor_write_on),
+            ('monitor_write_inst', monitor_write_inst),
+            ('monitor_addr', monitor_addr),
+            ('monitor_data', monitor_data)
+        ] + self.ce_con(ce)
         m.Instance(m_fetch, m_fetch.name, par, con)
 
         m_decode = self.create_decode()
@@ -98,7 +135,10 @@ class Riscv:
             ('funct', funct),
             ('monitor_read_on', monitor_read_on),
             ('monitor_addr', monitor_addr[0:5]),
-        ]
+            ('regwrite', regwrite),
+            ('rd', rd),
+            ('monitor_write_on', monitor_write_on),
+        ] + self.ce_con(ce)
         m.Instance(m_decode, m_decode.name, par, con)
 
         m_exec = self.create_execute()
@@ -119,11 +159,11 @@ class Riscv:
         con = [
             ('clk', clk),
             ('address', maddr),
-            ('writedata', data2),
+            ('writedata', mwdata),
             ('memread', mrd),
-            ('memwrite', memwrite),
+            ('memwrite', mwr),
             ('readdata', readdata),
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_memory, m_memory.name, par, con)
 
         m_writeback = self.create_writeback()
@@ -147,20 +187,29 @@ class Riscv:
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.create_ce(m)
         rst = m.Input("rst")
         zero = m.Input('zero')
         branch = m.Input('branch')
         sigext = m.Input('sigext', data_width)
         inst = m.Output('inst', data_width)
+        pc = m.Output('pc', data_width)
+        monitor_write_on = m.Input('monitor_write_on')
+        monitor_write_inst = m.Input('monitor_write_inst')
+        monitor_addr = m.Input('monitor_addr', data_width)
+        monitor_data = m.Input('monitor_data', data_width)
 
-        pc = m.Wire('pc', data_width)
         pc_4 = m.Wire('pc_4', data_width)
         new_pc = m.Wire('new_pc', data_width)
 
         m.EmbeddedCode('')
 
         pc_4.assign(Int(4, data_width, 10) + pc)
-        new_pc.assign(Mux(AndList(branch, zero), pc+sigext, pc_4))
+        new_pc.assign(Mux(monitor_write_on, pc, Mux(AndList(branch, zero), pc+sigext, pc_4)))
+        iwr = m.Wire('iwr')
+        iaddr = m.Wire('iaddr', data_width)
+        iwr.assign(AndList(monitor_write_on, monitor_write_inst))
+        iaddr.assign(Mux(iwr, monitor_addr, pc))
 
         m_pc = self.create_pc()
         par = []
@@ -169,19 +218,19 @@ class Riscv:
             ('rst', rst),
             ('pc_in', new_pc),
             ('pc_out', pc)
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_pc, m.name, par, con)
 
 
         m_memory = self.create_memory()
         con = [
             ('clk', clk),
-            ('address', pc[2:data_width]),
-            #('writedata', data2),
+            ('address', iaddr),
+            ('writedata', monitor_data),
             ('memread', Int(1,1,2)),
-            ('memwrite', Int(0,1,2)),
+            ('memwrite', iwr),
             ('readdata', inst),
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_memory, m_memory.name, par, con)
 
         '''
@@ -241,12 +290,13 @@ class Riscv:
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.create_ce(m)
         rst = m.Input("rst")
         pc_in = m.Input("pc_in", data_width)
         pc_out = m.OutputReg("pc_out", data_width)
 
         m.Always(Posedge(clk))(
-            pc_out(pc_in),
+            self.enabled(ce, pc_out(pc_in)),
             If(rst)(
                 pc_out(Int(0, pc_out.width, 10))
             )
@@ -267,6 +317,7 @@ class Riscv:
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.create_ce(m)
         inst = m.Input("inst", data_width)
         writedata = m.Input("writedata", data_width)
         data1 = m.Output('data1', data_width)
@@ -282,12 +333,14 @@ class Riscv:
 
         monitor_read_on = m.Input('monitor_read_on')
         monitor_addr = m.Input('monitor_addr', 5)
+        monitor_write_on = m.Input('monitor_write_on')
 
-        regwrite = m.Wire('regwrite')
+        regwrite = m.Output('regwrite')
+        bank_we = m.Wire('bank_we')
         # writereg = m.Wire('writereg', reg_add_width)
         rs1 = m.Wire('rs1', reg_add_width)
         rs2 = m.Wire('rs2', reg_add_width)
-        rd = m.Wire('rd', reg_add_width)
+        rd = m.Output('rd', reg_add_width)
         opcode = m.Wire('opcode', 7)
         funct7 = m.Wire('funct7', 7)
         funct3 = m.Wire('funct3', 3)
@@ -305,6 +358,7 @@ class Riscv:
             '// adaptacao para a interface serial controlar a execução do riscV')
         rraddr = m.Wire('raddr', 5)
         rraddr.assign(Mux(monitor_read_on, monitor_addr, rs1))
+        bank_we.assign(AndList(regwrite, ~monitor_write_on))
         m.EmbeddedCode('// *****')
 
         m_uc = self.create_control_unit()
@@ -326,14 +380,14 @@ class Riscv:
         m_reg_bank = self.create_register_bank()
         con = [
             ('clk', clk),
-            ('regwrite', regwrite),
+            ('regwrite', bank_we),
             ('read_reg1', rraddr),
             ('read_reg2', rs2),
             ('write_reg', rd),
             ('writedata', writedata),
             ('read_data1', data1),
             ('read_data2', data2),
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_reg_bank, m_reg_bank.name, par, con)
 
         _u.initialize_regs(m)
@@ -424,6 +478,7 @@ class Riscv:
         m = Module(name)
 
         clk = m.Input('clk')
+        ce = self.create_ce(m)
         regwrite = m.Input('regwrite')
         read_reg1 = m.Input('read_reg1', reg_add_width)
         read_reg2 = m.Input('read_reg2', reg_add_width)
@@ -440,9 +495,9 @@ class Riscv:
         read_data2.assign(reg_bank[read_reg2])
 
         m.Always(Posedge(clk))(
-            If(regwrite)(
+            self.enabled(ce, If(regwrite)(
                 reg_bank[write_reg](writedata)
-            )
+            ))
         )
 
         self.cache[name] = m
@@ -765,6 +820,7 @@ class Riscv:
         m = Module(name)
 
         clk = m.Input('clk')
+        ce = self.create_ce(m)
         address = m.Input('address', data_width)
         writedata = m.Input('writedata', data_width)
         memread = m.Input('memread')
@@ -779,9 +835,9 @@ class Riscv:
             Mux(memread, memory[address[2:data_width]], Int(0, data_width, 10)))
 
         m.Always(Posedge(clk))(
-            If(memwrite)(
+            self.enabled(ce, If(memwrite)(
                 memory[address[2:data_width]](writedata)
-            )
+            ))
         )
 
         self.cache[name] = m
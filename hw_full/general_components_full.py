@@ -8,14 +8,29 @@ class GeneralComponents(object):
 
     def __new__(class_, *args, **kwargs):
         if not isinstance(class_._instance, class_):
-            class_._instance = object.__new__(class_, *args, **kwargs)
+            class_._instance = object.__new__(class_)
         return class_._instance
 
     def __init__(self,
-                 serial_width: int = 8):
+                 serial_width: int = 8,
+                 clock_enable: bool = False):
         self.serial_width = serial_width
+        # with clock_enable the core modules with state get a ce input and
+        # only move on the clk edges that have it set
+        self.clock_enable = clock_enable
         self.cache = {}
 
+    def get_ce(self, m: Module):
+        if self.clock_enable:
+            return m.Input('ce')
+        return None
+
+    def ce_con(self, ce) -> list:
+        return [] if ce is None else [('ce', ce)]
+
+    def enabled(self, ce, statement):
+        return statement if ce is None else If(ce)(statement)
+
     def get_fifo(self, ) -> Module:
         data_width = 8
         fifo_depth = 2
@@ -652,6 +667,7 @@ class GeneralComponents(object):
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.get_ce(m)
         rst = m.Input("rst")
 
         monitor_read_on = m.Input('monitor_read_on')
@@ -700,7 +716,7 @@ class GeneralComponents(object):
             ('branch', branch),
             ('sigext', sigext),
             ('inst', inst)
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_fetch, m_fetch.name, par, con)
 
         m_decode = self.get_decode()
@@ -720,7 +736,7 @@ class GeneralComponents(object):
             ('funct', funct),
             ('monitor_read_on', monitor_read_on),
             ('monitor_addr', monitor_addr[0:5]),
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_decode, m_decode.name, par, con)
 
         m_exec = self.get_execute()
@@ -745,7 +761,7 @@ class GeneralComponents(object):
             ('memread', mrd),
             ('memwrite', memwrite),
             ('readdata', readdata),
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_memory, m_memory.name, par, con)
 
         m_writeback = self.get_writeback()
@@ -769,6 +785,7 @@ class GeneralComponents(object):
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.get_ce(m)
         rst = m.Input("rst")
         zero = m.Input('zero')
         branch = m.Input('branch')
@@ -791,7 +808,7 @@ class GeneralComponents(object):
             ('rst', rst),
             ('pc_in', new_pc),
             ('pc_out', pc)
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_pc, m.name, par, con)
 
         m_memory = self.get_memory()
@@ -802,7 +819,7 @@ class GeneralComponents(object):
             ('memread', Int(1, 1, 2)),
             ('memwrite', Int(0, 1, 2)),
             ('readdata', inst),
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_memory, m_memory.name, par, con)
 
         '''
@@ -862,12 +879,13 @@ class GeneralComponents(object):
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.get_ce(m)
         rst = m.Input("rst")
         pc_in = m.Input("pc_in", data_width)
         pc_out = m.OutputReg("pc_out", data_width)
 
         m.Always(Posedge(clk))(
-            pc_out(pc_in),
+            self.enabled(ce, pc_out(pc_in)),
             If(rst)(
                 pc_out(Int(0, pc_out.width, 10))
             )
@@ -888,6 +906,7 @@ class GeneralComponents(object):
         m = Module(name)
 
         clk = m.Input("clk")
+        ce = self.get_ce(m)
         inst = m.Input("inst", data_width)
         writedata = m.Input("writedata", data_width)
         data1 = m.Output('data1', data_width)
@@ -954,7 +973,7 @@ class GeneralComponents(object):
             ('writedata', writedata),
             ('read_data1', data1),
             ('read_data2', data2),
-        ]
+        ] + self.ce_con(ce)
         m.Instance(m_reg_bank, m_reg_bank.name, par, con)
 
         _u.initialize_regs(m)
@@ -1052,6 +1071,7 @@ class GeneralComponents(object):
         m = Module(name)
 
         clk = m.Input('clk')
+        ce = self.get_ce(m)
         regwrite = m.Input('regwrite')
         read_reg1 = m.Input('read_reg1', reg_add_width)
         read_reg2 = m.Input('read_reg2', reg_add_width)
@@ -1068,9 +1088,9 @@ class GeneralComponents(object):
         read_data2.assign(reg_bank[read_reg2])
 
         m.Always(Posedge(clk))(
-            If(regwrite)(
+            self.enabled(ce, If(regwrite)(
                 reg_bank[write_reg](writedata)
-            )
+            ))
         )
 
         self.cache[name] = m
@@ -1422,6 +1442,7 @@ class GeneralComponents(object):
         DATA_WIDTH = m.Parameter('DATA_WIDTH', 32)
 
         clk = m.Input('clk')
+        ce = self.get_ce(m)
         address = m.Input('address', RAM_DEPTH)
         writedata = m.Input('writedata', DATA_WIDTH)
         memread = m.Input('memread')
@@ -1437,16 +1458,16 @@ class GeneralComponents(object):
         readdata.assign(Mux(memread, memory[address], 0))
 
         m.Always(Posedge(clk))(
-            If(memwrite)(
+            self.enabled(ce, If(memwrite)(
                 memory[address](writedata)
-            ),
+            )),
         )
 
         m.EmbeddedCode('//synthesis translate_off')
         m.Always(Posedge(clk))(
-            If(AndList(memwrite, WRITE_F))(
+            self.enabled(ce, If(AndList(memwrite, WRITE_F))(
                 Systask('writememh', OUTPUT_FILE, memory)
-            ),
+            )),
         )
         m.EmbeddedCode('//synthesis translate_on')
 
@@ -35,8 +35,9 @@ class GeneralComponents:
         tx = m.Output('tx')
         tx_bsy = m.Output('tx_bsy')
 
+        m.EmbeddedCode('// The core runs on clk and moves on the clocks risc_ce is set')
         risc_rst = m.Reg('risc_rst')
-        risc_clk = m.Reg('risc_clk')
+        risc_ce = m.Reg('risc_ce')
 
         m.EmbeddedCode('')
         m.EmbeddedCode('// Instantiate the RX controller')
@@ -107,13 +108,13 @@ class GeneralComponents:
             If(rst)(
                 fsm_io(FSM_IDLE),
                 rx_fifo_re(Int(0, 1, 2)),
-                risc_clk(Int(0, 1, 2)),
+                risc_ce(Int(0, 1, 2)),
                 risc_rst(Int(0, 1, 2)),
                 tx_send_trig(Int(0, 1, 2)),
                 monitor_read_on(Int(0, 1, 2)),
             ).Else(
                 rx_fifo_re(Int(0, 1, 2)),
-                risc_clk(Int(0, 1, 2)),
+                risc_ce(Int(0, 1, 2)),
                 risc_rst(Int(0, 1, 2)),
                 tx_send_trig(Int(0, 1, 2)),
                 Case(fsm_io)(
@@ -140,11 +141,11 @@ class GeneralComponents:
                     ),
                     When(FSM_RESET)(
                         risc_rst(Int(1, 1, 2)),
-                        risc_clk(Int(1, 1, 2)),
+                        risc_ce(Int(1, 1, 2)),
                         fsm_io(FSM_IDLE)
                     ),
                     When(FSM_EXEC_CLOCK)(
-                        risc_clk(Int(1, 1, 2)),
+                        risc_ce(Int(1, 1, 2)),
                         fsm_io(FSM_SEND_REG_TAM)
                     ),
                     When(FSM_SEND_REG_TAM)(
@@ -251,7 +252,8 @@ class GeneralComponents:
         aux = riscv.get_riscv()
         par = []
         con = [
-            ('clk', risc_clk),
+            ('clk', clk),
+            ('ce', risc_ce),
             ('rst', risc_rst),
             ('monitor_read_on', monitor_read_on),
             ('monitor_addr', monitor_addr),
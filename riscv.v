@@ -41,7 +41,7 @@ module tang_nano_9k_riscv_monitor
   io_riscv_controller
   (
     .clk(clk_27mhz),
-    .rst(~button_s1),
+    .rst(rst),
     .rx(uart_rx),
     .rx_bsy(rx_bsy),
     .tx(uart_tx),
@@ -63,8 +63,11 @@ module io_riscv_controller
   output tx_bsy
 );
 
+  // The core runs on clk and moves on the clocks risc_ce is set:
+  // single risc_pulse steps and every clock of a run
   reg risc_rst;
-  reg risc_clk;
+  reg risc_pulse;
+  wire risc_ce;
 
   // Instantiate the RX controller
   wire rx_block_timeout;
@@ -75,69 +78,475 @@ module io_riscv_controller
   reg send_trig;
   reg [8-1:0] send_data;
 
+  // Instantiate the TX fifo
+  wire tx_fifo_we;
+  wire [8-1:0] tx_fifo_in_data;
+  wire tx_fifo_re;
+  wire tx_fifo_out_valid;
+  wire [8-1:0] tx_fifo_out_data;
+  wire tx_fifo_empty;
+  wire tx_fifo_full;
+  wire tx_fifo_almostfull;
+  // The FSM pushes with send_trig, one byte per clock while not almost
+  // full: the push it starts lands a clock later, behind the one in flight.
+  // A byte is popped when uart_tx is idle and the last one popped
+  // (out_valid, the send_trig of uart_tx) has already started
+  assign tx_fifo_we = send_trig;
+  assign tx_fifo_in_data = send_data;
+  assign tx_fifo_re = ~tx_fifo_empty && ~tx_bsy && ~tx_fifo_out_valid;
+
   // Instantiate the RX fifo
   wire rx_fifo_we;
   wire [8-1:0] rx_fifo_in_data;
-  reg rx_fifo_re;
+  wire rx_fifo_re;
   wire rx_fifo_out_valid;
   wire [8-1:0] rx_fifo_out_data;
   wire rx_fifo_empty;
+  wire rx_fifo_full;
+  wire [6-1:0] rx_fifo_count;
   // The Rx fifo is controlled by the uart_rx module
   assign rx_fifo_we = rx_data_valid;
   assign rx_fifo_in_data = rx_data_out;
+  // Credits: free fifo slots the host may still fill.
+  // rx_overflow is sticky until it is reported by a CREDIT reply
+  wire [8-1:0] rx_fifo_free;
+  reg rx_overflow;
+  assign rx_fifo_free = 8'd32 - rx_fifo_count;
 
   // Config and read data from riscv
-  reg [8-1:0] monitor_addr;
+  // monitor_addr is a register number or a data memory byte address
+  reg [32-1:0] monitor_addr;
+  reg [6-1:0] mem_cnt;
+  // a risc_pulse pulse with monitor_write_on set stores monitor_data
+  // instead of executing
+  reg monitor_write_on;
+  reg monitor_write_inst;
+  reg [32-1:0] monitor_data;
+  reg [8-1:0] write_cnt;
+  reg [8-1:0] write_total;
   reg config_on;
-  wire [8-1:0] mem_dataout;
-  wire [8-1:0] reg_dataout;
+  wire [32-1:0] mem_dataout;
+  wire [32-1:0] reg_dataout;
 
   // PC to board protocol
   localparam [8-1:0] PROT_PC_B_RESET = 8'h0;
   localparam [8-1:0] PROT_PC_B_CLOCK = 8'h1;
+  localparam [8-1:0] PROT_PC_B_CREDIT = 8'h2;
+  localparam [8-1:0] PROT_PC_B_DUMP = 8'h3;
+  localparam [8-1:0] PROT_PC_B_RUN = 8'h4;
+  localparam [8-1:0] PROT_PC_B_SET_BP = 8'h5;
+  localparam [8-1:0] PROT_PC_B_RUN_UNTIL = 8'h6;
+  localparam [8-1:0] PROT_PC_B_SET_WP = 8'h7;
+  localparam [8-1:0] PROT_PC_B_DUMP_MODE = 8'h8;
+  localparam [8-1:0] PROT_PC_B_READ_MEM = 8'h9;
+  localparam [8-1:0] PROT_PC_B_WRITE_MEM = 8'ha;
+  localparam [8-1:0] PROT_PC_B_SET_TRIGGER = 8'hb;
+  localparam [8-1:0] PROT_PC_B_READ_TRACE = 8'hc;
+  localparam [8-1:0] PROT_PC_B_READ_COUNTERS = 8'hd;
+  localparam [8-1:0] PROT_PC_B_RUN_FREE = 8'he;
+  localparam [8-1:0] PROT_PC_B_HALT = 8'hf;
+  localparam [8-1:0] PROT_PC_B_STATUS = 8'h10;
+  localparam [8-1:0] FRAME_SYNC = 8'ha5;
+  localparam [8-1:0] FRAME_SYNC_CRC = 8'h72;
+  localparam [6-1:0] FRAME_MAX = 6'd28;
+  localparam [8-1:0] FRAME_ACK = 8'h0;
+  localparam [8-1:0] FRAME_NAK_CRC = 8'h1;
+  localparam [8-1:0] FRAME_NAK_SEQ = 8'h2;
+
+  // Framed mode. Commands read their bytes through cmd_*: from the rx
+  // fifo, or from frame_buf once a frame passed its crc (frame_on)
+  reg prot_framed;
+  reg frame_on;
+  reg frame_done;
+  reg [8-1:0] frame_buf [0:32-1];
+  reg [6-1:0] frame_wr;
+  reg [5-1:0] frame_rd;
+  reg [6-1:0] frame_len;
+  reg [8-1:0] frame_seq;
+  reg frame_resync;
+  reg frame_out_valid;
+  reg [8-1:0] frame_out_data;
+  reg [8-1:0] rx_seq;
+  reg [8-1:0] rx_crc;
+  reg [8-1:0] tx_crc;
+  reg tx_body;
+  reg cmd_re;
+  wire cmd_empty;
+  wire cmd_valid;
+  wire [8-1:0] cmd_data;
+  wire [8-1:0] rx_byte;
+  wire [8-1:0] rx_crc_next;
+  wire [8-1:0] tx_crc_next;
+  // reads past the end of a short frame return stale bytes instead of
+  // waiting for ones that never come
+  assign cmd_empty = ~frame_on && rx_fifo_empty;
+  assign cmd_valid = (frame_on)? frame_out_valid : rx_fifo_out_valid;
+  assign cmd_data = (frame_on)? frame_out_data : rx_fifo_out_data;
+  assign rx_fifo_re = cmd_re && ~frame_on;
+
+  // Command arguments are shifted in from the top: after n bytes
+  // the little endian value sits in arg_data[63:64-8*n]
+  reg [64-1:0] arg_data;
+  reg [4-1:0] arg_cnt;
+  reg [32-1:0] run_cnt;
+  reg [32-1:0] run_steps;
+  assign rx_byte = arg_data[63:56];
+  assign rx_crc_next = { rx_crc[5] ^ rx_crc[6] ^ rx_crc[7] ^ rx_byte[5] ^ rx_byte[6] ^ rx_byte[7], rx_crc[4] ^ rx_crc[5] ^ rx_crc[6] ^ rx_byte[4] ^ rx_byte[5] ^ rx_byte[6], rx_crc[3] ^ rx_crc[4] ^ rx_crc[5] ^ rx_byte[3] ^ rx_byte[4] ^ rx_byte[5], rx_crc[2] ^ rx_crc[3] ^ rx_crc[4] ^ rx_byte[2] ^ rx_byte[3] ^ rx_byte[4], rx_crc[1] ^ rx_crc[2] ^ rx_crc[3] ^ rx_crc[7] ^ rx_byte[1] ^ rx_byte[2] ^ rx_byte[3] ^ rx_byte[7], rx_crc[0] ^ rx_crc[1] ^ rx_crc[2] ^ rx_crc[6] ^ rx_byte[0] ^ rx_byte[1] ^ rx_byte[2] ^ rx_byte[6], rx_crc[0] ^ rx_crc[1] ^ rx_crc[6] ^ rx_byte[0] ^ rx_byte[1] ^ rx_byte[6], rx_crc[0] ^ rx_crc[6] ^ rx_crc[7] ^ rx_byte[0] ^ rx_byte[6] ^ rx_byte[7] };
+  assign tx_crc_next = { tx_crc[5] ^ tx_crc[6] ^ tx_crc[7] ^ send_data[5] ^ send_data[6] ^ send_data[7], tx_crc[4] ^ tx_crc[5] ^ tx_crc[6] ^ send_data[4] ^ send_data[5] ^ send_data[6], tx_crc[3] ^ tx_crc[4] ^ tx_crc[5] ^ send_data[3] ^ send_data[4] ^ send_data[5], tx_crc[2] ^ tx_crc[3] ^ tx_crc[4] ^ send_data[2] ^ send_data[3] ^ send_data[4], tx_crc[1] ^ tx_crc[2] ^ tx_crc[3] ^ tx_crc[7] ^ send_data[1] ^ send_data[2] ^ send_data[3] ^ send_data[7], tx_crc[0] ^ tx_crc[1] ^ tx_crc[2] ^ tx_crc[6] ^ send_data[0] ^ send_data[1] ^ send_data[2] ^ send_data[6], tx_crc[0] ^ tx_crc[1] ^ tx_crc[6] ^ send_data[0] ^ send_data[1] ^ send_data[6], tx_crc[0] ^ tx_crc[6] ^ tx_crc[7] ^ send_data[0] ^ send_data[6] ^ send_data[7] };
+
+  // Registers written since the last delta dump, marked on the clock
+  // the core writes them; the reset clock writes the bank too
+  reg dump_delta;
+  reg dump_wide;
+  reg [32-1:0] reg_dirty;
+  reg [32-1:0] delta_mask;
+  wire [8-1:0] dirty_count;
+  assign dirty_count = 8'd0 + reg_dirty[0] + reg_dirty[1] + reg_dirty[2] + reg_dirty[3] + reg_dirty[4] + reg_dirty[5] + reg_dirty[6] + reg_dirty[7] + reg_dirty[8] + reg_dirty[9] + reg_dirty[10] + reg_dirty[11] + reg_dirty[12] + reg_dirty[13] + reg_dirty[14] + reg_dirty[15] + reg_dirty[16] + reg_dirty[17] + reg_dirty[18] + reg_dirty[19] + reg_dirty[20] + reg_dirty[21] + reg_dirty[22] + reg_dirty[23] + reg_dirty[24] + reg_dirty[25] + reg_dirty[26] + reg_dirty[27] + reg_dirty[28] + reg_dirty[29] + reg_dirty[30] + reg_dirty[31];
+  wire [8-1:0] delta_tam;
+  assign delta_tam = (dump_wide)? (dirty_count << 2) + 8'd8 : dirty_count + 8'd4;
+
+  // PC breakpoints, compared against the pc the next clock executes
+  wire [32-1:0] riscv_pc;
+  reg [32-1:0] bp_addr [0:4-1];
+  reg [4-1:0] bp_en;
+  wire [4-1:0] bp_hit;
+  assign bp_hit = { bp_en[3] && (bp_addr[3] == riscv_pc), bp_en[2] && (bp_addr[2] == riscv_pc), bp_en[1] && (bp_addr[1] == riscv_pc), bp_en[0] && (bp_addr[0] == riscv_pc) };
+
+  // Watchpoints on the accesses of the instruction the next clock executes.
+  wire riscv_regwrite;
+  wire [5-1:0] riscv_rd;
+  wire riscv_memread;
+  wire riscv_memwrite;
+  wire [32-1:0] riscv_maddr;
+  reg [32-1:0] wp_addr [0:4-1];
+  reg [4-1:0] wp_mem_write;
+  reg [4-1:0] wp_mem_read;
+  reg [4-1:0] wp_reg_write;
+  wire [4-1:0] wp_hit;
+  assign wp_hit = { wp_mem_write[3] && riscv_memwrite && ((wp_addr[3] >> 2) == (riscv_maddr >> 2)) || wp_mem_read[3] && riscv_memread && ((wp_addr[3] >> 2) == (riscv_maddr >> 2)) || wp_reg_write[3] && riscv_regwrite && (wp_addr[3] == { 27'd0, riscv_rd }), wp_mem_write[2] && riscv_memwrite && ((wp_addr[2] >> 2) == (riscv_maddr >> 2)) || wp_mem_read[2] && riscv_memread && ((wp_addr[2] >> 2) == (riscv_maddr >> 2)) || wp_reg_write[2] && riscv_regwrite && (wp_addr[2] == { 27'd0, riscv_rd }), wp_mem_write[1] && riscv_memwrite && ((wp_addr[1] >> 2) == (riscv_maddr >> 2)) || wp_mem_read[1] && riscv_memread && ((wp_addr[1] >> 2) == (riscv_maddr >> 2)) || wp_reg_write[1] && riscv_regwrite && (wp_addr[1] == { 27'd0, riscv_rd }), wp_mem_write[0] && riscv_memwrite && ((wp_addr[0] >> 2) == (riscv_maddr >> 2)) || wp_mem_read[0] && riscv_memread && ((wp_addr[0] >> 2) == (riscv_maddr >> 2)) || wp_reg_write[0] && riscv_regwrite && (wp_addr[0] == { 27'd0, riscv_rd }) };
+
+  // Trace buffer: a ring of {writeback value, inst, pc} of the clocks the
+  // core executes, written on the clock it executes; reads are registered
+  // so the ring can sit in BSRAM
+  wire [32-1:0] riscv_inst;
+  wire [32-1:0] riscv_writedata;
+  wire riscv_step;
+  reg [96-1:0] trace_mem [0:1024-1];
+  reg [96-1:0] trace_out;
+  wire trace_we;
+  reg [10-1:0] trace_wr;
+  reg [10-1:0] trace_rd;
+  reg [11-1:0] trace_count;
+  reg [8-1:0] trace_left;
+  reg trace_on;
+  reg trace_triggered;
+  reg [8-1:0] trace_mode;
+  reg [32-1:0] trace_pc;
+  reg [16-1:0] trace_post;
+  wire trace_hit;
+  // a risc_ce clock that executes an instruction
+  assign riscv_step = risc_ce && ~risc_rst && ~monitor_write_on;
+  assign trace_we = riscv_step && trace_on;
+  assign trace_hit = trace_mode[1] && (trace_pc == riscv_pc) || trace_mode[2] && |{ bp_hit, wp_hit };
+
+  always @(posedge clk) begin
+    if(trace_we) begin
+      trace_mem[trace_wr] <= { riscv_writedata, riscv_inst, riscv_pc };
+    end 
+    trace_out <= trace_mem[trace_rd];
+  end
+
+
+  // Performance counters, 64 bits like mcycle/minstret: controller clocks
+  // the core spent running, instructions executed, taken branches, loads,
+  // stores, and running clocks that executed nothing. A read sends perf_snap,
+  // taken on one clock, since a free run keeps counting while it goes out
+  reg [64-1:0] perf_cnt [0:6-1];
+  reg [64-1:0] perf_snap [0:6-1];
+  reg [3-1:0] perf_idx;
+  wire riscv_branch_taken;
+  wire core_busy;
+
+  // Free run: the core executes every clock next to the FSM, which keeps
+  // taking the commands that leave the core alone (cmd_passive). A command
+  // that halts the core finds the step of its decode clock done.
+  // free_stop: the next step would run into a breakpoint or watchpoint.
+  // run_steps counts the instructions run
+  reg free_run;
+  reg [8-1:0] halt_reason;
+  wire cmd_passive;
+  wire core_hit;
+  wire free_stop;
+  assign core_hit = |{ bp_hit, wp_hit };
+  assign free_stop = free_run && core_hit && (run_steps != 32'd0);
+
+  // Short replies are shifted out LSB first, tam byte included.
+  // tx_ready: the tx fifo still has room for a byte pushed this clock
+  reg [96-1:0] reply_data;
+  reg [4-1:0] reply_cnt;
+  wire tx_ready;
+  assign tx_ready = ~tx_fifo_almostfull;
 
   // IO and protocol controller
-  reg [4-1:0] fsm_io;
-  localparam [4-1:0] FSM_IDLE = 4'h0;
-  localparam [4-1:0] FSM_DECODE_PROTOCOL = 4'h1;
-  localparam [4-1:0] FSM_RESET = 4'h2;
-  localparam [4-1:0] FSM_EXEC_CLOCK = 4'h3;
-  localparam [4-1:0] FSM_SEND_REG_TAM = 4'h4;
-  localparam [4-1:0] FSM_SEND_REG_DATA = 4'h5;
-  localparam [4-1:0] FSM_SEND_REG_BYTES = 4'h6;
-  localparam [4-1:0] FSM_SEND_MEM_TAM = 4'h7;
-  localparam [4-1:0] FSM_SEND_MEM_DATA = 4'h8;
-  localparam [4-1:0] FSM_SEND_MEM_BYTES = 4'h9;
+  reg [6-1:0] fsm_io;
+  localparam [6-1:0] FSM_IDLE = 6'h0;
+  localparam [6-1:0] FSM_DECODE_PROTOCOL = 6'h1;
+  localparam [6-1:0] FSM_RESET = 6'h2;
+  localparam [6-1:0] FSM_EXEC_CLOCK = 6'h3;
+  localparam [6-1:0] FSM_SEND_REG_TAM = 6'h4;
+  localparam [6-1:0] FSM_SEND_REG_DATA = 6'h5;
+  localparam [6-1:0] FSM_SEND_REG_BYTES = 6'h6;
+  localparam [6-1:0] FSM_SEND_MEM_TAM = 6'h7;
+  localparam [6-1:0] FSM_SEND_MEM_DATA = 6'h8;
+  localparam [6-1:0] FSM_SEND_MEM_BYTES = 6'h9;
+  localparam [6-1:0] FSM_SEND_REPLY = 6'ha;
+  localparam [6-1:0] FSM_READ_ARG = 6'hb;
+  localparam [6-1:0] FSM_WAIT_ARG = 6'hc;
+  localparam [6-1:0] FSM_RUN_LOAD = 6'hd;
+  localparam [6-1:0] FSM_RUN = 6'he;
+  localparam [6-1:0] FSM_SET_BP = 6'hf;
+  localparam [6-1:0] FSM_RUN_UNTIL_LOAD = 6'h10;
+  localparam [6-1:0] FSM_RUN_UNTIL = 6'h11;
+  localparam [6-1:0] FSM_SET_WP = 6'h12;
+  localparam [6-1:0] FSM_SET_DUMP_MODE = 6'h13;
+  localparam [6-1:0] FSM_DELTA_LATCH = 6'h14;
+  localparam [6-1:0] FSM_DELTA_SCAN = 6'h15;
+  localparam [6-1:0] FSM_DELTA_BYTES = 6'h16;
+  localparam [6-1:0] FSM_WRITE_MEM = 6'h17;
+  localparam [6-1:0] FSM_WRITE_WORD = 6'h18;
+  localparam [6-1:0] FSM_WRITE_PULSE = 6'h19;
+  localparam [6-1:0] FSM_WRITE_NEXT = 6'h1a;
+  localparam [6-1:0] FSM_FRAME_SEQ = 6'h1b;
+  localparam [6-1:0] FSM_FRAME_LEN = 6'h1c;
+  localparam [6-1:0] FSM_FRAME_DATA = 6'h1d;
+  localparam [6-1:0] FSM_FRAME_STORE = 6'h1e;
+  localparam [6-1:0] FSM_FRAME_CHECK = 6'h1f;
+  localparam [6-1:0] FSM_FRAME_EXEC = 6'h20;
+  localparam [6-1:0] FSM_FRAME_END = 6'h21;
+  localparam [6-1:0] FSM_FRAME_CRC = 6'h22;
+  localparam [6-1:0] FSM_SET_TRIGGER = 6'h23;
+  localparam [6-1:0] FSM_TRACE_TAM = 6'h24;
+  localparam [6-1:0] FSM_TRACE_DATA = 6'h25;
+  localparam [6-1:0] FSM_TRACE_WORD = 6'h26;
+  localparam [6-1:0] FSM_COUNTERS_TAM = 6'h27;
+  localparam [6-1:0] FSM_COUNTERS_DATA = 6'h28;
+  localparam [6-1:0] FSM_STATUS = 6'h29;
+  reg [6-1:0] reply_next;
+  reg [6-1:0] arg_next;
+  assign core_busy = (fsm_io == FSM_RUN) || (fsm_io == FSM_RUN_UNTIL) || free_run || riscv_step;
+  // runs step every clock; run until and free run stop before a breakpoint
+  // or watchpoint, except on the first step, which may leave the last one
+  assign risc_ce = risc_pulse || (fsm_io == FSM_RUN) && (run_cnt != 32'd0) || (fsm_io == FSM_RUN_UNTIL) && (run_cnt != 32'd0) && ~(core_hit && (run_steps != 32'd0)) || free_run && ~free_stop;
+  assign cmd_passive = (cmd_data == PROT_PC_B_CREDIT) || (cmd_data == PROT_PC_B_SET_BP) || (cmd_data == PROT_PC_B_SET_WP) || (cmd_data == PROT_PC_B_DUMP_MODE) || (cmd_data == PROT_PC_B_SET_TRIGGER) || (cmd_data == PROT_PC_B_READ_COUNTERS) || (cmd_data == PROT_PC_B_RUN_FREE) || (cmd_data == PROT_PC_B_HALT) || (cmd_data == PROT_PC_B_STATUS);
 
   always @(posedge clk) begin
     if(rst) begin
       fsm_io <= FSM_IDLE;
-      rx_fifo_re <= 1'b0;
-      risc_clk <= 1'b0;
+      cmd_re <= 1'b0;
+      risc_pulse <= 1'b0;
       risc_rst <= 1'b0;
       send_trig <= 1'b0;
       config_on <= 1'b0;
+      monitor_write_on <= 1'b0;
+      rx_overflow <= 1'b0;
+      bp_en <= 4'd0;
+      wp_mem_write <= 4'd0;
+      wp_mem_read <= 4'd0;
+      wp_reg_write <= 4'd0;
+      dump_delta <= 1'b0;
+      dump_wide <= 1'b0;
+      reg_dirty <= 32'd0;
+      reply_next <= FSM_IDLE;
+      prot_framed <= 1'b0;
+      frame_on <= 1'b0;
+      frame_out_valid <= 1'b0;
+      tx_body <= 1'b0;
+      rx_seq <= 8'd0;
+      trace_on <= 1'b0;
+      trace_count <= 11'd0;
+      trace_wr <= 10'd0;
+      perf_cnt[0] <= 64'd0;
+      perf_cnt[1] <= 64'd0;
+      perf_cnt[2] <= 64'd0;
+      perf_cnt[3] <= 64'd0;
+      perf_cnt[4] <= 64'd0;
+      perf_cnt[5] <= 64'd0;
+      free_run <= 1'b0;
+      halt_reason <= 8'd0;
     end else begin
-      rx_fifo_re <= 1'b0;
-      risc_clk <= 1'b0;
+      cmd_re <= 1'b0;
+      risc_pulse <= 1'b0;
       risc_rst <= 1'b0;
       send_trig <= 1'b0;
+      frame_out_valid <= 1'b0;
+      if(cmd_re && frame_on) begin
+        frame_out_data <= frame_buf[frame_rd];
+        frame_out_valid <= 1'b1;
+        frame_rd <= frame_rd + 5'd1;
+      end 
+      // every byte sent is in the reply crc, which is cleared when the
+      // header goes out
+      if(send_trig) begin
+        tx_crc <= tx_crc_next;
+        if(frame_on) begin
+          tx_body <= 1'b1;
+        end 
+      end 
+      if(risc_ce && ~monitor_write_on && riscv_regwrite) begin
+        reg_dirty[riscv_rd] <= 1'b1;
+      end 
+      if(trace_we) begin
+        trace_wr <= trace_wr + 10'd1;
+        if(~trace_count[10]) begin
+          trace_count <= trace_count + 11'd1;
+        end 
+        if(trace_triggered || trace_hit) begin
+          trace_triggered <= 1'b1;
+          if(trace_post == 16'd1) begin
+            trace_on <= 1'b0;
+          end 
+          if(trace_post != 16'd0) begin
+            trace_post <= trace_post - 16'd1;
+          end 
+        end 
+      end 
+      if(core_busy) begin
+        perf_cnt[0] <= perf_cnt[0] + 64'd1;
+        if(riscv_step) begin
+          perf_cnt[1] <= perf_cnt[1] + 64'd1;
+          if(riscv_branch_taken) begin
+            perf_cnt[2] <= perf_cnt[2] + 64'd1;
+          end 
+          if(riscv_memread) begin
+            perf_cnt[3] <= perf_cnt[3] + 64'd1;
+          end 
+          if(riscv_memwrite) begin
+            perf_cnt[4] <= perf_cnt[4] + 64'd1;
+          end 
+        end else begin
+          perf_cnt[5] <= perf_cnt[5] + 64'd1;
+        end
+      end 
+      if(free_run) begin
+        if(free_stop) begin
+          free_run <= 1'b0;
+          halt_reason <= { bp_hit | wp_hit, 2'd0, |wp_hit, |bp_hit };
+        end else begin
+          run_steps <= run_steps + 32'd1;
+        end
+      end 
       case(fsm_io)
         FSM_IDLE: begin
-          if(~rx_fifo_empty) begin
-            rx_fifo_re <= 1'b1;
+          if(frame_on) begin
+            // one command per frame
+            if(frame_done) begin
+              fsm_io <= FSM_FRAME_END;
+            end else begin
+              cmd_re <= 1'b1;
+              frame_done <= 1'b1;
+              fsm_io <= FSM_DECODE_PROTOCOL;
+            end
+          end else if(~rx_fifo_empty) begin
+            cmd_re <= 1'b1;
             fsm_io <= FSM_DECODE_PROTOCOL;
           end 
         end
         FSM_DECODE_PROTOCOL: begin
-          if(rx_fifo_out_valid) begin
-            case(rx_fifo_out_data)
+          if(cmd_valid && ~frame_on && (cmd_data == FRAME_SYNC)) begin
+            prot_framed <= 1'b1;
+            rx_crc <= FRAME_SYNC_CRC;
+            arg_cnt <= 4'd1;
+            arg_next <= FSM_FRAME_SEQ;
+            fsm_io <= FSM_READ_ARG;
+          end else if(cmd_valid && ~frame_on && prot_framed) begin
+            fsm_io <= FSM_IDLE;
+          end else if(cmd_valid) begin
+            if(free_run && ~cmd_passive && ~free_stop) begin
+              free_run <= 1'b0;
+              halt_reason <= 8'd0;
+            end 
+            case(cmd_data)
               PROT_PC_B_RESET: begin
                 fsm_io <= FSM_RESET;
               end
               PROT_PC_B_CLOCK: begin
                 fsm_io <= FSM_EXEC_CLOCK;
               end
+              PROT_PC_B_DUMP: begin
+                fsm_io <= FSM_SEND_REG_TAM;
+              end
+              PROT_PC_B_RUN: begin
+                arg_cnt <= 4'd4;
+                arg_next <= FSM_RUN_LOAD;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_SET_BP: begin
+                arg_cnt <= 4'd5;
+                arg_next <= FSM_SET_BP;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_RUN_UNTIL: begin
+                arg_cnt <= 4'd4;
+                arg_next <= FSM_RUN_UNTIL_LOAD;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_SET_WP: begin
+                arg_cnt <= 4'd5;
+                arg_next <= FSM_SET_WP;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_DUMP_MODE: begin
+                arg_cnt <= 4'd1;
+                arg_next <= FSM_SET_DUMP_MODE;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_READ_MEM: begin
+                arg_cnt <= 4'd5;
+                arg_next <= FSM_SEND_MEM_TAM;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_WRITE_MEM: begin
+                arg_cnt <= 4'd6;
+                arg_next <= FSM_WRITE_MEM;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_SET_TRIGGER: begin
+                arg_cnt <= 4'd7;
+                arg_next <= FSM_SET_TRIGGER;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_READ_TRACE: begin
+                arg_cnt <= 4'd3;
+                arg_next <= FSM_TRACE_TAM;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_READ_COUNTERS: begin
+                arg_cnt <= 4'd1;
+                arg_next <= FSM_COUNTERS_TAM;
+                fsm_io <= FSM_READ_ARG;
+              end
+              PROT_PC_B_RUN_FREE: begin
+                free_run <= 1'b1;
+                halt_reason <= 8'd0;
+                run_steps <= 32'd0;
+                fsm_io <= FSM_IDLE;
+              end
+              PROT_PC_B_HALT: begin
+                free_run <= 1'b0;
+                if(free_run && ~free_stop) begin
+                  halt_reason <= 8'd0;
+                end 
+                fsm_io <= FSM_STATUS;
+              end
+              PROT_PC_B_STATUS: begin
+                fsm_io <= FSM_STATUS;
+              end
+              PROT_PC_B_CREDIT: begin
+                reply_data <= { 40'd0, 7'd0, rx_overflow, rx_fifo_free, 8'd2 };
+                reply_cnt <= 4'd3;
+                rx_overflow <= 1'b0;
+                fsm_io <= FSM_SEND_REPLY;
+              end
               default: begin
                 fsm_io <= FSM_IDLE;
               end
@@ -146,48 +555,68 @@ module io_riscv_controller
         end
         FSM_RESET: begin
           risc_rst <= 1'b1;
-          risc_clk <= 1'b1;
+          risc_pulse <= 1'b1;
           fsm_io <= FSM_IDLE;
         end
         FSM_EXEC_CLOCK: begin
-          risc_clk <= 1'b1;
+          risc_pulse <= 1'b1;
           fsm_io <= FSM_SEND_REG_TAM;
         end
         FSM_SEND_REG_TAM: begin
-          if(~tx_bsy) begin
+          if(dump_delta) begin
+            fsm_io <= FSM_DELTA_LATCH;
+          end else if(tx_ready) begin
             send_trig <= 1'b1;
-            send_data <= 8'd32;
-            monitor_addr <= 8'd0;
+            send_data <= (dump_wide)? 8'd132 : 8'd32;
+            monitor_addr <= 32'd0;
             fsm_io <= FSM_SEND_REG_DATA;
           end 
         end
         FSM_SEND_REG_DATA: begin
           if(monitor_addr == 32) begin
             config_on <= 1'b0;
-            fsm_io <= FSM_IDLE;
+            if(dump_wide) begin
+              reply_data <= { 64'd0, riscv_pc };
+              reply_cnt <= 4'd4;
+              fsm_io <= FSM_SEND_REPLY;
+            end else begin
+              fsm_io <= FSM_IDLE;
+            end
           end else begin
             config_on <= 1'b1;
             fsm_io <= FSM_SEND_REG_BYTES;
           end
         end
         FSM_SEND_REG_BYTES: begin
-          if(~tx_bsy) begin
-            monitor_addr <= monitor_addr + 8'd1;
-            send_trig <= 1;
-            send_data <= reg_dataout;
-            fsm_io <= FSM_SEND_REG_DATA;
+          if(dump_wide) begin
+            // SEND_REPLY shifts the word out and comes back
+            monitor_addr <= monitor_addr + 32'd1;
+            reply_data <= { 64'd0, reg_dataout };
+            reply_cnt <= 4'd4;
+            reply_next <= FSM_SEND_REG_DATA;
+            fsm_io <= FSM_SEND_REPLY;
+          end else if(tx_ready) begin
+            // reg_dataout follows monitor_addr: a byte per clock
+            monitor_addr <= monitor_addr + 32'd1;
+            send_trig <= 1'b1;
+            send_data <= reg_dataout[7:0];
+            if(monitor_addr == 31) begin
+              fsm_io <= FSM_SEND_REG_DATA;
+            end 
           end 
         end
         FSM_SEND_MEM_TAM: begin
-          if(~tx_bsy) begin
+          // arguments: addr in arg_data[55:24], n words in arg_data[63:56]
+          if(tx_ready) begin
             send_trig <= 1'b1;
-            send_data <= 8'd32;
-            monitor_addr <= 8'd0;
+            send_data <= { arg_data[61:56], 2'd0 };
+            monitor_addr <= arg_data[55:24];
+            mem_cnt <= arg_data[61:56];
             fsm_io <= FSM_SEND_MEM_DATA;
           end 
         end
         FSM_SEND_MEM_DATA: begin
-          if(monitor_addr == 32) begin
+          if(mem_cnt == 6'd0) begin
             config_on <= 1'b0;
             fsm_io <= FSM_IDLE;
           end else begin
@@ -196,17 +625,336 @@ module io_riscv_controller
           end
         end
         FSM_SEND_MEM_BYTES: begin
-          if(~tx_bsy) begin
-            monitor_addr <= monitor_addr + 8'd1;
-            send_trig <= 1;
-            send_data <= mem_dataout;
-            fsm_io <= FSM_SEND_MEM_DATA;
+          monitor_addr <= monitor_addr + 32'd4;
+          mem_cnt <= mem_cnt - 6'd1;
+          reply_data <= { 64'd0, mem_dataout };
+          reply_cnt <= 4'd4;
+          reply_next <= FSM_SEND_MEM_DATA;
+          fsm_io <= FSM_SEND_REPLY;
+        end
+        FSM_SEND_REPLY: begin
+          if(tx_ready) begin
+            send_trig <= 1'b1;
+            send_data <= reply_data[7:0];
+            reply_data <= reply_data >> 8;
+            reply_cnt <= reply_cnt - 4'd1;
+            if(reply_cnt == 4'd1) begin
+              fsm_io <= reply_next;
+              reply_next <= FSM_IDLE;
+            end 
+          end 
+        end
+        FSM_READ_ARG: begin
+          if(~cmd_empty) begin
+            cmd_re <= 1'b1;
+            fsm_io <= FSM_WAIT_ARG;
+          end 
+        end
+        FSM_WAIT_ARG: begin
+          if(cmd_valid) begin
+            arg_data <= { cmd_data, arg_data[63:8] };
+            arg_cnt <= arg_cnt - 4'd1;
+            if(arg_cnt == 4'd1) begin
+              fsm_io <= arg_next;
+            end else begin
+              fsm_io <= FSM_READ_ARG;
+            end
+          end 
+        end
+        FSM_RUN_LOAD: begin
+          run_cnt <= arg_data[63:32];
+          fsm_io <= FSM_RUN;
+        end
+        FSM_RUN: begin
+          // risc_ce steps the core on every clock run_cnt is not 0
+          if(run_cnt == 32'd0) begin
+            fsm_io <= FSM_SEND_REG_TAM;
+          end else begin
+            run_cnt <= run_cnt - 32'd1;
+          end
+        end
+        FSM_SET_BP: begin
+          bp_addr[arg_data[25:24]] <= arg_data[63:32];
+          bp_en[arg_data[25:24]] <= arg_data[31];
+          fsm_io <= FSM_IDLE;
+        end
+        FSM_SET_WP: begin
+          wp_addr[arg_data[25:24]] <= arg_data[63:32];
+          wp_mem_write[arg_data[25:24]] <= arg_data[31] && arg_data[28];
+          wp_mem_read[arg_data[25:24]] <= arg_data[31] && arg_data[29];
+          wp_reg_write[arg_data[25:24]] <= arg_data[31] && arg_data[30];
+          fsm_io <= FSM_IDLE;
+        end
+        FSM_SET_DUMP_MODE: begin
+          dump_delta <= arg_data[56];
+          dump_wide <= arg_data[57];
+          reg_dirty <= 32'hffffffff;
+          fsm_io <= FSM_IDLE;
+        end
+        FSM_DELTA_LATCH: begin
+          // a cycle after the last step reg_dirty is up to date
+          delta_mask <= reg_dirty;
+          reg_dirty <= 32'd0;
+          reply_data <= { 56'd0, reg_dirty, delta_tam };
+          reply_cnt <= 4'd5;
+          reply_next <= FSM_DELTA_SCAN;
+          monitor_addr <= 32'd0;
+          fsm_io <= FSM_SEND_REPLY;
+        end
+        FSM_DELTA_SCAN: begin
+          if(monitor_addr == 32) begin
+            config_on <= 1'b0;
+            if(dump_wide) begin
+              reply_data <= { 64'd0, riscv_pc };
+              reply_cnt <= 4'd4;
+              fsm_io <= FSM_SEND_REPLY;
+            end else begin
+              fsm_io <= FSM_IDLE;
+            end
+          end else if(delta_mask[monitor_addr[4:0]]) begin
+            config_on <= 1'b1;
+            fsm_io <= FSM_DELTA_BYTES;
+          end else begin
+            monitor_addr <= monitor_addr + 32'd1;
+          end
+        end
+        FSM_DELTA_BYTES: begin
+          if(dump_wide) begin
+            monitor_addr <= monitor_addr + 32'd1;
+            reply_data <= { 64'd0, reg_dataout };
+            reply_cnt <= 4'd4;
+            reply_next <= FSM_DELTA_SCAN;
+            fsm_io <= FSM_SEND_REPLY;
+          end else if(tx_ready) begin
+            monitor_addr <= monitor_addr + 32'd1;
+            send_trig <= 1'b1;
+            send_data <= reg_dataout[7:0];
+            fsm_io <= FSM_DELTA_SCAN;
+          end 
+        end
+        FSM_WRITE_MEM: begin
+          // target arg_data[23:16], addr arg_data[55:24], n words arg_data[63:56]
+          monitor_write_inst <= arg_data[23:16] == 8'd0;
+          monitor_addr <= arg_data[55:24];
+          write_cnt <= arg_data[63:56];
+          write_total <= arg_data[63:56];
+          if(arg_data[63:56] == 8'd0) begin
+            reply_data <= { 80'd0, 8'd1 };
+            reply_cnt <= 4'd2;
+            fsm_io <= FSM_SEND_REPLY;
+          end else begin
+            arg_cnt <= 4'd4;
+            arg_next <= FSM_WRITE_WORD;
+            fsm_io <= FSM_READ_ARG;
+          end
+        end
+        FSM_WRITE_WORD: begin
+          monitor_data <= arg_data[63:32];
+          monitor_write_on <= 1'b1;
+          fsm_io <= FSM_WRITE_PULSE;
+        end
+        FSM_WRITE_PULSE: begin
+          risc_pulse <= 1'b1;
+          fsm_io <= FSM_WRITE_NEXT;
+        end
+        FSM_WRITE_NEXT: begin
+          monitor_write_on <= 1'b0;
+          monitor_addr <= monitor_addr + 32'd4;
+          write_cnt <= write_cnt - 8'd1;
+          if(write_cnt == 8'd1) begin
+            reply_data <= { 80'd0, write_total, 8'd1 };
+            reply_cnt <= 4'd2;
+            fsm_io <= FSM_SEND_REPLY;
+          end else begin
+            arg_cnt <= 4'd4;
+            arg_next <= FSM_WRITE_WORD;
+            fsm_io <= FSM_READ_ARG;
+          end
+        end
+        FSM_RUN_UNTIL_LOAD: begin
+          run_cnt <= arg_data[63:32];
+          run_steps <= 32'd0;
+          fsm_io <= FSM_RUN_UNTIL;
+        end
+        FSM_RUN_UNTIL: begin
+          // the first clock may leave a breakpoint the last run stopped on;
+          // risc_ce steps the core on the clocks that take the Else
+          if(core_hit && (run_steps != 32'd0)) begin
+            reply_data <= { run_steps, riscv_pc, bp_hit | wp_hit, 2'd0, |wp_hit, |bp_hit, 8'd9 };
+            reply_cnt <= 4'd10;
+            fsm_io <= FSM_SEND_REPLY;
+          end else if(run_cnt == 32'd0) begin
+            reply_data <= { run_steps, riscv_pc, 8'd0, 8'd9 };
+            reply_cnt <= 4'd10;
+            fsm_io <= FSM_SEND_REPLY;
+          end else begin
+            run_cnt <= run_cnt - 32'd1;
+            run_steps <= run_steps + 32'd1;
+          end
+        end
+        FSM_SET_TRIGGER: begin
+          // mode arg_data[15:8], pc arg_data[47:16], post arg_data[63:48]
+          trace_mode <= arg_data[15:8];
+          trace_pc <= arg_data[47:16];
+          trace_post <= arg_data[63:48];
+          trace_on <= arg_data[8];
+          if(arg_data[8]) begin
+            trace_wr <= 10'd0;
+            trace_count <= 11'd0;
+            trace_triggered <= ~(|arg_data[10:9]);
+          end 
+          fsm_io <= FSM_IDLE;
+        end
+        FSM_TRACE_TAM: begin
+          // first entry arg_data[55:40], n arg_data[63:56]; the oldest
+          // entry is trace_count entries behind trace_wr
+          trace_rd <= trace_wr - trace_count[9:0] + arg_data[49:40];
+          trace_left <= arg_data[63:56];
+          reply_data <= { 64'd0, 6'd0, trace_triggered, trace_on, 5'd0, trace_count, (arg_data[63:56] << 3) + (arg_data[63:56] << 2) + 8'd4 };
+          reply_cnt <= 4'd5;
+          reply_next <= FSM_TRACE_DATA;
+          fsm_io <= FSM_SEND_REPLY;
+        end
+        FSM_TRACE_DATA: begin
+          // trace_out reads trace_rd in the next clock
+          if(trace_left == 8'd0) begin
+            fsm_io <= FSM_IDLE;
+          end else begin
+            fsm_io <= FSM_TRACE_WORD;
+          end
+        end
+        FSM_TRACE_WORD: begin
+          trace_rd <= trace_rd + 10'd1;
+          trace_left <= trace_left - 8'd1;
+          reply_data <= trace_out;
+          reply_cnt <= 4'd12;
+          reply_next <= FSM_TRACE_DATA;
+          fsm_io <= FSM_SEND_REPLY;
+        end
+        FSM_STATUS: begin
+          reply_data <= { run_steps, riscv_pc, halt_reason[7:4], free_run, halt_reason[2:0], 8'd9 };
+          reply_cnt <= 4'd10;
+          fsm_io <= FSM_SEND_REPLY;
+        end
+        FSM_COUNTERS_TAM: begin
+          perf_idx <= 3'd0;
+          perf_snap[0] <= perf_cnt[0];
+          perf_snap[1] <= perf_cnt[1];
+          perf_snap[2] <= perf_cnt[2];
+          perf_snap[3] <= perf_cnt[3];
+          perf_snap[4] <= perf_cnt[4];
+          perf_snap[5] <= perf_cnt[5];
+          // cleared on the clock of the snapshot
+          if(arg_data[56]) begin
+            perf_cnt[0] <= 64'd0;
+            perf_cnt[1] <= 64'd0;
+            perf_cnt[2] <= 64'd0;
+            perf_cnt[3] <= 64'd0;
+            perf_cnt[4] <= 64'd0;
+            perf_cnt[5] <= 64'd0;
+          end 
+          reply_data <= 96'd48;
+          reply_cnt <= 4'd1;
+          reply_next <= FSM_COUNTERS_DATA;
+          fsm_io <= FSM_SEND_REPLY;
+        end
+        FSM_COUNTERS_DATA: begin
+          if(perf_idx == 6) begin
+            fsm_io <= FSM_IDLE;
+          end else begin
+            perf_idx <= perf_idx + 3'd1;
+            reply_data <= { 32'd0, perf_snap[perf_idx] };
+            reply_cnt <= 4'd8;
+            reply_next <= FSM_COUNTERS_DATA;
+            fsm_io <= FSM_SEND_REPLY;
+          end
+        end
+        FSM_FRAME_SEQ: begin
+          frame_seq <= rx_byte;
+          rx_crc <= rx_crc_next;
+          arg_cnt <= 4'd1;
+          arg_next <= FSM_FRAME_LEN;
+          fsm_io <= FSM_READ_ARG;
+        end
+        FSM_FRAME_LEN: begin
+          rx_crc <= rx_crc_next;
+          frame_resync <= rx_byte[7];
+          frame_len <= rx_byte[5:0];
+          frame_wr <= 6'd0;
+          if((rx_byte[5:0] == 6'd0) || (rx_byte[5:0] > FRAME_MAX)) begin
+            tx_crc <= 8'd0;
+            tx_body <= 1'b0;
+            reply_data <= { 72'd0, FRAME_NAK_CRC, rx_seq, FRAME_SYNC };
+            reply_cnt <= 4'd3;
+            reply_next <= FSM_FRAME_END;
+            fsm_io <= FSM_SEND_REPLY;
+          end else begin
+            fsm_io <= FSM_FRAME_DATA;
+          end
+        end
+        FSM_FRAME_DATA: begin
+          arg_cnt <= 4'd1;
+          arg_next <= (frame_wr == frame_len)? FSM_FRAME_CHECK : FSM_FRAME_STORE;
+          fsm_io <= FSM_READ_ARG;
+        end
+        FSM_FRAME_STORE: begin
+          frame_buf[frame_wr[4:0]] <= rx_byte;
+          rx_crc <= rx_crc_next;
+          frame_wr <= frame_wr + 6'd1;
+          fsm_io <= FSM_FRAME_DATA;
+        end
+        FSM_FRAME_CHECK: begin
+          // rx_byte is the crc byte of the frame
+          // a new header: no body has gone out behind it yet
+          tx_crc <= 8'd0;
+          tx_body <= 1'b0;
+          reply_cnt <= 4'd3;
+          fsm_io <= FSM_SEND_REPLY;
+          if(rx_byte != rx_crc) begin
+            reply_data <= { 72'd0, FRAME_NAK_CRC, rx_seq, FRAME_SYNC };
+            reply_next <= FSM_FRAME_END;
+          end else if((frame_seq != rx_seq) && ~frame_resync) begin
+            reply_data <= { 72'd0, FRAME_NAK_SEQ, rx_seq, FRAME_SYNC };
+            reply_next <= FSM_FRAME_END;
+          end else begin
+            rx_seq <= frame_seq + 8'd1;
+            reply_data <= { 72'd0, FRAME_ACK, frame_seq, FRAME_SYNC };
+            reply_next <= FSM_FRAME_EXEC;
+          end
+        end
+        FSM_FRAME_EXEC: begin
+          frame_on <= 1'b1;
+          frame_done <= 1'b0;
+          frame_rd <= 5'd0;
+          fsm_io <= FSM_IDLE;
+        end
+        FSM_FRAME_END: begin
+          // commands without a reply, and naks, answer with tam 0
+          frame_on <= 1'b0;
+          if(tx_body) begin
+            fsm_io <= FSM_FRAME_CRC;
+          end else begin
+            reply_data <= 96'd0;
+            reply_cnt <= 4'd1;
+            reply_next <= FSM_FRAME_CRC;
+            fsm_io <= FSM_SEND_REPLY;
+          end
+        end
+        FSM_FRAME_CRC: begin
+          // ~send_trig: the crc has taken in the last byte pushed
+          if(tx_ready && ~send_trig) begin
+            send_trig <= 1'b1;
+            send_data <= tx_crc;
+            fsm_io <= FSM_IDLE;
           end 
         end
         default: begin
           fsm_io <= FSM_IDLE;
         end
       endcase
+      if(rx_fifo_we && rx_fifo_full) begin
+        rx_overflow <= 1'b1;
+      end 
     end
   end
 
@@ -225,7 +973,29 @@ module io_riscv_controller
     .re(rx_fifo_re),
     .out_valid(rx_fifo_out_valid),
     .out_data(rx_fifo_out_data),
-    .empty(rx_fifo_empty)
+    .empty(rx_fifo_empty),
+    .full(rx_fifo_full),
+    .data_count(rx_fifo_count)
+  );
+
+
+  fifo
+  #(
+    .FIFO_WIDTH(8),
+    .FIFO_DEPTH_BITS(8)
+  )
+  tx_fifo
+  (
+    .clk(clk),
+    .rst(rst),
+    .we(tx_fifo_we),
+    .in_data(tx_fifo_in_data),
+    .re(tx_fifo_re),
+    .out_valid(tx_fifo_out_valid),
+    .out_data(tx_fifo_out_data),
+    .empty(tx_fifo_empty),
+    .full(tx_fifo_full),
+    .almostfull(tx_fifo_almostfull)
   );
 
 
@@ -247,8 +1017,8 @@ module io_riscv_controller
   (
     .clk(clk),
     .rst(rst),
-    .send_trig(send_trig),
-    .send_data(send_data),
+    .send_trig(tx_fifo_out_valid),
+    .send_data(tx_fifo_out_data),
     .tx(tx),
     .tx_bsy(tx_bsy)
   );
@@ -257,24 +1027,106 @@ module io_riscv_controller
   riscv_rd_5_ird_6
   riscv_rd_5_ird_6
   (
-    .clk(risc_clk),
+    .clk(clk),
+    .ce(risc_ce),
     .rst(risc_rst),
     .monitor_read_on(config_on),
+    .monitor_write_on(monitor_write_on),
+    .monitor_write_inst(monitor_write_inst),
     .monitor_addr(monitor_addr),
+    .monitor_data(monitor_data),
     .mem_dataout(mem_dataout),
-    .reg_dataout(reg_dataout)
+    .reg_dataout(reg_dataout),
+    .pc(riscv_pc),
+    .inst(riscv_inst),
+    .writedata(riscv_writedata),
+    .branch_taken(riscv_branch_taken),
+    .regwrite(riscv_regwrite),
+    .rd(riscv_rd),
+    .memread(riscv_memread),
+    .memwrite(riscv_memwrite),
+    .maddr(riscv_maddr)
   );
 
+  integer i_initial;
 
   initial begin
     risc_rst = 1;
-    risc_clk = 0;
+    risc_pulse = 0;
     send_trig = 0;
     send_data = 0;
-    rx_fifo_re = 0;
+    rx_overflow = 0;
     monitor_addr = 0;
+    mem_cnt = 0;
+    monitor_write_on = 0;
+    monitor_write_inst = 0;
+    monitor_data = 0;
+    write_cnt = 0;
+    write_total = 0;
     config_on = 0;
+    prot_framed = 0;
+    frame_on = 0;
+    frame_done = 0;
+    for(i_initial=0; i_initial<32; i_initial=i_initial+1) begin
+      frame_buf[i_initial] = 0;
+    end
+    frame_wr = 0;
+    frame_rd = 0;
+    frame_len = 0;
+    frame_seq = 0;
+    frame_resync = 0;
+    frame_out_valid = 0;
+    frame_out_data = 0;
+    rx_seq = 0;
+    rx_crc = 0;
+    tx_crc = 0;
+    tx_body = 0;
+    cmd_re = 0;
+    arg_data = 0;
+    arg_cnt = 0;
+    run_cnt = 0;
+    run_steps = 0;
+    dump_delta = 0;
+    dump_wide = 0;
+    reg_dirty = 0;
+    delta_mask = 0;
+    for(i_initial=0; i_initial<4; i_initial=i_initial+1) begin
+      bp_addr[i_initial] = 0;
+    end
+    bp_en = 0;
+    for(i_initial=0; i_initial<4; i_initial=i_initial+1) begin
+      wp_addr[i_initial] = 0;
+    end
+    wp_mem_write = 0;
+    wp_mem_read = 0;
+    wp_reg_write = 0;
+    for(i_initial=0; i_initial<1024; i_initial=i_initial+1) begin
+      trace_mem[i_initial] = 0;
+    end
+    trace_out = 0;
+    trace_wr = 0;
+    trace_rd = 0;
+    trace_count = 0;
+    trace_left = 0;
+    trace_on = 0;
+    trace_triggered = 0;
+    trace_mode = 0;
+    trace_pc = 0;
+    trace_post = 0;
+    for(i_initial=0; i_initial<6; i_initial=i_initial+1) begin
+      perf_cnt[i_initial] = 0;
+    end
+    for(i_initial=0; i_initial<6; i_initial=i_initial+1) begin
+      perf_snap[i_initial] = 0;
+    end
+    perf_idx = 0;
+    free_run = 0;
+    halt_reason = 0;
+    reply_data = 0;
+    reply_cnt = 0;
     fsm_io = 0;
+    reply_next = 0;
+    arg_next = 0;
   end
 
 
@@ -307,6 +1159,11 @@ module fifo #
   reg [FIFO_DEPTH_BITS-1:0] read_pointer;
   reg [FIFO_DEPTH_BITS-1:0] write_pointer;
   reg [FIFO_WIDTH-1:0] mem [0:2**FIFO_DEPTH_BITS-1];
+  // a write into a full fifo and a read from an empty one are dropped
+  wire we_ok;
+  wire re_ok;
+  assign we_ok = we && ~full;
+  assign re_ok = re && ~empty;
 
   always @(posedge clk) begin
     if(rst) begin
@@ -318,7 +1175,7 @@ module fifo #
       write_pointer <= 0;
       data_count <= 0;
     end else begin
-      case({ we, re })
+      case({ we_ok, re_ok })
         3: begin
           read_pointer <= read_pointer + 1;
           write_pointer <= write_pointer + 1;
@@ -365,7 +1222,7 @@ module fifo #
       out_valid <= 0;
     end else begin
       out_valid <= 0;
-      if(we == 1) begin
+      if(we_ok) begin
         mem[write_pointer] <= in_data;
       end 
       if(re == 1) begin
@@ -393,25 +1250,23 @@ module uart_rx
 
   // 27MHz
   // 3Mbits
-  localparam CLKPERFRM = 86;
-  // bit order is lsb-msb
-  localparam TBITAT = 5;
-  // START BIT
-  localparam BIT0AT = 11;
-  localparam BIT1AT = 20;
-  localparam BIT2AT = 29;
-  localparam BIT3AT = 38;
-  localparam BIT4AT = 47;
-  localparam BIT5AT = 56;
-  localparam BIT6AT = 65;
-  localparam BIT7AT = 74;
-  localparam PBITAT = 80;
-  // STOP bit
-  localparam BLK_TIMEOUT = 20;
+  // Same phase accumulator as uart_tx. It starts half a bit (plus the
+  // edge detect delay) ahead, so every tick falls in the middle of a bit
+  localparam [17-1:0] BAUD_INC = 17'd7282;
+  localparam [16-1:0] PHASE_START = 16'd40050;
+  // idle bit times after a frame that end a block
+  localparam [2-1:0] BLK_TIMEOUT = 2'd2;
   // this depends on your USB UART chip
 
   // rx flow control
-  reg [8-1:0] rx_cnt;
+  reg [16-1:0] phase;
+  wire [17-1:0] phase_next;
+  wire bit_tick;
+  // bit being sampled: 0 START, 1-8 data lsb-msb, 9 STOP
+  reg [4-1:0] bit_idx;
+  reg [2-1:0] idle_cnt;
+  assign phase_next = phase + BAUD_INC;
+  assign bit_tick = phase_next[16];
 
   //logic rx_sync
   reg rx_hold;
@@ -419,7 +1274,6 @@ module uart_rx
   wire frame_begin;
   wire frame_end;
   wire start_invalid;
-  wire stop_invalid;
 
   always @(posedge clk) begin
     if(rst) begin
@@ -431,12 +1285,10 @@ module uart_rx
 
   // negative edge detect
   assign frame_begin = &{ ~rx_bsy, ~rx, rx_hold };
-  // final count
-  assign frame_end = &{ rx_bsy, rx_cnt == CLKPERFRM };
-  // START bit must be low  for 80% of the bit duration
-  assign start_invalid = &{ rx_bsy, rx_cnt < TBITAT, rx };
-  // STOP  bit must be high for 80% of the bit duration
-  assign stop_invalid = &{ rx_bsy, rx_cnt > PBITAT, ~rx };
+  // middle of the STOP bit
+  assign frame_end = &{ rx_bsy, bit_tick, bit_idx == 4'd9 };
+  // START bit must still be low in its middle
+  assign start_invalid = &{ rx_bsy, bit_tick, bit_idx == 4'd0, rx };
 
   always @(posedge clk) begin
     if(rst) begin
@@ -444,33 +1296,39 @@ module uart_rx
     end else begin
       if(frame_begin) begin
         rx_bsy <= 1'b1;
-      end else if(|{ start_invalid, stop_invalid }) begin
-        rx_bsy <= 1'b0;
-      end else if(frame_end) begin
+      end else if(|{ start_invalid, frame_end }) begin
         rx_bsy <= 1'b0;
       end 
     end
   end
 
-  // count if frame is valid or until the timeout
+  // the accumulator also times the idle line until the timeout
 
   always @(posedge clk) begin
     if(rst) begin
-      rx_cnt <= 8'd0;
+      phase <= 16'd0;
+      bit_idx <= 4'd0;
+      idle_cnt <= 2'd0;
     end else begin
       if(frame_begin) begin
-        rx_cnt <= 8'd0;
-      end else if(|{ start_invalid, stop_invalid, frame_end }) begin
-        rx_cnt <= 8'd0;
+        phase <= PHASE_START;
+        bit_idx <= 4'd0;
+        idle_cnt <= 2'd0;
+      end else if(rx_bsy) begin
+        phase <= phase_next[15:0];
+        if(bit_tick) begin
+          bit_idx <= bit_idx + 1;
+        end 
       end else if(~timeout) begin
-        rx_cnt <= rx_cnt + 1;
-      end else begin
-        rx_cnt <= 8'd0;
-      end
+        phase <= phase_next[15:0];
+        if(bit_tick) begin
+          idle_cnt <= idle_cnt + 1;
+        end 
+      end 
     end
   end
 
-  // this just stops the rx_cnt
+  // this just stops the idle count
 
   always @(posedge clk) begin
     if(rst) begin
@@ -478,7 +1336,7 @@ module uart_rx
     end else begin
       if(frame_begin) begin
         timeout <= 1'b0;
-      end else if(&{ ~rx_bsy, rx_cnt == BLK_TIMEOUT }) begin
+      end else if(&{ ~rx_bsy, bit_tick, idle_cnt == BLK_TIMEOUT - 1 }) begin
         timeout <= 1'b1;
       end 
     end
@@ -490,7 +1348,7 @@ module uart_rx
     if(rst) begin
       block_timeout <= 1'b0;
     end else begin
-      if(&{ ~rx_bsy, rx_cnt == BLK_TIMEOUT }) begin
+      if(&{ ~rx_bsy, ~timeout, bit_tick, idle_cnt == BLK_TIMEOUT - 1 }) begin
         block_timeout <= 1'b1;
       end else begin
         block_timeout <= 1'b0;
@@ -498,53 +1356,29 @@ module uart_rx
     end
   end
 
-  // this pulses upon completion of a clean frame
+  // this pulses upon completion of a clean frame:
+  // STOP bit must be high in its middle
 
   always @(posedge clk) begin
     if(rst) begin
       data_valid <= 1'b0;
     end else begin
       if(frame_end) begin
-        data_valid <= 1'b1;
+        data_valid <= rx;
       end else begin
         data_valid <= 1'b0;
       end
     end
   end
 
-  // rx data control
+  // rx data control, shifted in lsb first
 
   always @(posedge clk) begin
     if(rst) begin
       data_out <= 8'd0;
     end else begin
-      if(rx_bsy) begin
-        case(rx_cnt)
-          BIT0AT: begin
-            data_out[0] <= rx;
-          end
-          BIT1AT: begin
-            data_out[1] <= rx;
-          end
-          BIT2AT: begin
-            data_out[2] <= rx;
-          end
-          BIT3AT: begin
-            data_out[3] <= rx;
-          end
-          BIT4AT: begin
-            data_out[4] <= rx;
-          end
-          BIT5AT: begin
-            data_out[5] <= rx;
-          end
-          BIT6AT: begin
-            data_out[6] <= rx;
-          end
-          BIT7AT: begin
-            data_out[7] <= rx;
-          end
-        endcase
+      if(rx_bsy && bit_tick && (bit_idx != 4'd0) && (bit_idx != 4'd9)) begin
+        data_out <= { rx, data_out[7:1] };
       end 
     end
   end
@@ -555,7 +1389,9 @@ module uart_rx
     block_timeout = 0;
     data_valid = 0;
     data_out = 0;
-    rx_cnt = 0;
+    phase = 0;
+    bit_idx = 0;
+    idle_cnt = 0;
     rx_hold = 0;
     timeout = 0;
   end
@@ -577,30 +1413,26 @@ module uart_tx
 
   // 27MHz
   // 3Mbps
-  localparam CLKPERFRM = 90;
-  // bit order is lsb-msb
-  localparam TBITAT = 1;
-  // START bit
-  localparam BIT0AT = 10;
-  localparam BIT1AT = 19;
-  localparam BIT2AT = 28;
-  localparam BIT3AT = 37;
-  localparam BIT4AT = 46;
-  localparam BIT5AT = 55;
-  localparam BIT6AT = 64;
-  localparam BIT7AT = 73;
-  localparam PBITAT = 82;
-  // STOP bit
+  // Bit times come from a phase accumulator that adds BAUD_INC/2^16
+  // of a bit per clock: every edge is within one clock of where it
+  // belongs, also when the baudrate does not divide the clock
+  localparam [17-1:0] BAUD_INC = 17'd7282;
 
   // tx flow control 
-  reg [8-1:0] tx_cnt;
+  reg [16-1:0] phase;
+  wire [17-1:0] phase_next;
+  wire bit_tick;
+  // bit periods done: 0 START, 1-8 data lsb-msb, 9 STOP
+  reg [4-1:0] bit_idx;
+  assign phase_next = phase + BAUD_INC;
+  assign bit_tick = phase_next[16];
 
   // buffer
   reg [8-1:0] data2send;
   wire frame_begin;
   wire frame_end;
   assign frame_begin = &{ send_trig, ~tx_bsy };
-  assign frame_end = &{ tx_bsy, tx_cnt == CLKPERFRM };
+  assign frame_end = &{ tx_bsy, bit_tick, bit_idx == 4'd9 };
 
   always @(posedge clk) begin
     if(rst) begin
@@ -617,22 +1449,30 @@ module uart_tx
 
   always @(posedge clk) begin
     if(rst) begin
-      tx_cnt <= 8'd0;
+      phase <= 16'd0;
+      bit_idx <= 4'd0;
     end else begin
-      if(frame_end) begin
-        tx_cnt <= 8'd0;
+      if(frame_begin) begin
+        phase <= 16'd0;
+        bit_idx <= 4'd0;
       end else if(tx_bsy) begin
-        tx_cnt <= tx_cnt + 1;
+        phase <= phase_next[15:0];
+        if(bit_tick) begin
+          bit_idx <= bit_idx + 1;
+        end 
       end 
     end
   end
 
+  // the byte is taken when the frame starts
 
   always @(posedge clk) begin
     if(rst) begin
       data2send <= 8'd0;
     end else begin
-      data2send <= send_data;
+      if(frame_begin) begin
+        data2send <= send_data;
+      end 
     end
   end
 
@@ -641,42 +1481,17 @@ module uart_tx
     if(rst) begin
       tx <= 1'b1;
     end else begin
-      if(tx_bsy) begin
-        case(tx_cnt)
-          TBITAT: begin
-            tx <= 1'b0;
-          end
-          BIT0AT: begin
-            tx <= data2send[0];
-          end
-          BIT1AT: begin
-            tx <= data2send[1];
-          end
-          BIT2AT: begin
-            tx <= data2send[2];
-          end
-          BIT3AT: begin
-            tx <= data2send[3];
-          end
-          BIT4AT: begin
-            tx <= data2send[4];
-          end
-          BIT5AT: begin
-            tx <= data2send[5];
-          end
-          BIT6AT: begin
-            tx <= data2send[6];
-          end
-          BIT7AT: begin
-            tx <= data2send[7];
-          end
-          PBITAT: begin
-            tx <= 1'b0;
-          end
-        endcase
-      end else begin
-        tx <= 1'b1;
-      end
+      if(frame_begin) begin
+        // START bit
+        tx <= 1'b0;
+      end else if(tx_bsy && bit_tick) begin
+        if(bit_idx < 4'd8) begin
+          tx <= data2send[bit_idx[2:0]];
+        end else begin
+          // STOP bit, then idle
+          tx <= 1'b1;
+        end
+      end 
     end
   end
 
@@ -684,7 +1499,8 @@ module uart_tx
   initial begin
     tx = 1;
     tx_bsy = 0;
-    tx_cnt = 0;
+    phase = 0;
+    bit_idx = 0;
     data2send = 0;
   end
 
@@ -696,24 +1512,35 @@ endmodule
 module riscv_rd_5_ird_6
 (
   input clk,
+  input ce,
   input rst,
   input monitor_read_on,
   input monitor_write_on,
-  input [8-1:0] monitor_addr,
-  output [8-1:0] mem_dataout,
-  output [8-1:0] reg_dataout
+  input monitor_write_inst,
+  input [32-1:0] monitor_addr,
+  input [32-1:0] monitor_data,
+  output [32-1:0] mem_dataout,
+  output [32-1:0] reg_dataout,
+  output [32-1:0] pc,
+  output regwrite,
+  output [5-1:0] rd,
+  output [32-1:0] inst,
+  output [32-1:0] writedata,
+  output branch_taken,
+  output memread,
+  output memwrite,
+  output [32-1:0] maddr
 );
 
-  wire [32-1:0] writedata;
-  wire [32-1:0] inst;
+  // debug: address of the instruction the next clock executes
+  // and the accesses it is going to make
+  // and the instruction word and the value it writes back
   wire [32-1:0] sigext;
   wire [32-1:0] data1;
   wire [32-1:0] data2;
   wire [32-1:0] aluout;
   wire [32-1:0] readdata;
   wire zero;
-  wire memread;
-  wire memwrite;
   wire memtoreg;
   wire branch;
   wire alusrc;
@@ -722,13 +1549,19 @@ module riscv_rd_5_ird_6
   // adaptacao para a interface serial controlar a execução do riscV
   // estágio de memoria
   wire mrd;
-  wire [32-1:0] maddr;
   assign mrd = |{ memread, monitor_read_on };
-  assign maddr = (monitor_read_on)? { 24'd0, monitor_addr } : aluout;
-  assign mem_dataout = readdata[7:0];
+  assign maddr = (|{ monitor_read_on, monitor_write_on })? monitor_addr : aluout;
+  assign mem_dataout = readdata;
+  // com monitor_write_on um pulso de clk grava monitor_data na memoria
+  // de instrucoes ou de dados; pc e banco de registradores ficam parados
+  wire mwr;
+  wire [32-1:0] mwdata;
+  assign mwr = (monitor_write_on)? ~monitor_write_inst : memwrite;
+  assign mwdata = (monitor_write_on)? monitor_data : data2;
   //*
   // estágio de decode
-  assign reg_dataout = data1[7:0];
+  assign reg_dataout = data1;
+  assign branch_taken = branch && zero;
   //*
   //*****
 
@@ -740,7 +1573,13 @@ module riscv_rd_5_ird_6
     .zero(zero),
     .branch(branch),
     .sigext(sigext),
-    .inst(inst)
+    .inst(inst),
+    .pc(pc),
+    .monitor_write_on(monitor_write_on),
+    .monitor_write_inst(monitor_write_inst),
+    .monitor_addr(monitor_addr),
+    .monitor_data(monitor_data),
+    .ce(ce)
   );
 
 
@@ -761,7 +1600,11 @@ module riscv_rd_5_ird_6
     .aluop(aluop),
     .funct(funct),
     .monitor_read_on(monitor_read_on),
-    .monitor_addr(monitor_addr[4:0])
+    .monitor_addr(monitor_addr[4:0]),
+    .regwrite(regwrite),
+    .rd(rd),
+    .monitor_write_on(monitor_write_on),
+    .ce(ce)
   );
 
 
@@ -784,10 +1627,11 @@ module riscv_rd_5_ird_6
   (
     .clk(clk),
     .address(maddr),
-    .writedata(data2),
+    .writedata(mwdata),
     .memread(mrd),
-    .memwrite(memwrite),
-    .readdata(readdata)
+    .memwrite(mwr),
+    .readdata(readdata),
+    .ce(ce)
   );
 
 
@@ -808,19 +1652,29 @@ endmodule
 module fetch
 (
   input clk,
+  input ce,
   input rst,
   input zero,
   input branch,
   input [32-1:0] sigext,
-  output [32-1:0] inst
+  output [32-1:0] inst,
+  output [32-1:0] pc,
+  input monitor_write_on,
+  input monitor_write_inst,
+  input [32-1:0] monitor_addr,
+  input [32-1:0] monitor_data
 );
 
-  wire [32-1:0] pc;
   wire [32-1:0] pc_4;
   wire [32-1:0] new_pc;
 
   assign pc_4 = 32'd4 + pc;
-  assign new_pc = (branch && zero)? pc + sigext : pc_4;
+  assign new_pc = (monitor_write_on)? pc : 
+                  (branch && zero)? pc + sigext : pc_4;
+  wire iwr;
+  wire [32-1:0] iaddr;
+  assign iwr = monitor_write_on && monitor_write_inst;
+  assign iaddr = (iwr)? monitor_addr : pc;
 
   pc
   fetch
@@ -828,7 +1682,8 @@ module fetch
     .clk(clk),
     .rst(rst),
     .pc_in(new_pc),
-    .pc_out(pc)
+    .pc_out(pc),
+    .ce(ce)
   );
 
 
@@ -836,10 +1691,12 @@ module fetch
   memory
   (
     .clk(clk),
-    .address(pc[31:2]),
+    .address(iaddr),
+    .writedata(monitor_data),
     .memread(1'b1),
-    .memwrite(1'b0),
-    .readdata(inst)
+    .memwrite(iwr),
+    .readdata(inst),
+    .ce(ce)
   );
 
 
@@ -850,6 +1707,7 @@ endmodule
 module pc
 (
   input clk,
+  input ce,
   input rst,
   input [32-1:0] pc_in,
   output reg [32-1:0] pc_out
@@ -857,7 +1715,9 @@ module pc
 
 
   always @(posedge clk) begin
-    pc_out <= pc_in;
+    if(ce) begin
+      pc_out <= pc_in;
+    end 
     if(rst) begin
       pc_out <= 32'd0;
     end 
@@ -876,6 +1736,7 @@ endmodule
 module memory
 (
   input clk,
+  input ce,
   input [32-1:0] address,
   input [32-1:0] writedata,
   input memread,
@@ -888,8 +1749,10 @@ module memory
   assign readdata = (memread)? memory[address[31:2]] : 32'd0;
 
   always @(posedge clk) begin
-    if(memwrite) begin
-      memory[address[31:2]] <= writedata;
+    if(ce) begin
+      if(memwrite) begin
+        memory[address[31:2]] <= writedata;
+      end 
     end 
   end
 
@@ -901,6 +1764,7 @@ endmodule
 module decode
 (
   input clk,
+  input ce,
   input [32-1:0] inst,
   input [32-1:0] writedata,
   output [32-1:0] data1,
@@ -914,13 +1778,15 @@ module decode
   output [2-1:0] aluop,
   output [10-1:0] funct,
   input monitor_read_on,
-  input [5-1:0] monitor_addr
+  input [5-1:0] monitor_addr,
+  input monitor_write_on,
+  output regwrite,
+  output [5-1:0] rd
 );
 
-  wire regwrite;
+  wire bank_we;
   wire [5-1:0] rs1;
   wire [5-1:0] rs2;
-  wire [5-1:0] rd;
   wire [7-1:0] opcode;
   wire [7-1:0] funct7;
   wire [3-1:0] funct3;
@@ -935,6 +1801,7 @@ module decode
   // adaptacao para a interface serial controlar a execução do riscV
   wire [5-1:0] raddr;
   assign raddr = (monitor_read_on)? monitor_addr : rs1;
+  assign bank_we = regwrite && ~monitor_write_on;
   // *****
 
   control_unit
@@ -957,13 +1824,14 @@ module decode
   register_bank
   (
     .clk(clk),
-    .regwrite(regwrite),
+    .regwrite(bank_we),
     .read_reg1(raddr),
     .read_reg2(rs2),
     .write_reg(rd),
     .writedata(writedata),
     .read_data1(data1),
-    .read_data2(data2)
+    .read_data2(data2),
+    .ce(ce)
   );
 
 
@@ -1049,6 +1917,7 @@ endmodule
 module register_bank
 (
   input clk,
+  input ce,
   input regwrite,
   input [5-1:0] read_reg1,
   input [5-1:0] read_reg2,
@@ -1064,8 +1933,10 @@ module register_bank
   assign read_data2 = reg_bank[read_reg2];
 
   always @(posedge clk) begin
-    if(regwrite) begin
-      reg_bank[write_reg] <= writedata;
+    if(ce) begin
+      if(regwrite) begin
+        reg_bank[write_reg] <= writedata;
+      end 
     end 
   end
 
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+
+import protocol as _p
+from uart_interface import UartInterface
+from monitor import RiscvMonitor
+
+
+def create_args():
+    parser = argparse.ArgumentParser('benchmark_host -h')
+    parser.add_argument(
+        '-u', '--url', help='Board url. Without it a local board_emulator is started', type=str, default=None)
+    parser.add_argument(
+        '-s', '--steps', help='Number of clock commands', type=int, default=1000)
+    parser.add_argument(
+        '-p', '--program', help='Program for the emulator', type=str, default=None)
+    parser.add_argument(
+        '-w', '--window', help='Pipeline clocks inside the rx fifo credit window', action='store_true')
+    parser.add_argument(
+        '-d', '--delta', help='Delta register dumps', action='store_true')
+    parser.add_argument(
+        '-W', '--wide', help='32 bit register dumps with the pc', action='store_true')
+    parser.add_argument(
+        '-f', '--framed', help='CRC framed protocol with retries', action='store_true')
+    parser.add_argument(
+        '-b', '--baudrate', help='Link baudrate (hw/interface.py -b must match)', type=int, default=3000000)
+    parser.add_argument(
+        '-j', '--json', help='Write link telemetry as JSON to this file', type=str, default=None)
+    parser.add_argument(
+        '-c', '--csv', help='Write link telemetry as CSV to this file', type=str, default=None)
+    return parser.parse_args()
+
+
+def start_emulator(program: str = None, baudrate: int = 0):
+    cmd = [sys.executable, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'board_emulator.py')]
+    if program:
+        cmd += ['-p', program]
+    if baudrate:
+        cmd += ['-b', str(baudrate)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    return proc, proc.stdout.readline().strip()
+
+
+async def main():
+    args = create_args()
+    proc = None
+    url = args.url
+    if url is None:
+        proc, url = start_emulator(args.program, args.baudrate)
+
+    u = UartInterface(url=url, baudrate=args.baudrate)
+    await u.start_listener()
+    monitor = RiscvMonitor(u, framed=args.framed)
+    await monitor.reset()
+    await monitor.read_counters(clear=True)
+    if args.delta or args.wide:
+        await monitor.set_dump_mode(delta=args.delta, wide=args.wide)
+
+    start = time.perf_counter()
+    if args.window:
+        await monitor.clock_many(args.steps)
+    else:
+        for _ in range(args.steps):
+            await monitor.clock()
+    elapsed = time.perf_counter() - start
+    print('%d steps in %.3f s: %.1f steps/s, %.1f us/step' % (
+        args.steps, elapsed, args.steps / elapsed, elapsed / args.steps * 1e6))
+    for name, d in u.telemetry.snapshot()['commands'].items():
+        share = '-' if d['wire_share'] is None else '%.0f%%' % (d['wire_share'] * 100)
+        print('%-6s n=%-6d mean %8.1f us  p99 <%8.0f us  wire %6.1f us (%s)' % (
+            name, d['count'], d['mean_us'], d['p99_us'], d['wire_us'], share))
+    free, flags = await monitor.credit()
+    print('rx fifo: %d free slots, overflow %s' % (free, bool(flags & _p.CREDIT_RX_OVERFLOW)))
+    c = await monitor.read_counters()
+    print('core: %d instructions in %d cycles (%d stalls), %d taken branches, %d loads, %d stores' % (
+        c['instret'], c['cycles'], c['stalls'], c['branches'], c['loads'], c['stores']))
+    if args.json:
+        u.telemetry.to_json(args.json)
+    if args.csv:
+        u.telemetry.to_csv(args.csv)
+
+    monitor.close()
+    u.stop_listener()
+    if proc is not None:
+        proc.terminate()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
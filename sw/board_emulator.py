@@ -0,0 +1,414 @@
+import os
+import sys
+import tty
+import time
+import random
+import struct
+import argparse
+import traceback
+
+import protocol as _p
+from riscv_model import RiscvModel, read_hex
+
+
+class BoardEmulator:
+    '''
+        Byte level stand-in for create_io_riscv_controller: feed() takes
+        the bytes the host wrote and returns the bytes the board would send.
+    '''
+
+    def __init__(self, model: RiscvModel, fifo_depth: int = _p.RX_FIFO_DEPTH, error_rate: float = 0.0,
+                 free_burst: int = 10000):
+        self.model = model
+        self.fifo_depth = fifo_depth
+        self.rx_overflow = False
+        self.rx = bytearray()
+        # set by the first FRAME_SYNC byte, as on the board
+        self.framed = False
+        self.rx_seq = 0
+        # a reply body went out after the last header: no tam 0 at the end
+        self.tx_body = False
+        # fraction of the bytes, both ways, that get a bit flipped
+        self.error_rate = error_rate
+        self.random = random.Random(0)
+        self.dump_mode = 0
+        # registers written since the last delta dump, one bit each
+        self.reg_dirty = 0
+        self.breakpoints = [None] * _p.N_BREAKPOINTS
+        # (kind bits, addr) per watchpoint
+        self.watchpoints = [None] * _p.N_WATCHPOINTS
+        # ring of (pc, inst, writeback value), laid out as on the board
+        self.trace = [(0, 0, 0)] * _p.TRACE_DEPTH
+        self.trace_wr = 0
+        self.trace_count = 0
+        self.trace_on = False
+        self.trace_triggered = False
+        self.trace_mode = 0
+        self.trace_pc = 0
+        self.trace_post = 0
+        self.counters = dict.fromkeys(_p.COUNTERS, 0)
+        # a free run goes on by free_burst clocks each time a command comes in
+        self.free_burst = free_burst
+        self.free_run = False
+        self.free_steps = 0
+        self.halt_reason = 0
+        # opcode -> handler; argument sizes come from protocol.command_args
+        self.commands = {
+            _p.PROT_PC_B_RESET: self.cmd_reset,
+            _p.PROT_PC_B_CLOCK: self.cmd_clock,
+            _p.PROT_PC_B_CREDIT: self.cmd_credit,
+            _p.PROT_PC_B_DUMP: self.cmd_dump,
+            _p.PROT_PC_B_RUN: self.cmd_run,
+            _p.PROT_PC_B_SET_BP: self.cmd_set_bp,
+            _p.PROT_PC_B_RUN_UNTIL: self.cmd_run_until,
+            _p.PROT_PC_B_SET_WP: self.cmd_set_wp,
+            _p.PROT_PC_B_DUMP_MODE: self.cmd_dump_mode,
+            _p.PROT_PC_B_READ_MEM: self.cmd_read_mem,
+            _p.PROT_PC_B_WRITE_MEM: self.cmd_write_mem,
+            _p.PROT_PC_B_SET_TRIGGER: self.cmd_set_trigger,
+            _p.PROT_PC_B_READ_TRACE: self.cmd_read_trace,
+            _p.PROT_PC_B_READ_COUNTERS: self.cmd_read_counters,
+            _p.PROT_PC_B_RUN_FREE: self.cmd_run_free,
+            _p.PROT_PC_B_HALT: self.cmd_halt,
+            _p.PROT_PC_B_STATUS: self.cmd_status,
+        }
+
+    def feed(self, data: bytes) -> bytes:
+        self.rx += self.corrupt(data)
+        # commands run instantly here, so a write bigger than the fifo is
+        # what would have overrun the board
+        if len(self.rx) > self.fifo_depth:
+            self.rx_overflow = True
+        out = bytearray()
+        while self.rx:
+            if not self.framed and self.rx[0] == _p.FRAME_SYNC:
+                self.framed = True
+            reply = self.feed_frame() if self.framed else self.feed_command()
+            if reply is None:
+                break
+            out += reply
+        return self.corrupt(out)
+
+    def corrupt(self, data) -> bytes:
+        if not self.error_rate:
+            return bytes(data)
+        data = bytearray(data)
+        for i in range(len(data)):
+            if self.random.random() < self.error_rate:
+                data[i] ^= 1 << self.random.randrange(8)
+        return bytes(data)
+
+    def feed_command(self):
+        # None until the whole command is in
+        handler = self.commands.get(self.rx[0])
+        size = _p.command_args(self.rx) if handler is not None else 0
+        if len(self.rx) < size + 1:
+            return None
+        opcode, args = self.rx[0], bytes(self.rx[1:size + 1])
+        del self.rx[:size + 1]
+        # unknown opcodes are dropped, like the FSM does
+        return self.dispatch(opcode, args) if handler is not None else b''
+
+    def dispatch(self, opcode: int, args: bytes) -> bytes:
+        if self.free_run:
+            self.advance(self.free_burst)
+            if opcode not in _p.FREE_RUN_PASSIVE:
+                self.free_run = False
+                self.halt_reason = 0
+        return self.commands[opcode](args)
+
+    def feed_frame(self):
+        rx = self.rx
+        if rx[0] != _p.FRAME_SYNC:
+            del rx[:1]
+            return b''
+        if len(rx) < 3:
+            return None
+        seq, size, resync = rx[1], rx[2] & _p.FRAME_LEN_MASK, rx[2] & _p.FRAME_RESYNC
+        if size == 0 or size > _p.FRAME_MAX:
+            del rx[:3]
+            self.tx_body = False
+            return self.frame_reply(self.rx_seq, _p.FRAME_NAK_CRC)
+        if len(rx) < size + _p.FRAME_OVERHEAD:
+            return None
+        frame = bytes(rx[:size + _p.FRAME_OVERHEAD])
+        del rx[:size + _p.FRAME_OVERHEAD]
+        self.tx_body = False
+        if _p.crc8(frame):
+            return self.frame_reply(self.rx_seq, _p.FRAME_NAK_CRC)
+        if seq != self.rx_seq and not resync:
+            return self.frame_reply(self.rx_seq, _p.FRAME_NAK_SEQ)
+        self.rx_seq = (seq + 1) & 0xff
+        command = frame[3:3 + size]
+        handler = self.commands.get(command[0])
+        if handler is None:
+            return self.frame_reply(seq, _p.FRAME_ACK)
+        # the FSM reads past the end of a short frame instead of waiting
+        args = command[1:].ljust(_p.command_args(command), b'\0')
+        return self.frame_reply(seq, _p.FRAME_ACK, self.dispatch(command[0], args))
+
+    def frame_reply(self, seq: int, status: int, reply: bytes = b'') -> bytes:
+        # FSM_FRAME_END: naks and commands without a reply answer with tam 0
+        self.tx_body = self.tx_body or bool(reply)
+        body = bytes([_p.FRAME_SYNC, seq, status]) + (reply if self.tx_body else self.frame([]))
+        return body + bytes([_p.crc8(body)])
+
+    def frame(self, payload) -> bytes:
+        return bytes([len(payload)]) + bytes(payload)
+
+    def step(self, rst: bool = False) -> dict:
+        # the trigger looks at the clock before it runs, as bp_hit does
+        hit = self.trace_on and not rst and (
+            (self.trace_mode & _p.TRACE_TRIG_PC and self.model.pc == self.trace_pc) or
+            (self.trace_mode & _p.TRACE_TRIG_HALT and bool(self.bp_hit() or self.wp_hit())))
+        e = self.model.step(rst)
+        if e['regwrite']:
+            self.reg_dirty |= 1 << e['rd']
+        if self.trace_on and not rst:
+            self.record(e, hit)
+        if not rst:
+            self.counters['instret'] += 1
+            self.counters['branches'] += e['branch_taken']
+            self.counters['loads'] += e['memread']
+            self.counters['stores'] += e['memwrite']
+        return e
+
+    def count_run(self, steps: int):
+        # FSM_RUN / FSM_RUN_UNTIL: a clock per step and the one that sees
+        # the end
+        self.counters['cycles'] += steps + 1
+        self.counters['stalls'] += 1
+
+    def record(self, e: dict, hit: bool):
+        self.trace[self.trace_wr] = (e['pc'], e['inst'], e['writedata'])
+        self.trace_wr = (self.trace_wr + 1) % _p.TRACE_DEPTH
+        self.trace_count = min(self.trace_count + 1, _p.TRACE_DEPTH)
+        if self.trace_triggered or hit:
+            self.trace_triggered = True
+            if self.trace_post == 1:
+                self.trace_on = False
+            if self.trace_post:
+                self.trace_post -= 1
+
+    def dump_regs(self) -> bytes:
+        mask = (1 << _p.N_REGS) - 1
+        out = b''
+        if self.dump_mode & _p.DUMP_DELTA:
+            mask, self.reg_dirty = self.reg_dirty, 0
+            out = mask.to_bytes(4, 'little')
+        values = [r for i, r in enumerate(self.model.regs) if mask >> i & 1]
+        if self.dump_mode & _p.DUMP_WIDE:
+            return self.frame(out + struct.pack('<%dI' % (len(values) + 1), *values, self.model.pc))
+        return self.frame(out + bytes([r & 0xff for r in values]))
+
+    def bp_hit(self) -> int:
+        return sum(1 << i for i, a in enumerate(self.breakpoints) if a == self.model.pc)
+
+    def wp_hit(self) -> int:
+        e = self.model.evaluate()
+        hit = 0
+        for i, wp in enumerate(self.watchpoints):
+            if wp is None:
+                continue
+            kind, addr = wp
+            same_word = addr >> 2 == e['maddr'] >> 2
+            if (kind & _p.WP_MEM_WRITE and e['memwrite'] and same_word) or \
+                    (kind & _p.WP_MEM_READ and e['memread'] and same_word) or \
+                    (kind & _p.WP_REG_WRITE and e['regwrite'] and addr == e['rd']):
+                hit |= 1 << i
+        return hit
+
+    def cmd_reset(self, args: bytes) -> bytes:
+        # FSM_RESET raises risc_rst and risc_pulse together
+        self.step(rst=True)
+        return b''
+
+    def cmd_clock(self, args: bytes) -> bytes:
+        self.step()
+        self.counters['cycles'] += 1
+        return self.dump_regs()
+
+    def cmd_dump(self, args: bytes) -> bytes:
+        return self.dump_regs()
+
+    def cmd_run(self, args: bytes) -> bytes:
+        steps = int.from_bytes(args, 'little')
+        for _ in range(steps):
+            self.step()
+        self.count_run(steps)
+        return self.dump_regs()
+
+    def cmd_set_bp(self, args: bytes) -> bytes:
+        idx = args[0] & (_p.N_BREAKPOINTS - 1)
+        self.breakpoints[idx] = int.from_bytes(args[1:5], 'little') if args[0] & _p.BP_ENABLE else None
+        return b''
+
+    def cmd_dump_mode(self, args: bytes) -> bytes:
+        self.dump_mode = args[0]
+        self.reg_dirty = (1 << _p.N_REGS) - 1
+        return b''
+
+    def cmd_read_mem(self, args: bytes) -> bytes:
+        addr = int.from_bytes(args[0:4], 'little')
+        n = args[4] & _p.READ_MEM_MAX
+        return self.frame(struct.pack('<%dI' % n, *[self.model.read_mem(addr + 4 * i) for i in range(n)]))
+
+    def cmd_write_mem(self, args: bytes) -> bytes:
+        target = args[0]
+        addr = int.from_bytes(args[1:5], 'little')
+        n = args[5]
+        words = struct.unpack_from('<%dI' % n, args, 6)
+        mem = self.model.inst_mem if target == _p.MEM_INST else self.model.mem
+        for i, w in enumerate(words):
+            index = ((addr >> 2) + i) & 0x3fffffff
+            if index < len(mem):
+                mem[index] = w
+        return self.frame([n])
+
+    def cmd_set_trigger(self, args: bytes) -> bytes:
+        self.trace_mode = args[0]
+        self.trace_pc = int.from_bytes(args[1:5], 'little')
+        self.trace_post = int.from_bytes(args[5:7], 'little')
+        self.trace_on = bool(self.trace_mode & _p.TRACE_ARM)
+        if self.trace_on:
+            self.trace_wr = 0
+            self.trace_count = 0
+            self.trace_triggered = not self.trace_mode & (_p.TRACE_TRIG_PC | _p.TRACE_TRIG_HALT)
+        return b''
+
+    def cmd_read_trace(self, args: bytes) -> bytes:
+        first = int.from_bytes(args[0:2], 'little')
+        n = args[2]
+        flags = (_p.TRACE_RECORDING if self.trace_on else 0) | (_p.TRACE_TRIGGERED if self.trace_triggered else 0)
+        out = struct.pack('<HBB', self.trace_count, flags, 0)
+        start = self.trace_wr - self.trace_count + first
+        for i in range(n):
+            out += struct.pack('<3I', *self.trace[(start + i) % _p.TRACE_DEPTH])
+        return self.frame(out)
+
+    def cmd_read_counters(self, args: bytes) -> bytes:
+        out = struct.pack('<%dQ' % len(_p.COUNTERS), *[self.counters[k] for k in _p.COUNTERS])
+        if args[0] & _p.COUNTERS_CLEAR:
+            self.counters = dict.fromkeys(_p.COUNTERS, 0)
+        return self.frame(out)
+
+    def cmd_set_wp(self, args: bytes) -> bytes:
+        idx = args[0] & (_p.N_WATCHPOINTS - 1)
+        kind = args[0] & (_p.WP_MEM_WRITE | _p.WP_MEM_READ | _p.WP_REG_WRITE)
+        enable = args[0] & _p.BP_ENABLE and kind
+        self.watchpoints[idx] = (kind, int.from_bytes(args[1:5], 'little')) if enable else None
+        return b''
+
+    def run_until(self, limit: int, steps: int = 0) -> tuple:
+        # (halt reason, steps) once a breakpoint or watchpoint stops the core
+        # or steps reaches limit
+        reason = 0
+        while True:
+            bp, wp = self.bp_hit(), self.wp_hit()
+            if (bp or wp) and steps:
+                reason = ((bp | wp) << 4) | (_p.HALT_BREAKPOINT if bp else 0) | \
+                    (_p.HALT_WATCHPOINT if wp else 0)
+                break
+            if steps == limit:
+                break
+            self.step()
+            steps += 1
+        return reason, steps
+
+    def halt_frame(self, reason: int, steps: int) -> bytes:
+        return self.frame(bytes([reason]) + self.model.pc.to_bytes(4, 'little') +
+                          (steps & 0xffffffff).to_bytes(4, 'little'))
+
+    def cmd_run_until(self, args: bytes) -> bytes:
+        reason, steps = self.run_until(int.from_bytes(args, 'little'))
+        self.count_run(steps)
+        return self.halt_frame(reason, steps)
+
+    def advance(self, n: int):
+        start = self.free_steps
+        self.halt_reason, self.free_steps = self.run_until(start + n, start)
+        # a step every clock, and the clock that sees a breakpoint stalls
+        self.counters['cycles'] += self.free_steps - start
+        if self.halt_reason:
+            self.counters['cycles'] += 1
+            self.counters['stalls'] += 1
+            self.free_run = False
+
+    def cmd_run_free(self, args: bytes) -> bytes:
+        self.free_run = True
+        self.free_steps = 0
+        self.halt_reason = 0
+        return b''
+
+    def cmd_halt(self, args: bytes) -> bytes:
+        if self.free_run:
+            self.halt_reason = 0
+        self.free_run = False
+        return self.cmd_status(args)
+
+    def cmd_status(self, args: bytes) -> bytes:
+        return self.halt_frame(self.halt_reason | (_p.STATUS_RUNNING if self.free_run else 0), self.free_steps)
+
+    def cmd_credit(self, args: bytes) -> bytes:
+        flags = _p.CREDIT_RX_OVERFLOW if self.rx_overflow else 0
+        self.rx_overflow = False
+        return self.frame([self.fifo_depth - len(self.rx), flags])
+
+
+def create_args():
+    parser = argparse.ArgumentParser('board_emulator -h')
+    parser.add_argument(
+        '-p', '--program', help='Instruction memory in $readmemh format', type=str, default=None)
+    parser.add_argument(
+        '-d', '--data', help='Data memory in $readmemh format', type=str, default=None)
+    parser.add_argument(
+        '-r', '--ram_depth', help='Data memory depth bits', type=int, default=5)
+    parser.add_argument(
+        '-i', '--inst_ram_depth', help='Instruction memory depth bits', type=int, default=5)
+    parser.add_argument(
+        '-b', '--baudrate', help='Pace replies at this baudrate (0 = no pacing)', type=int, default=0)
+    parser.add_argument(
+        '-l', '--link', help='Symlink to create for the pty', type=str, default=None)
+    parser.add_argument(
+        '-e', '--error_rate', help='Flip a bit in this fraction of the bytes, both ways', type=float, default=0.0)
+    parser.add_argument(
+        '-F', '--free_burst', help='Clocks a free run goes on by per command received', type=int, default=10000)
+    return parser.parse_args()
+
+
+def main():
+    args = create_args()
+    model = RiscvModel(args.ram_depth, args.inst_ram_depth)
+    model.load_program(read_hex(args.program) if args.program else [],
+                       read_hex(args.data) if args.data else None)
+    emulator = BoardEmulator(model, error_rate=args.error_rate, free_burst=args.free_burst)
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    if args.link:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(name, args.link)
+    print(name, flush=True)
+
+    try:
+        while True:
+            reply = emulator.feed(os.read(master, 4096))
+            if reply:
+                if args.baudrate:
+                    time.sleep(len(reply) * 10 / args.baudrate)
+                os.write(master, reply)
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
@@ -0,0 +1,171 @@
+import sys
+import time
+import queue
+import asyncio
+import argparse
+import threading
+import traceback
+
+from uart_interface import UartInterface
+from monitor import RiscvMonitor
+
+# FT2232H, the USB bridge on the Tang Nano 9K; interface 2 is the UART
+TANG_NANO_PID = 0x6010
+TANG_NANO_UART_IF = 2
+
+
+def list_ftdi_boards() -> list:
+    from pyftdi.ftdi import Ftdi
+    urls = []
+    for desc, _ in Ftdi.list_devices():
+        if desc.pid != TANG_NANO_PID:
+            continue
+        # the serial number survives replugging, bus:address does not
+        dev = desc.sn if desc.sn else '%d:%d' % (desc.bus, desc.address)
+        urls.append('ftdi://ftdi:2232:%s/%d' % (dev, TANG_NANO_UART_IF))
+    return urls
+
+
+class Job:
+    def __init__(self, name: str, test):
+        # test is an async callable taking a RiscvMonitor
+        self.name = name
+        self.test = test
+
+
+class JobResult:
+    def __init__(self, job: Job, board: str, result=None, error: str = None, elapsed: float = 0.0):
+        self.job = job
+        self.board = board
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<%s on %s: %s>' % (self.job.name, self.board,
+                                   'error' if self.error else 'ok')
+
+
+class BoardPool:
+    '''
+        One worker thread per board, all pulling from the same job queue.
+        Each worker owns its UartInterface and event loop, so a slow or
+        dead board only holds back the job it is running.
+    '''
+
+    def __init__(self, urls: list, baudrate: int = 3000000):
+        self.urls = urls
+        self.baudrate = baudrate
+        self.jobs = queue.Queue()
+        self.results = []
+        self.results_lock = threading.Lock()
+        self.workers = []
+
+    def submit(self, name: str, test):
+        self.jobs.put(Job(name, test))
+
+    def worker_routine(self, url: str):
+        asyncio.run(self.worker_main(url))
+
+    async def worker_main(self, url: str):
+        u = UartInterface(url=url, baudrate=self.baudrate)
+        await u.start_listener()
+        monitor = RiscvMonitor(u)
+        try:
+            while True:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                try:
+                    await monitor.reset()
+                    r = JobResult(job, url, result=await job.test(monitor))
+                except Exception:
+                    r = JobResult(job, url, error=traceback.format_exc())
+                r.elapsed = time.perf_counter() - start
+                with self.results_lock:
+                    self.results.append(r)
+        finally:
+            monitor.close()
+            u.stop_listener()
+
+    def run(self) -> list:
+        self.workers = [threading.Thread(target=self.worker_routine, args=[url], daemon=True)
+                        for url in self.urls]
+        for w in self.workers:
+            w.start()
+        for w in self.workers:
+            w.join()
+        return self.results
+
+    def summary(self) -> dict:
+        boards = {}
+        for r in self.results:
+            b = boards.setdefault(r.board, {'jobs': 0, 'errors': 0, 'busy_s': 0.0})
+            b['jobs'] += 1
+            b['errors'] += 1 if r.error else 0
+            b['busy_s'] += r.elapsed
+        return boards
+
+
+def create_args():
+    parser = argparse.ArgumentParser('board_pool -h')
+    parser.add_argument(
+        '-u', '--url', help='Board url (repeatable). Default: every attached FT2232', action='append', default=None)
+    parser.add_argument(
+        '-e', '--emulators', help='Use this many local board_emulator ptys instead of boards', type=int, default=0)
+    parser.add_argument(
+        '-p', '--program', help='Program for the emulators', type=str, default=None)
+    parser.add_argument(
+        '-b', '--baudrate', help='Link baudrate; emulators are paced at it', type=int, default=3000000)
+    parser.add_argument(
+        '-j', '--jobs', help='Number of jobs', type=int, default=16)
+    parser.add_argument(
+        '-s', '--steps', help='Clocks per job', type=int, default=1000)
+    return parser.parse_args()
+
+
+def main():
+    from benchmark_host import start_emulator
+    args = create_args()
+    procs = []
+    urls = args.url
+    if args.emulators:
+        urls = []
+        for _ in range(args.emulators):
+            proc, url = start_emulator(args.program, args.baudrate)
+            procs.append(proc)
+            urls.append(url)
+    if not urls:
+        urls = list_ftdi_boards()
+    if not urls:
+        print('no boards found', file=sys.stderr)
+        return
+
+    async def run_steps(monitor: RiscvMonitor):
+        regs = await monitor.clock_many(args.steps)
+        return regs[-1]
+
+    pool = BoardPool(urls, args.baudrate)
+    for i in range(args.jobs):
+        pool.submit('job%d' % i, run_steps)
+    start = time.perf_counter()
+    results = pool.run()
+    elapsed = time.perf_counter() - start
+
+    for url, b in pool.summary().items():
+        print('%-40s %4d jobs %2d errors busy %.3f s' % (url, b['jobs'], b['errors'], b['busy_s']))
+    for r in results:
+        if r.error:
+            print(r, r.error, file=sys.stderr)
+    steps = args.jobs * args.steps
+    print('%d jobs on %d boards in %.3f s: %.1f steps/s' % (
+        args.jobs, len(urls), elapsed, steps / elapsed))
+
+    for proc in procs:
+        proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+import sys
+import asyncio
+import argparse
+
+import protocol as _p
+from uart_interface import UartInterface
+from monitor import RiscvMonitor
+from riscv_model import read_hex
+from state_cache import StateCache
+
+# stop signals: SIGTRAP for steps, breakpoints and watchpoints, SIGINT for ^C
+SIGINT = 2
+SIGTRAP = 5
+# seconds between STATUS polls while the core runs free
+POLL_INTERVAL = 0.05
+
+ABI_NAMES = ['zero', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 'fp', 's1'] + \
+    ['a%d' % i for i in range(8)] + ['s%d' % i for i in range(2, 12)] + ['t%d' % i for i in range(3, 7)]
+
+TARGET_XML = '<?xml version="1.0"?><!DOCTYPE target SYSTEM "gdb-target.dtd"><target version="1.0">' \
+    '<architecture>riscv:rv32</architecture><feature name="org.gnu.gdb.riscv.cpu">' + \
+    ''.join('<reg name="%s" bitsize="32" type="%s" regnum="%d"/>' %
+            (name, 'data_ptr' if name in ('sp', 'fp') else 'int', i) for i, name in enumerate(ABI_NAMES)) + \
+    '<reg name="pc" bitsize="32" type="code_ptr" regnum="32"/></feature></target>'
+
+# Z/z type -> watchpoint kind; types 0 and 1 are the pc breakpoints
+WATCH_KINDS = {
+    2: _p.WP_MEM_WRITE,
+    3: _p.WP_MEM_READ,
+    4: _p.WP_MEM_WRITE | _p.WP_MEM_READ,
+}
+WATCH_STOP = {
+    _p.WP_MEM_WRITE: 'watch',
+    _p.WP_MEM_READ: 'rwatch',
+    _p.WP_MEM_WRITE | _p.WP_MEM_READ: 'awatch',
+}
+
+
+def checksum(payload: bytes) -> int:
+    return sum(payload) & 0xff
+
+
+def hex_le(value: int) -> str:
+    return (value & 0xffffffff).to_bytes(4, 'little').hex()
+
+
+class GdbServer:
+    '''
+        GDB remote serial protocol in front of a RiscvMonitor, for
+        `target remote host:port` from riscv64-unknown-elf-gdb. One client at
+        a time. Memory packets address the data memory: the monitor can
+        write the instruction memory but not read it back.
+
+        Registers and memory come from a StateCache, so gdb walking the
+        same frame only goes to the board once and a step only refetches
+        what it wrote. Z0/Z1 use the hardware breakpoints and Z2-Z4 the
+        watchpoints, nothing is patched into the program; c runs the core
+        free and polls STATUS, which leaves it running, so a ^C from gdb
+        can still halt it.
+    '''
+
+    def __init__(self, monitor: RiscvMonitor):
+        self.monitor = monitor
+        self.cache = StateCache(monitor)
+        self.breakpoints = [None] * _p.N_BREAKPOINTS
+        # (kind, addr) per watchpoint
+        self.watchpoints = [None] * _p.N_WATCHPOINTS
+        self.no_ack = False
+        self.interrupt = asyncio.Event()
+        self.packets = {
+            '?': self.cmd_stop_reason,
+            'g': self.cmd_read_regs,
+            'G': self.cmd_write_regs,
+            'p': self.cmd_read_reg,
+            'P': self.cmd_write_reg,
+            'm': self.cmd_read_mem,
+            'M': self.cmd_write_mem,
+            's': self.cmd_step,
+            'c': self.cmd_continue,
+            'Z': self.cmd_insert_point,
+            'z': self.cmd_remove_point,
+            'q': self.cmd_query,
+            'Q': self.cmd_set,
+            'H': self.cmd_ok,
+            'D': self.cmd_ok,
+        }
+
+    async def start(self, program: list = None):
+        await self.cache.start()
+        if program is not None:
+            # through the cache, so a step knows what it writes
+            await self.cache.load_program(program)
+
+    async def registers(self) -> list:
+        return await self.cache.registers() + [await self.cache.get_pc()]
+
+    async def read_words(self, first: int, last: int) -> list:
+        return await self.cache.read(first * 4, last - first + 1)
+
+    async def cmd_stop_reason(self, args: str) -> str:
+        return 'S%02x' % SIGTRAP
+
+    async def cmd_read_regs(self, args: str) -> str:
+        return ''.join(hex_le(r) for r in await self.registers())
+
+    async def cmd_write_regs(self, args: str) -> str:
+        # the monitor cannot write registers; gdb writing back what it read is fine
+        regs = await self.registers()
+        values = [int.from_bytes(bytes.fromhex(args[i:i + 8]), 'little') for i in range(0, len(args), 8)]
+        return 'OK' if values == regs[:len(values)] else 'E01'
+
+    async def cmd_read_reg(self, args: str) -> str:
+        regs = await self.registers()
+        n = int(args, 16)
+        return hex_le(regs[n]) if n < len(regs) else 'E01'
+
+    async def cmd_write_reg(self, args: str) -> str:
+        n, value = args.split('=')
+        regs = await self.registers()
+        n = int(n, 16)
+        if n >= len(regs) or int.from_bytes(bytes.fromhex(value), 'little') != regs[n]:
+            return 'E01'
+        return 'OK'
+
+    async def cmd_read_mem(self, args: str) -> str:
+        addr, size = [int(x, 16) for x in args.split(',')]
+        if size == 0:
+            return ''
+        words = await self.read_words(addr >> 2, (addr + size - 1) >> 2)
+        data = b''.join(w.to_bytes(4, 'little') for w in words)
+        return data[addr & 3:(addr & 3) + size].hex()
+
+    async def cmd_write_mem(self, args: str) -> str:
+        header, data = args.split(':')
+        addr, size = [int(x, 16) for x in header.split(',')]
+        data = bytes.fromhex(data)[:size]
+        if not data:
+            return 'OK'
+        first, last = addr >> 2, (addr + len(data) - 1) >> 2
+        # partial words keep the bytes around them
+        if addr & 3 or (addr + len(data)) & 3:
+            old = await self.read_words(first, last)
+        else:
+            old = [0] * (last - first + 1)
+        buf = bytearray(b''.join(w.to_bytes(4, 'little') for w in old))
+        buf[addr & 3:(addr & 3) + len(data)] = data
+        words = [int.from_bytes(buf[i:i + 4], 'little') for i in range(0, len(buf), 4)]
+        await self.cache.write(_p.MEM_DATA, first * 4, words)
+        return 'OK'
+
+    async def cmd_step(self, args: str) -> str:
+        if args:
+            return 'E01'
+        await self.cache.step()
+        return 'S%02x' % SIGTRAP
+
+    async def cmd_continue(self, args: str) -> str:
+        if args:
+            return 'E01'
+        self.interrupt.clear()
+        await self.cache.run_free()
+        while True:
+            try:
+                await asyncio.wait_for(self.interrupt.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                status = await self.cache.status()
+                if status['running']:
+                    continue
+                break
+            status = await self.cache.halt()
+            break
+        if status['watchpoint']:
+            for i in status['hits']:
+                if self.watchpoints[i] is not None:
+                    kind, addr = self.watchpoints[i]
+                    return 'T%02x%s:%x;' % (SIGTRAP, WATCH_STOP[kind], addr)
+        if status['breakpoint']:
+            return 'T%02xhwbreak:;' % SIGTRAP
+        return 'S%02x' % (SIGINT if self.interrupt.is_set() else SIGTRAP)
+
+    async def cmd_insert_point(self, args: str) -> str:
+        kind, addr, _ = [int(x, 16) for x in args.split(',')]
+        if kind in (0, 1):
+            if addr in self.breakpoints:
+                return 'OK'
+            if None not in self.breakpoints:
+                return 'E01'
+            idx = self.breakpoints.index(None)
+            self.breakpoints[idx] = addr
+            await self.monitor.set_breakpoint(idx, addr)
+            return 'OK'
+        if kind not in WATCH_KINDS:
+            return ''
+        point = (WATCH_KINDS[kind], addr)
+        if point in self.watchpoints:
+            return 'OK'
+        if None not in self.watchpoints:
+            return 'E01'
+        idx = self.watchpoints.index(None)
+        self.watchpoints[idx] = point
+        await self.monitor.set_watchpoint(idx, addr, point[0])
+        return 'OK'
+
+    async def cmd_remove_point(self, args: str) -> str:
+        kind, addr, _ = [int(x, 16) for x in args.split(',')]
+        if kind in (0, 1):
+            if addr in self.breakpoints:
+                idx = self.breakpoints.index(addr)
+                self.breakpoints[idx] = None
+                await self.monitor.set_breakpoint(idx, addr, enable=False)
+            return 'OK'
+        if kind not in WATCH_KINDS:
+            return ''
+        point = (WATCH_KINDS[kind], addr)
+        if point in self.watchpoints:
+            idx = self.watchpoints.index(point)
+            self.watchpoints[idx] = None
+            await self.monitor.set_watchpoint(idx, addr, enable=False)
+        return 'OK'
+
+    async def cmd_query(self, args: str) -> str:
+        if args.startswith('Supported'):
+            return 'PacketSize=1000;QStartNoAckMode+;qXfer:features:read+;hwbreak+'
+        if args.startswith('Xfer:features:read:target.xml:'):
+            offset, length = [int(x, 16) for x in args.split(':')[-1].split(',')]
+            chunk = TARGET_XML[offset:offset + length]
+            return ('m' if offset + length < len(TARGET_XML) else 'l') + chunk
+        if args == 'Attached':
+            return '1'
+        if args == 'C':
+            return 'QC1'
+        if args == 'fThreadInfo':
+            return 'm1'
+        if args == 'sThreadInfo':
+            return 'l'
+        return ''
+
+    async def cmd_set(self, args: str) -> str:
+        if args == 'StartNoAckMode':
+            self.no_ack = True
+            return 'OK'
+        return ''
+
+    async def cmd_ok(self, args: str) -> str:
+        return 'OK'
+
+    async def handle(self, packet: str) -> str:
+        handler = self.packets.get(packet[:1])
+        if handler is None:
+            return ''
+        try:
+            return await handler(packet[1:])
+        except (ValueError, IndexError):
+            return 'E01'
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            # the board did not answer: gdb shows the error and can try again
+            print('%s: %r' % (packet[:1], e), file=sys.stderr)
+            return 'E01'
+
+    def send(self, writer: asyncio.StreamWriter, payload: str):
+        data = payload.encode()
+        writer.write(b'$' + data + b'#%02x' % checksum(data))
+
+    async def packet_routine(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                             packets: asyncio.Queue):
+        # acks and packets in, ^C sets interrupt even while a packet is served
+        buf = bytearray()
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            buf += data
+            while buf:
+                if buf[0] == 0x03:
+                    self.interrupt.set()
+                    del buf[:1]
+                    continue
+                if buf[0] != ord('$'):
+                    del buf[:1]
+                    continue
+                end = buf.find(b'#')
+                if end < 0 or len(buf) < end + 3:
+                    break
+                payload = bytes(buf[1:end])
+                ok = int(buf[end + 1:end + 3], 16) == checksum(payload)
+                del buf[:end + 3]
+                if not self.no_ack:
+                    writer.write(b'+' if ok else b'-')
+                if ok:
+                    packets.put_nowait(payload.decode())
+        packets.put_nowait(None)
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.no_ack = False
+        packets = asyncio.Queue()
+        receiver = asyncio.create_task(self.packet_routine(reader, writer, packets))
+        try:
+            while True:
+                packet = await packets.get()
+                if packet is None or packet == 'k':
+                    break
+                self.send(writer, await self.handle(packet))
+                await writer.drain()
+                if packet == 'D':
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            receiver.cancel()
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 3333):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def create_args():
+    parser = argparse.ArgumentParser('gdb_server -h')
+    parser.add_argument(
+        '-u', '--url', help='Board url. Without it a local board_emulator is started', type=str, default=None)
+    parser.add_argument(
+        '-p', '--program', help='Program to load ($readmemh format)', type=str, default=None)
+    parser.add_argument(
+        '-b', '--baudrate', help='Serial baudrate', type=int, default=3000000)
+    parser.add_argument(
+        '-H', '--host', help='Address to listen on', type=str, default='127.0.0.1')
+    parser.add_argument(
+        '-P', '--port', help='TCP port to listen on', type=int, default=3333)
+    parser.add_argument(
+        '-f', '--framed', help='CRC framed protocol with retries towards the board', action='store_true')
+    return parser.parse_args()
+
+
+async def main():
+    from benchmark_host import start_emulator
+    args = create_args()
+    proc = None
+    url = args.url
+    if url is None:
+        proc, url = start_emulator()
+    u = UartInterface(url=url, baudrate=args.baudrate)
+    await u.start_listener()
+    server = GdbServer(RiscvMonitor(u, framed=args.framed))
+    await server.start(read_hex(args.program) if args.program else None)
+    print('gdb: target remote %s:%d (%s)' % (args.host, args.port, url), flush=True)
+    try:
+        await server.serve(args.host, args.port)
+    finally:
+        print('%d board reads, %d served from the cache' % (server.cache.misses, server.cache.hits),
+              file=sys.stderr)
+        u.stop_listener()
+        if proc is not None:
+            proc.terminate()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
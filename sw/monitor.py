@@ -0,0 +1,520 @@
+import time
+import struct
+import asyncio
+import functools
+import collections
+import numpy as np
+import protocol as _p
+from uart_interface import UartInterface
+
+# commands that can simply run again when their reply was lost (a delta
+# dump after the registers are marked written again)
+RETRY_LOST = {_p.PROT_PC_B_READ_MEM, _p.PROT_PC_B_CREDIT, _p.PROT_PC_B_READ_TRACE, _p.PROT_PC_B_DUMP}
+
+# commands answered with a register dump
+DUMPS = {_p.PROT_PC_B_CLOCK, _p.PROT_PC_B_DUMP, _p.PROT_PC_B_RUN}
+
+# one read trace entry, as the board sends it
+TRACE_DTYPE = np.dtype([('pc', '<u4'), ('inst', '<u4'), ('value', '<u4')])
+
+
+def as_words(data) -> np.ndarray:
+    # little endian bytes (e.g. a flat binary) or a list of words
+    if isinstance(data, (bytes, bytearray)):
+        return np.frombuffer(bytes(data) + bytes(-len(data) % 4), dtype='<u4')
+    return np.asarray(data, dtype='<u4')
+
+
+class CreditWindow:
+    '''
+        Host side view of the board rx fifo. Command bytes are in flight
+        from the write until the reply of that command, or of any later one,
+        comes back. One slot is kept for a CREDIT query so the window can
+        always be resynchronised.
+    '''
+
+    def __init__(self, depth: int = _p.RX_FIFO_DEPTH):
+        self.depth = depth
+        self.sent = 0
+        self.consumed = 0
+
+    def in_flight(self) -> int:
+        return self.sent - self.consumed
+
+    def available(self, reserve: int = 1) -> int:
+        return self.depth - reserve - self.in_flight()
+
+    def on_send(self, n: int) -> int:
+        # returns the mark the reply of this command releases up to
+        self.sent += n
+        return self.sent
+
+    def on_reply(self, mark: int):
+        self.consumed = max(self.consumed, mark)
+
+
+class Command:
+    def __init__(self, name: str, data: bytes, fut=None, decode=None, hold: float = 0.0):
+        self.name = name
+        self.data = data
+        # None when nobody waits for the reply
+        self.fut = fut
+        self.decode = decode
+        # seconds the board may spend on it before a framed retry (None: no retry)
+        self.hold = hold
+        self.start = 0.0
+        self.mark = 0
+        self.seq = 0
+        self.sends = 0
+        # resends this command caused itself: its own nak, timeout or lost reply,
+        # counted once per send (blamed: the send already counted)
+        self.retries = 0
+        self.blamed = 0
+        self.done = False
+
+    def finish(self, result=None, error: Exception = None):
+        self.done = True
+        # a command that timed out on the caller side is still finished here
+        if self.fut is None or self.fut.done():
+            return
+        if error is None and self.decode is not None:
+            try:
+                result = self.decode(result)
+            except ConnectionError as e:
+                error = e
+        if error is not None:
+            self.fut.set_exception(error)
+        else:
+            self.fut.set_result(result)
+
+
+class RiscvMonitor:
+    '''
+        framed=True talks the crc framed protocol: every command is
+        answered, a frame the board rejects is sent again together with
+        everything sent after it (the board drops those), and so is the
+        oldest command when nothing came back for retry_timeout. A command
+        that ran but whose reply was lost fails with ConnectionError. A
+        lost delta dump sets the dump mode again, so the next delta carries
+        every register; dumps decoded before that fail too.
+    '''
+
+    def __init__(self, uart: UartInterface, fifo_depth: int = _p.RX_FIFO_DEPTH, framed: bool = False,
+                 retry_timeout: float = 0.2, max_retries: int = 8):
+        self.uart = uart
+        self.telemetry = uart.telemetry
+        self.window = CreditWindow(fifo_depth)
+        # commands waiting for a reply, oldest first; the board answers in order
+        self.pending = collections.deque()
+        self.replied = None
+        self.reader = None
+        self.overflows = 0
+        self.framed = framed
+        uart.crc_frames = framed
+        self.overhead = _p.FRAME_OVERHEAD if framed else 0
+        self.retry_timeout = retry_timeout
+        self.max_retries = max_retries
+        self.seq = 0
+        # the first frame tells the board which seq comes next
+        self.resync = True
+        # newest seq the board said it expects (None: nothing heard yet); it
+        # only moves on, so stale answers cannot take it back
+        self.board_seq = None
+        # framed: commands to send again, and (credit mark, command, try) of
+        # every frame on the wire in send order; each one gets one answer
+        self.backlog = collections.deque()
+        self.on_wire = collections.deque()
+        self.head_since = 0.0
+        # (bytes, future) of the newest command on the wire
+        self.last_command = None
+        # host copy of the registers, patched by every dump in reply order
+        self.regs = [0] * _p.N_REGS
+        self.pc = None
+        # False from a lost delta dump until a dump carries every register;
+        # resync_cmd: the DUMP_MODE sent to get them all again
+        self.regs_valid = True
+        self.resync_cmd = None
+        self.dump_delta = False
+        self.dump_wide = False
+
+    async def reader_routine(self):
+        while True:
+            if self.framed:
+                try:
+                    frame = await self.uart.get_frame(self.head_timeout())
+                except asyncio.TimeoutError:
+                    if self.pending:
+                        self.on_timeout()
+                        self.replied.set()
+                    continue
+                self.on_frames([frame] + self.uart.get_frames_nowait())
+                self.replied.set()
+                continue
+            frame = await self.uart.get_frame()
+            if not self.pending:
+                continue
+            cmd = self.pending.popleft()
+            # a command that timed out still releases its credits
+            self.window.on_reply(cmd.mark)
+            self.telemetry.record(cmd.name, time.perf_counter() - cmd.start, len(cmd.data) + 1 + len(frame))
+            cmd.finish(frame)
+            self.replied.set()
+
+    def head_timeout(self):
+        # with nothing pending, wake up now and then to see a new command
+        if not self.pending:
+            return self.retry_timeout
+        if self.pending[0].hold is None:
+            return None
+        return max(0.0, self.head_since + self.retry_timeout + self.pending[0].hold - time.perf_counter())
+
+    def send_frame(self, cmd: Command):
+        flags = _p.FRAME_RESYNC if self.resync else 0
+        self.resync = False
+        frame = _p.pack_frame(cmd.seq, cmd.data, flags)
+        cmd.start = time.perf_counter()
+        if cmd is self.pending[0]:
+            self.head_since = cmd.start
+        cmd.sends += 1
+        self.uart.send_data(frame)
+        cmd.mark = self.window.on_send(len(frame))
+        self.on_wire.append((cmd.mark, cmd, cmd.sends))
+
+    def pump(self):
+        # resent frames go out as credits come back, ahead of new commands
+        while self.backlog and (self.backlog[0].done or
+                                self.window.available(0) >= len(self.backlog[0].data) + self.overhead):
+            cmd = self.backlog.popleft()
+            if not cmd.done:
+                self.send_frame(cmd)
+
+    def on_frames(self, frames: list):
+        # answers queued behind each other are taken in one go: a run of
+        # stale naks then costs one go back, from the newest seq the board sent
+        back = None
+        for frame in frames:
+            back = self.on_frame(frame, back)
+        if back is not None:
+            self.go_back(self.board_seq, back)
+        self.pump()
+
+    def on_frame(self, frame: bytes, back: int = None) -> int:
+        # frame: [seq][status][tam][tam bytes]; returns the credit mark of
+        # the frame a go back is owed to (None: none)
+        seq, status = frame[0], frame[1]
+        self.on_board_seq((seq + 1) & 0xff if status == _p.FRAME_ACK else seq)
+        answered = None
+        if self.on_wire:
+            mark, answered, tried = self.on_wire.popleft()
+            self.window.on_reply(mark)
+        if status == _p.FRAME_ACK:
+            self.drop_lost(seq)
+            # anything else acked is a duplicate of a command already done
+            if self.pending and self.pending[0].seq == seq:
+                cmd = self.pending.popleft()
+                now = time.perf_counter()
+                self.head_since = now
+                self.telemetry.record(cmd.name, now - cmd.start,
+                                      len(cmd.data) + self.overhead + len(frame) + 2)
+                # answers that never made it leave older frames in front
+                while answered is not cmd and self.on_wire:
+                    mark, answered, tried = self.on_wire.popleft()
+                    self.window.on_reply(mark)
+                if cmd.data[0] == _p.PROT_PC_B_DUMP and self.resync_cmd is not None \
+                        and not self.resync_cmd.done:
+                    # ran before the resync, its delta misses what the lost one took
+                    self.requeue(cmd)
+                else:
+                    cmd.finish(frame[3:])
+                # the board took the head after any nak before it
+                return None
+            return back
+        # whatever nak it is, the commands before the seq it carries ran
+        self.drop_lost(self.board_seq)
+        # naks to frames that were already sent again are stale
+        if answered in self.pending and tried == answered.sends:
+            return mark
+        return back
+
+    def on_board_seq(self, seq: int):
+        if self.board_seq is None or 0 < (seq - self.board_seq) & 0xff < 0x80:
+            self.board_seq = seq
+
+    def on_timeout(self):
+        # nothing came back: whatever was on the wire is gone
+        self.on_wire.clear()
+        self.window.on_reply(self.window.sent)
+        self.go_back(self.pending[0].seq if self.board_seq is None else self.board_seq)
+        self.pump()
+
+    def drop_lost(self, seq: int):
+        # commands before seq ran, only their replies were lost
+        while self.pending and 0 < (seq - self.pending[0].seq) & 0xff < 0x80:
+            cmd = self.pending.popleft()
+            self.blame(cmd)
+            if cmd.data[0] in DUMPS and self.dump_delta:
+                # the board cleared the written bits that delta carried
+                self.resync_dump()
+            if cmd.data[0] in RETRY_LOST and cmd.retries <= self.max_retries:
+                self.requeue(cmd)
+                continue
+            cmd.finish(error=ConnectionError('%s ran but its reply was lost' % cmd.name))
+
+    def requeue(self, cmd: Command):
+        # again, under a new seq behind everything sent so far
+        cmd.seq = self.seq
+        self.seq = (self.seq + 1) & 0xff
+        self.pending.append(cmd)
+        self.backlog.append(cmd)
+
+    def resync_dump(self):
+        # setting the mode again marks every register as written, so the next
+        # delta brings the whole mirror back
+        self.regs_valid = False
+        mode = (_p.DUMP_DELTA if self.dump_delta else 0) | (_p.DUMP_WIDE if self.dump_wide else 0)
+        self.resync_cmd = Command('dump_mode', bytes([_p.PROT_PC_B_DUMP_MODE, mode]))
+        self.requeue(self.resync_cmd)
+
+    def blame(self, cmd: Command):
+        # one retry per send, however many naks and timeouts point at it
+        if cmd.blamed != cmd.sends:
+            cmd.blamed = cmd.sends
+            cmd.retries += 1
+
+    def go_back(self, expected: int, mark: int = None):
+        self.drop_lost(expected)
+        # only the command the board is waiting for is to blame, the ones
+        # behind it just go out again with it. A nak (mark: of the frame it
+        # answers) only says its last send was lost if that frame left after it
+        if self.pending and (mark is None or mark >= self.pending[0].mark):
+            self.blame(self.pending[0])
+        if self.pending and self.pending[0].retries > self.max_retries:
+            cmd = self.pending.popleft()
+            cmd.finish(error=ConnectionError('%s: no ack after %d tries' % (cmd.name, cmd.retries)))
+        if self.pending and self.pending[0].seq != expected:
+            self.resync = True
+        self.backlog.clear()
+        self.backlog.extend(self.pending)
+        self.telemetry.on_retransmit(len(self.backlog))
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            self.reader = None
+
+    async def submit(self, name: str, data: bytes, reply: bool = True, reserve: int = 1, decode=None,
+                     hold: float = 0.0):
+        if self.reader is None:
+            self.replied = asyncio.Event()
+            self.reader = asyncio.create_task(self.reader_routine())
+        if self.framed:
+            if len(data) > _p.FRAME_MAX:
+                raise ValueError('%s: %d bytes do not fit in a frame' % (name, len(data)))
+            # every frame is answered, no CREDIT slot to keep
+            reserve = 0
+        while self.backlog or self.window.available(reserve) < len(data) + self.overhead:
+            if not self.pending and self.framed:
+                # only answers to frames sent twice are out: wait for them
+                # a while, then count them as lost
+                self.replied.clear()
+                try:
+                    await asyncio.wait_for(self.replied.wait(), self.retry_timeout)
+                except asyncio.TimeoutError:
+                    self.on_wire.clear()
+                    self.window.on_reply(self.window.sent)
+                continue
+            if not self.pending:
+                # only reply-less commands are in flight: ask the board
+                await self.credit()
+                continue
+            self.replied.clear()
+            await self.replied.wait()
+        fut = asyncio.get_running_loop().create_future() if reply else None
+        cmd = Command(name, bytes(data), fut, decode, hold)
+        self.last_command = (cmd.data, fut)
+        if self.framed:
+            cmd.seq = self.seq
+            self.seq = (self.seq + 1) & 0xff
+            self.pending.append(cmd)
+            self.send_frame(cmd)
+            return fut
+        cmd.start = time.perf_counter()
+        self.uart.send_data(data)
+        cmd.mark = self.window.on_send(len(data))
+        if not reply:
+            # no reply: only the host side of the write is measured
+            self.telemetry.record(name, time.perf_counter() - cmd.start, len(data))
+            return None
+        self.pending.append(cmd)
+        return fut
+
+    def decode_dump(self, frame: bytes, delta: bool, wide: bool) -> list:
+        offset = 4 if delta else 0
+        if wide:
+            # one pass over the packed little endian words, pc last
+            values = struct.unpack_from('<%dI' % ((len(frame) - offset) // 4), frame, offset)
+            self.pc = values[-1]
+            values = values[:-1]
+        else:
+            values = frame[offset:]
+        if delta:
+            mask = int.from_bytes(frame[0:4], 'little')
+            it = iter(values)
+            for i in range(_p.N_REGS):
+                if mask >> i & 1:
+                    self.regs[i] = next(it)
+            if mask == (1 << _p.N_REGS) - 1:
+                self.regs_valid = True
+        else:
+            self.regs[:] = values
+            self.regs_valid = True
+        if not self.regs_valid:
+            raise ConnectionError('registers out of sync after a lost dump')
+        return list(self.regs)
+
+    def dump_decoder(self):
+        # a reply is decoded in the mode that was set when its command was sent
+        return functools.partial(self.decode_dump, delta=self.dump_delta, wide=self.dump_wide)
+
+    async def set_dump_mode(self, delta: bool = True, wide: bool = False):
+        mode = (_p.DUMP_DELTA if delta else 0) | (_p.DUMP_WIDE if wide else 0)
+        await self.submit('dump_mode', bytes([_p.PROT_PC_B_DUMP_MODE, mode]), reply=False)
+        self.dump_delta = delta
+        self.dump_wide = wide
+
+    async def reset(self):
+        await self.submit('reset', bytes([_p.PROT_PC_B_RESET]), reply=False)
+
+    async def clock(self, timeout: float = 1.0) -> list:
+        fut = await self.submit('clock', bytes([_p.PROT_PC_B_CLOCK]), decode=self.dump_decoder())
+        return await asyncio.wait_for(fut, timeout)
+
+    async def dump(self, timeout: float = 1.0) -> list:
+        fut = await self.submit('dump', bytes([_p.PROT_PC_B_DUMP]), decode=self.dump_decoder())
+        return await asyncio.wait_for(fut, timeout)
+
+    async def run(self, n: int, timeout: float = 1.0) -> list:
+        # n clocks in hardware and a single dump; timeout is on top of the run time
+        fut = await self.submit('run', bytes([_p.PROT_PC_B_RUN]) + n.to_bytes(4, 'little'),
+                                decode=self.dump_decoder(), hold=n / _p.CORE_CLOCK_HZ)
+        return await asyncio.wait_for(fut, timeout + n / _p.CORE_CLOCK_HZ)
+
+    async def set_breakpoint(self, idx: int, addr: int, enable: bool = True):
+        flags = idx | (_p.BP_ENABLE if enable else 0)
+        await self.submit('set_bp', bytes([_p.PROT_PC_B_SET_BP, flags]) + addr.to_bytes(4, 'little'),
+                          reply=False)
+
+    async def set_watchpoint(self, idx: int, addr: int, kind: int = _p.WP_MEM_WRITE, enable: bool = True):
+        # kind: WP_MEM_WRITE / WP_MEM_READ on a data address, WP_REG_WRITE on a register number
+        flags = idx | kind | (_p.BP_ENABLE if enable else 0)
+        await self.submit('set_wp', bytes([_p.PROT_PC_B_SET_WP, flags]) + addr.to_bytes(4, 'little'),
+                          reply=False)
+
+    async def run_until(self, limit: int = 0xffffffff, timeout: float = None) -> dict:
+        # a single halt frame comes back, however long the run is
+        hold = None if timeout is None else limit / _p.CORE_CLOCK_HZ
+        fut = await self.submit('run_until', bytes([_p.PROT_PC_B_RUN_UNTIL]) + limit.to_bytes(4, 'little'),
+                                hold=hold)
+        if timeout is not None:
+            timeout += hold
+        return self.decode_halt(await asyncio.wait_for(fut, timeout))
+
+    def decode_halt(self, frame: bytes) -> dict:
+        reason = frame[0]
+        return {
+            'breakpoint': bool(reason & _p.HALT_BREAKPOINT),
+            'watchpoint': bool(reason & _p.HALT_WATCHPOINT),
+            'hits': [i for i in range(_p.N_BREAKPOINTS) if reason >> 4 & (1 << i)],
+            'pc': int.from_bytes(frame[1:5], 'little'),
+            'clocks': int.from_bytes(frame[5:9], 'little'),
+            'running': bool(reason & _p.STATUS_RUNNING),
+        }
+
+    async def run_free(self):
+        # the core runs on its own; halt(), status() and the FREE_RUN_PASSIVE
+        # commands leave it running, anything else halts it first
+        await self.submit('run_free', bytes([_p.PROT_PC_B_RUN_FREE]), reply=False)
+
+    async def halt(self, timeout: float = 1.0) -> dict:
+        fut = await self.submit('halt', bytes([_p.PROT_PC_B_HALT]), decode=self.decode_halt)
+        return await asyncio.wait_for(fut, timeout)
+
+    async def status(self, timeout: float = 1.0) -> dict:
+        fut = await self.submit('status', bytes([_p.PROT_PC_B_STATUS]), decode=self.decode_halt)
+        return await asyncio.wait_for(fut, timeout)
+
+    async def read_mem(self, addr: int, n_words: int, timeout: float = 1.0) -> np.ndarray:
+        # bursts of READ_MEM_MAX words, all in flight at once
+        futs = []
+        for off in range(0, n_words, _p.READ_MEM_MAX):
+            n = min(_p.READ_MEM_MAX, n_words - off)
+            cmd = bytes([_p.PROT_PC_B_READ_MEM]) + (addr + 4 * off).to_bytes(4, 'little') + bytes([n])
+            futs.append(await self.submit('read_mem', cmd))
+        frames = await asyncio.wait_for(asyncio.gather(*futs), timeout * len(futs))
+        return np.frombuffer(b''.join(frames), dtype='<u4')
+
+    async def write_mem(self, target: int, addr: int, words, timeout: float = 1.0):
+        # each burst has to fit in the credit window next to the CREDIT slot
+        words = np.asarray(words, dtype='<u4')
+        per_burst = (self.window.depth - (0 if self.framed else 1) - self.overhead - 7) // 4
+        futs = []
+        for off in range(0, len(words), per_burst):
+            chunk = words[off:off + per_burst]
+            cmd = bytes([_p.PROT_PC_B_WRITE_MEM, target]) + (addr + 4 * off).to_bytes(4, 'little') + \
+                bytes([len(chunk)]) + chunk.tobytes()
+            futs.append(await self.submit('write_mem', cmd))
+        await asyncio.wait_for(asyncio.gather(*futs), timeout * max(1, len(futs)))
+
+    async def load_program(self, program, data=None, reset: bool = True):
+        # program/data: see as_words
+        await self.write_mem(_p.MEM_INST, 0, as_words(program))
+        if data is not None:
+            await self.write_mem(_p.MEM_DATA, 0, as_words(data))
+        if reset:
+            await self.reset()
+
+    async def set_trigger(self, mode: int = _p.TRACE_ARM, pc: int = 0, post: int = 0):
+        # mode: TRACE_ARM plus TRACE_TRIG_PC / TRACE_TRIG_HALT; mode 0 stops recording
+        cmd = bytes([_p.PROT_PC_B_SET_TRIGGER, mode]) + pc.to_bytes(4, 'little') + post.to_bytes(2, 'little')
+        await self.submit('set_trigger', cmd, reply=False)
+
+    def trace_command(self, first: int, n: int) -> bytes:
+        return bytes([_p.PROT_PC_B_READ_TRACE]) + first.to_bytes(2, 'little') + bytes([n])
+
+    async def trace_status(self, timeout: float = 1.0) -> dict:
+        frame = await asyncio.wait_for(await self.submit('read_trace', self.trace_command(0, 0)), timeout)
+        return {
+            'entries': int.from_bytes(frame[0:2], 'little'),
+            'recording': bool(frame[2] & _p.TRACE_RECORDING),
+            'triggered': bool(frame[2] & _p.TRACE_TRIGGERED),
+        }
+
+    async def read_trace(self, timeout: float = 1.0) -> np.ndarray:
+        # every recorded clock, oldest first; the reads go out back to back
+        status = await self.trace_status(timeout)
+        futs = []
+        for first in range(0, status['entries'], _p.TRACE_READ_MAX):
+            n = min(_p.TRACE_READ_MAX, status['entries'] - first)
+            futs.append(await self.submit('read_trace', self.trace_command(first, n)))
+        frames = await asyncio.wait_for(asyncio.gather(*futs), timeout * max(1, len(futs)))
+        return np.frombuffer(b''.join(f[4:] for f in frames), dtype=TRACE_DTYPE)
+
+    async def read_counters(self, clear: bool = False, timeout: float = 1.0) -> dict:
+        cmd = bytes([_p.PROT_PC_B_READ_COUNTERS, _p.COUNTERS_CLEAR if clear else 0])
+        frame = await asyncio.wait_for(await self.submit('read_counters', cmd), timeout)
+        counters = dict(zip(_p.COUNTERS, struct.unpack('<%dQ' % len(_p.COUNTERS), frame)))
+        counters['cpi'] = counters['cycles'] / counters['instret'] if counters['instret'] else None
+        return counters
+
+    async def clock_many(self, n: int, timeout: float = 1.0) -> list:
+        # keeps the fifo full instead of waiting for each dump
+        futs = [await self.submit('clock', bytes([_p.PROT_PC_B_CLOCK]), decode=self.dump_decoder())
+                for _ in range(n)]
+        return await asyncio.wait_for(asyncio.gather(*futs), timeout * n)
+
+    async def credit(self, timeout: float = 1.0) -> tuple:
+        fut = await self.submit('credit', bytes([_p.PROT_PC_B_CREDIT]), reserve=0)
+        free, flags = await asyncio.wait_for(fut, timeout)
+        if flags & _p.CREDIT_RX_OVERFLOW:
+            self.overflows += 1
+        return free, flags
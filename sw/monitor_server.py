@@ -0,0 +1,132 @@
+import sys
+import asyncio
+import argparse
+
+import protocol as _p
+from uart_interface import UartInterface
+from monitor import RiscvMonitor
+
+
+class MonitorServer:
+    '''
+        Owns the board link and relays the monitor protocol to TCP clients
+        (open them with UartInterface(url='tcp://host:port')). Commands
+        from every client share the RiscvMonitor credit window, so they are
+        pipelined onto the wire; each client gets its replies back in the
+        order it sent the commands.
+
+        A DUMP that arrives while the newest command on the wire is still an
+        unanswered DUMP rides on that one: nothing can have changed the
+        registers in between.
+
+        The delta dump bookkeeping lives on the board, one for everyone, so
+        a client that sends DUMP_MODE is disconnected: a delta it asked for
+        would carry registers that another client's dumps already took.
+    '''
+
+    def __init__(self, monitor: RiscvMonitor):
+        self.monitor = monitor
+        self.clients = 0
+        self.requests = 0
+        self.coalesced = 0
+
+    async def request(self, data: bytes, name: str, reply: bool):
+        self.requests += 1
+        last = self.monitor.last_command
+        if data[0] == _p.PROT_PC_B_DUMP and last is not None and last[0] == data \
+                and last[1] is not None and not last[1].done():
+            self.coalesced += 1
+            return last[1]
+        return await self.monitor.submit(name, data, reply)
+
+    async def reply_routine(self, replies: asyncio.Queue, writer: asyncio.StreamWriter):
+        while True:
+            fut = await replies.get()
+            if fut is None:
+                break
+            try:
+                frame = await fut
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                # the client cannot tell a missing reply apart, hang up on it
+                print('dropping client: %s' % e, file=sys.stderr)
+                writer.close()
+                return
+            writer.write(bytes([len(frame)]) + frame)
+            if replies.empty():
+                await writer.drain()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients += 1
+        replies = asyncio.Queue()
+        replier = asyncio.create_task(self.reply_routine(replies, writer))
+        buf = bytearray()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                buf += data
+                while buf:
+                    name, size, reply = _p.COMMANDS.get(buf[0], (None, 0, False))
+                    if name is not None:
+                        size = _p.command_args(buf)
+                    if len(buf) < size + 1:
+                        break
+                    cmd = bytes(buf[:size + 1])
+                    del buf[:size + 1]
+                    # unknown opcodes never reach the board, the FSM would drop them
+                    if name is None:
+                        continue
+                    if cmd[0] == _p.PROT_PC_B_DUMP_MODE:
+                        raise ConnectionError('dump mode is shared by every client')
+                    fut = await self.request(cmd, name, reply)
+                    if fut is not None:
+                        replies.put_nowait(fut)
+            replies.put_nowait(None)
+            await replier
+        except (ConnectionError, asyncio.CancelledError):
+            replier.cancel()
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 7777):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def create_args():
+    parser = argparse.ArgumentParser('monitor_server -h')
+    parser.add_argument(
+        '-u', '--url', help='Board url', type=str, default='ftdi://ftdi:2232:1/2')
+    parser.add_argument(
+        '-b', '--baudrate', help='Serial baudrate', type=int, default=3000000)
+    parser.add_argument(
+        '-H', '--host', help='Address to listen on', type=str, default='127.0.0.1')
+    parser.add_argument(
+        '-P', '--port', help='TCP port to listen on', type=int, default=7777)
+    parser.add_argument(
+        '-f', '--framed', help='CRC framed protocol with retries towards the board', action='store_true')
+    return parser.parse_args()
+
+
+async def main():
+    args = create_args()
+    u = UartInterface(url=args.url, baudrate=args.baudrate)
+    await u.start_listener()
+    server = MonitorServer(RiscvMonitor(u, framed=args.framed))
+    print('serving %s on %s:%d' % (args.url, args.host, args.port), flush=True)
+    try:
+        await server.serve(args.host, args.port)
+    finally:
+        print('%d requests, %d dumps coalesced' % (server.requests, server.coalesced),
+              file=sys.stderr)
+        u.stop_listener()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
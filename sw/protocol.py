@@ -0,0 +1,216 @@
+'''
+    Monitor protocol shared with hw/components.py (create_io_riscv_controller)
+
+    PC->board
+    0x00    reset 8b
+    0x01    exec clock 8b
+    0x02    credit 8b
+    0x03    dump registers 8b (no clock)
+    0x04    run 8b + n_clocks 32b LE, dump registers at the end
+    0x05    set breakpoint 8b + idx 8b (bit7 enable) + addr 32b LE
+    0x06    run until breakpoint 8b + max clocks 32b LE
+    0x07    set watchpoint 8b + idx 8b (bit7 enable, bits 6:4 kind) + addr 32b LE
+            addr is a data memory address, or a register number for WP_REG_WRITE
+    0x08    dump mode 8b + mode 8b (DUMP_DELTA | DUMP_WIDE)
+    0x09    read memory 8b + byte addr 32b LE + n words 8b (n <= READ_MEM_MAX)
+    0x0a    write memory 8b + target 8b (MEM_INST/MEM_DATA) + byte addr 32b LE
+            + n words 8b + n words 32b LE
+    0x0b    set trigger 8b + mode 8b (TRACE_*) + pc 32b LE + post 16b LE
+    0x0c    read trace 8b + first entry 16b LE + n entries 8b (n <= TRACE_READ_MAX)
+    0x0d    read counters 8b + flags 8b (COUNTERS_CLEAR)
+    0x0e    run free 8b
+    0x0f    halt 8b
+    0x10    status 8b
+
+    board->PC
+    clock, dump, run: monitor_tam 8b + monitor_tam bytes (one byte per register, x0..x31)
+        with DUMP_DELTA: 4 + n, [bitmap of registers written since the last
+        dump 32b LE][their n values, x0 first]. Setting the mode marks every
+        register as written, so the first delta carries them all.
+        with DUMP_WIDE: every value is 32b LE and the pc (32b LE) is
+        appended, e.g. [132][x0..x31][pc]
+    credit: 2 + [free rx fifo slots][flags]
+    read memory: 4n + n words 32b LE, always full width
+    write memory: 1 + [n]
+    read trace: 4 + 12n + [entries recorded 16b LE][TRACE_RECORDING | TRACE_TRIGGERED][0]
+        [n x pc, instruction, writeback value, 32b LE each], entry 0 is the oldest
+    read counters: 48 + one 64b LE value per name in COUNTERS, all taken on
+        the same clock; COUNTERS_CLEAR clears them on that clock
+    halt, status: 9 + as run until, clocks counted from the run free;
+        reason STATUS_RUNNING set while the core still runs
+
+    The trace records every clock the core executes while it is armed. A
+    TRACE_TRIG_* mode waits for its condition (the pc reaching the trigger
+    pc, or a breakpoint or watchpoint hit), otherwise the first clock is
+    the trigger; post clocks after it, the trigger included, recording
+    stops (post 0: never, the ring keeps the last TRACE_DEPTH clocks).
+    A mode without TRACE_ARM stops recording and keeps the buffer.
+
+    The counters count controller clocks: a clock command costs 1 cycle,
+    running n instructions n + 1 (the core steps on every clock and the
+    FSM checks for the end once more), the clocks without an instruction
+    are stalls.
+
+    Run free keeps clocking the core until a breakpoint or watchpoint
+    stops it (reason as run until), or halt. Only the FREE_RUN_PASSIVE
+    commands run next to it, any other one halts the core first (reason
+    0) and then runs as usual.
+    run until: 9 + [reason][pc 32b LE][clocks run 32b LE]
+        reason bit0 set: stopped before the instruction at a breakpoint,
+        bit1 set: stopped before an instruction that makes a watched access,
+        bits 7:4 say which; otherwise the clock limit was reached
+
+    The rx fifo has RX_FIFO_DEPTH bytes and no backpressure: the host must
+    never have more command bytes in flight than that. A reply means every
+    byte up to and including its command was taken out of the fifo.
+
+    Framed protocol: the first FRAME_SYNC byte switches the board to it
+    until the FPGA is reset; from then on bytes outside a frame are dropped.
+    PC->board   [FRAME_SYNC][seq][len | FRAME_RESYNC][len bytes: one command][crc8]
+    board->PC   [FRAME_SYNC][seq][status][tam][tam bytes][crc8]
+    crc8 covers every byte of the frame before it. Every frame is answered,
+    commands without a reply with tam 0. FRAME_ACK: the command ran, seq is
+    its own. FRAME_NAK_*: nothing ran, seq is the one the board expects
+    next; FRAME_RESYNC makes the board accept the frame seq instead.
+'''
+
+PROT_PC_B_RESET = 0x00
+PROT_PC_B_CLOCK = 0x01
+PROT_PC_B_CREDIT = 0x02
+PROT_PC_B_DUMP = 0x03
+PROT_PC_B_RUN = 0x04
+PROT_PC_B_SET_BP = 0x05
+PROT_PC_B_RUN_UNTIL = 0x06
+PROT_PC_B_SET_WP = 0x07
+PROT_PC_B_DUMP_MODE = 0x08
+PROT_PC_B_READ_MEM = 0x09
+PROT_PC_B_WRITE_MEM = 0x0A
+PROT_PC_B_SET_TRIGGER = 0x0B
+PROT_PC_B_READ_TRACE = 0x0C
+PROT_PC_B_READ_COUNTERS = 0x0D
+PROT_PC_B_RUN_FREE = 0x0E
+PROT_PC_B_HALT = 0x0F
+PROT_PC_B_STATUS = 0x10
+
+# opcode -> (name, argument bytes, has reply); lets a relay split a byte
+# stream into commands without knowing what they do
+COMMANDS = {
+    PROT_PC_B_RESET: ('reset', 0, False),
+    PROT_PC_B_CLOCK: ('clock', 0, True),
+    PROT_PC_B_CREDIT: ('credit', 0, True),
+    PROT_PC_B_DUMP: ('dump', 0, True),
+    PROT_PC_B_RUN: ('run', 4, True),
+    PROT_PC_B_SET_BP: ('set_bp', 5, False),
+    PROT_PC_B_RUN_UNTIL: ('run_until', 4, True),
+    PROT_PC_B_SET_WP: ('set_wp', 5, False),
+    PROT_PC_B_DUMP_MODE: ('dump_mode', 1, False),
+    PROT_PC_B_READ_MEM: ('read_mem', 5, True),
+    PROT_PC_B_WRITE_MEM: ('write_mem', 6, True),
+    PROT_PC_B_SET_TRIGGER: ('set_trigger', 7, False),
+    PROT_PC_B_READ_TRACE: ('read_trace', 3, True),
+    PROT_PC_B_READ_COUNTERS: ('read_counters', 1, True),
+    PROT_PC_B_RUN_FREE: ('run_free', 0, False),
+    PROT_PC_B_HALT: ('halt', 0, True),
+    PROT_PC_B_STATUS: ('status', 0, True),
+}
+
+# commands that leave a free running core alone
+FREE_RUN_PASSIVE = {
+    PROT_PC_B_CREDIT, PROT_PC_B_SET_BP, PROT_PC_B_SET_WP, PROT_PC_B_DUMP_MODE,
+    PROT_PC_B_SET_TRIGGER, PROT_PC_B_READ_COUNTERS, PROT_PC_B_RUN_FREE,
+    PROT_PC_B_HALT, PROT_PC_B_STATUS,
+}
+
+
+def command_args(buf) -> int:
+    # argument bytes of the command starting at buf[0]; WRITE_MEM carries
+    # its word count in the header, so its size grows once that arrived
+    size = COMMANDS[buf[0]][1]
+    if buf[0] == PROT_PC_B_WRITE_MEM and len(buf) > size:
+        size += 4 * buf[size]
+    return size
+
+
+FRAME_SYNC = 0xA5
+FRAME_RESYNC = 0x80
+FRAME_LEN_MASK = 0x3F
+# sync, seq, len and crc around the command
+FRAME_OVERHEAD = 4
+# a whole frame has to fit in the rx fifo
+FRAME_MAX = 28
+FRAME_ACK = 0
+FRAME_NAK_CRC = 1
+FRAME_NAK_SEQ = 2
+
+
+def _crc8_table(poly: int = 0x07) -> bytes:
+    table = bytearray(256)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ poly) & 0xff if c & 0x80 else (c << 1) & 0xff
+        table[i] = c
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data, crc: int = 0) -> int:
+    # CRC-8 x^8+x^2+x+1, init 0, no reflection; a frame with its crc appended gives 0
+    for b in data:
+        crc = CRC8_TABLE[crc ^ b]
+    return crc
+
+
+def pack_frame(seq: int, command: bytes, flags: int = 0) -> bytes:
+    frame = bytes([FRAME_SYNC, seq & 0xff, len(command) | flags]) + command
+    return frame + bytes([crc8(frame)])
+
+
+MONITOR_TAM = 32
+N_REGS = 32
+# words per read memory reply, the frame length byte has to hold 4n
+READ_MEM_MAX = 63
+
+# write memory targets
+MEM_INST = 0
+MEM_DATA = 1
+
+# dump mode bits
+DUMP_DELTA = 0x01
+DUMP_WIDE = 0x02
+
+# runs step the core on every cycle of the 27 MHz clock
+CORE_CLOCK_HZ = 27000000
+
+RX_FIFO_DEPTH = 32
+N_BREAKPOINTS = 4
+BP_ENABLE = 0x80
+HALT_BREAKPOINT = 0x01
+HALT_WATCHPOINT = 0x02
+STATUS_RUNNING = 0x08
+
+N_WATCHPOINTS = 4
+WP_MEM_WRITE = 0x10
+WP_MEM_READ = 0x20
+WP_REG_WRITE = 0x40
+
+# credit reply flags
+CREDIT_RX_OVERFLOW = 0x01
+
+# trace buffer, hw/interface.py -T sets its depth bits
+TRACE_DEPTH = 1024
+TRACE_ENTRY = 12
+# entries per read trace reply, the tam byte has to hold 4 + 12n
+TRACE_READ_MAX = 20
+TRACE_ARM = 0x01
+TRACE_TRIG_PC = 0x02
+TRACE_TRIG_HALT = 0x04
+# read trace status flags
+TRACE_RECORDING = 0x01
+TRACE_TRIGGERED = 0x02
+
+# read counters reply order and flags
+COUNTERS = ('cycles', 'instret', 'branches', 'loads', 'stores', 'stalls')
+COUNTERS_CLEAR = 0x01
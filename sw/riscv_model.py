@@ -0,0 +1,192 @@
+'''
+    Cycle model of the single-cycle core generated by hw/riscv.py.
+
+    It follows the RTL rather than the ISA manual: x0 is writable, SLT uses
+    the sign of a-b, only R/I/LW/SW/branch opcodes do anything and memory
+    accesses outside the array read as 0 and drop writes.
+'''
+
+MASK = 0xffffffff
+
+# control_unit opcodes
+R_TYPE = 51
+BRANCH = 99
+ADDI_SLTI_XORI = 19
+LW = 3
+SW = 35
+
+# alu operations (alucontrol)
+ALU_AND = 0
+ALU_OR = 1
+ALU_ADD = 2
+ALU_SLL = 3
+ALU_XOR = 4
+ALU_SRA = 5
+ALU_SUB = 6
+ALU_SLT = 7
+ALU_SRL = 8
+ALU_SLTU = 9
+
+
+def sign_extend(value: int, bits: int) -> int:
+    if value & (1 << (bits - 1)):
+        value |= MASK << bits
+    return value & MASK
+
+
+def read_hex(path: str) -> list:
+    # $readmemh style: one hex word per token, // comments allowed
+    words = []
+    with open(path, 'r') as fp:
+        for line in fp:
+            line = line.split('//')[0]
+            words += [int(w, 16) for w in line.split()]
+    return words
+
+
+class RiscvModel:
+    def __init__(self, ram_depth: int = 5, inst_ram_depth: int = 5):
+        self.ram_depth = ram_depth
+        self.inst_ram_depth = inst_ram_depth
+        self.pc = 0
+        self.regs = [0] * 32
+        self.mem = [0] * (2 ** ram_depth)
+        self.inst_mem = [0] * (2 ** inst_ram_depth)
+
+    def load_program(self, words: list, data: list = None):
+        for i, w in enumerate(words[:len(self.inst_mem)]):
+            self.inst_mem[i] = w & MASK
+        if data is not None:
+            for i, w in enumerate(data[:len(self.mem)]):
+                self.mem[i] = w & MASK
+
+    def read_mem(self, address: int) -> int:
+        index = (address & MASK) >> 2
+        if index < len(self.mem):
+            return self.mem[index]
+        return 0
+
+    def write_mem(self, address: int, value: int):
+        index = (address & MASK) >> 2
+        if index < len(self.mem):
+            self.mem[index] = value & MASK
+
+    def fetch(self) -> int:
+        index = self.pc >> 2
+        if index < len(self.inst_mem):
+            return self.inst_mem[index]
+        return 0
+
+    def alucontrol(self, aluop: int, funct3: int, funct7: int) -> int:
+        if aluop == 0:
+            return ALU_ADD
+        if aluop == 1:
+            return ALU_SUB
+        if funct3 == 0:
+            if aluop == 2 and funct7 != 0:
+                return ALU_SUB
+            return ALU_ADD
+        if funct3 == 5:
+            return ALU_SRA if funct7 & 0x20 else ALU_SRL
+        return [None, ALU_SLL, ALU_SLT, ALU_SLTU, ALU_XOR, None, ALU_OR, ALU_AND][funct3]
+
+    def alu(self, op: int, a: int, b: int) -> int:
+        sh = b & 0x1f
+        if op == ALU_AND:
+            return a & b
+        if op == ALU_OR:
+            return a | b
+        if op == ALU_ADD:
+            return (a + b) & MASK
+        if op == ALU_SLL:
+            return (a << sh) & MASK
+        if op == ALU_XOR:
+            return a ^ b
+        if op == ALU_SRA:
+            return sign_extend(a >> sh, 32 - sh)
+        if op == ALU_SUB:
+            return (a - b) & MASK
+        if op == ALU_SLT:
+            return ((a - b) >> 31) & 1
+        if op == ALU_SRL:
+            return a >> sh
+        if op == ALU_SLTU:
+            return int(a < b)
+        return 0
+
+    def evaluate(self) -> dict:
+        # what the next clock will do, without doing it (the combinational
+        # half of the core)
+        pc = self.pc
+        inst = self.fetch()
+        opcode = inst & 0x7f
+        rd = (inst >> 7) & 0x1f
+        funct3 = (inst >> 12) & 0x7
+        rs1 = (inst >> 15) & 0x1f
+        rs2 = (inst >> 20) & 0x1f
+        funct7 = inst >> 25
+
+        alusrc = memtoreg = regwrite = memread = memwrite = branch = 0
+        aluop = 0
+        imm = 0
+        if opcode == R_TYPE:
+            regwrite, aluop = 1, 2
+        elif opcode == BRANCH:
+            branch, aluop = 1, 1
+            imm = sign_extend(((inst >> 31) << 12) | (((inst >> 7) & 1) << 11) |
+                              (((inst >> 25) & 0x3f) << 5) | (((inst >> 8) & 0xf) << 1), 13)
+        elif opcode == ADDI_SLTI_XORI:
+            alusrc, regwrite, aluop = 1, 1, 3
+            imm = sign_extend(inst >> 20, 12)
+        elif opcode == LW:
+            alusrc, memtoreg, regwrite, memread = 1, 1, 1, 1
+            imm = sign_extend(inst >> 20, 12)
+        elif opcode == SW:
+            alusrc, memwrite = 1, 1
+            imm = sign_extend(((inst >> 25) << 5) | rd, 12)
+
+        data1 = self.regs[rs1]
+        data2 = self.regs[rs2]
+        alu_b = imm if alusrc else data2
+        aluout = self.alu(self.alucontrol(aluop, funct3, funct7), data1, alu_b)
+
+        zero = 0
+        if funct3 == 0:
+            zero = int(aluout == 0)
+        elif funct3 == 1:
+            zero = int(aluout != 0)
+        elif funct3 == 4:
+            zero = aluout >> 31
+        elif funct3 == 5:
+            zero = 1 - (aluout >> 31)
+        elif funct3 == 6:
+            zero = int(data1 < alu_b)
+        elif funct3 == 7:
+            zero = int(not data1 < alu_b)
+
+        readdata = self.read_mem(aluout) if memread else 0
+        writedata = readdata if memtoreg else aluout
+
+        taken = bool(branch and zero)
+        return {
+            'pc': pc,
+            'inst': inst,
+            'regwrite': regwrite,
+            'rd': rd,
+            'writedata': writedata,
+            'memread': memread,
+            'memwrite': memwrite,
+            'maddr': aluout,
+            'storedata': data2,
+            'branch_taken': taken,
+            'next_pc': (pc + imm) & MASK if taken else (pc + 4) & MASK,
+        }
+
+    def step(self, rst: bool = False) -> dict:
+        e = self.evaluate()
+        if e['regwrite']:
+            self.regs[e['rd']] = e['writedata']
+        if e['memwrite']:
+            self.write_mem(e['maddr'], e['storedata'])
+        self.pc = 0 if rst else e['next_pc']
+        return e
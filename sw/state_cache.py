@@ -0,0 +1,158 @@
+import protocol as _p
+from riscv_model import MASK, R_TYPE, ADDI_SLTI_XORI, LW, SW, sign_extend
+from monitor import RiscvMonitor, as_words
+
+
+class StateCache:
+    '''
+        Host copy of the core state (pc, x0..x31, data memory words) in
+        front of a RiscvMonitor, filled on demand from dumps and READ_MEM.
+
+        A step only drops what one instruction can change: its rd, which
+        the delta dump of the step sends back, and the word a store writes.
+        Both come from the instruction at pc, known when the program went
+        in through this cache; otherwise a step drops the whole data
+        memory. Runs drop everything.
+    '''
+
+    def __init__(self, monitor: RiscvMonitor):
+        self.monitor = monitor
+        # None: not known on the host
+        self.pc = None
+        self.regs = [None] * _p.N_REGS
+        # word index -> value
+        self.mem = {}
+        self.program = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        # wide delta dumps carry the pc and only the registers written
+        await self.monitor.set_dump_mode(delta=True, wide=True)
+        self.invalidate()
+
+    def invalidate(self):
+        self.pc = None
+        self.regs = [None] * _p.N_REGS
+        self.mem.clear()
+
+    def on_dump(self):
+        # the monitor patches every dump into its copy, so after one it is whole
+        self.regs = list(self.monitor.regs)
+        self.pc = self.monitor.pc
+
+    async def dump(self) -> list:
+        self.misses += 1
+        await self.monitor.dump()
+        self.on_dump()
+        return list(self.regs)
+
+    async def registers(self) -> list:
+        if self.pc is None or None in self.regs:
+            return await self.dump()
+        self.hits += 1
+        return list(self.regs)
+
+    async def register(self, n: int) -> int:
+        if self.regs[n] is None:
+            await self.dump()
+        else:
+            self.hits += 1
+        return self.regs[n]
+
+    async def get_pc(self) -> int:
+        if self.pc is None:
+            await self.dump()
+        else:
+            self.hits += 1
+        return self.pc
+
+    async def read(self, addr: int, n_words: int) -> list:
+        # the words not on the host yet come in one burst
+        first = addr >> 2
+        missing = [i for i in range(first, first + n_words) if i not in self.mem]
+        if missing:
+            self.misses += 1
+            words = await self.monitor.read_mem(missing[0] * 4, missing[-1] - missing[0] + 1)
+            for i, w in enumerate(words):
+                self.mem.setdefault(missing[0] + i, int(w))
+        else:
+            self.hits += 1
+        return [self.mem[i] for i in range(first, first + n_words)]
+
+    async def write(self, target: int, addr: int, words):
+        words = as_words(words)
+        await self.monitor.write_mem(target, addr, words)
+        cache = self.program if target == _p.MEM_INST else self.mem
+        for i, w in enumerate(words):
+            cache[(addr >> 2) + i] = int(w)
+
+    async def load_program(self, program, data=None, reset: bool = True):
+        self.program.clear()
+        await self.write(_p.MEM_INST, 0, program)
+        if data is not None:
+            await self.write(_p.MEM_DATA, 0, data)
+        if reset:
+            await self.reset()
+
+    def forget_step(self):
+        # drops what the instruction at pc is about to write
+        inst = self.program.get(self.pc >> 2) if self.pc is not None else None
+        if inst is None:
+            self.regs = [None] * _p.N_REGS
+            self.mem.clear()
+            return
+        opcode, rd = inst & 0x7f, (inst >> 7) & 0x1f
+        if opcode in (R_TYPE, ADDI_SLTI_XORI, LW):
+            self.regs[rd] = None
+        elif opcode == SW:
+            base = self.regs[(inst >> 15) & 0x1f]
+            if base is None:
+                self.mem.clear()
+            else:
+                offset = sign_extend(((inst >> 25) << 5) | rd, 12)
+                self.mem.pop(((base + offset) & MASK) >> 2, None)
+
+    async def step(self) -> list:
+        self.forget_step()
+        try:
+            await self.monitor.clock()
+        except ConnectionError:
+            # it may have run, or the monitor has no registers to give
+            self.invalidate()
+            raise
+        self.on_dump()
+        return list(self.regs)
+
+    async def reset(self):
+        # the reset clock still executes the instruction at pc
+        self.forget_step()
+        await self.monitor.reset()
+        self.pc = 0
+
+    async def run(self, n: int) -> list:
+        self.invalidate()
+        await self.monitor.run(n)
+        self.on_dump()
+        return list(self.regs)
+
+    async def run_until(self, limit: int = 0xffffffff, timeout: float = None) -> dict:
+        self.invalidate()
+        halt = await self.monitor.run_until(limit, timeout)
+        self.pc = halt['pc']
+        return halt
+
+    async def run_free(self):
+        self.invalidate()
+        await self.monitor.run_free()
+
+    async def halt(self) -> dict:
+        return self.on_status(await self.monitor.halt())
+
+    async def status(self) -> dict:
+        return self.on_status(await self.monitor.status())
+
+    def on_status(self, status: dict) -> dict:
+        if not status['running']:
+            self.pc = status['pc']
+        return status
@@ -1,53 +1,25 @@
-'''from pyftdi.ftdi import Ftdi
+import sys
 import asyncio
-import pyftdi.serialext
-import time,random
-import threading
+from uart_interface import UartInterface
+from monitor import RiscvMonitor
 
 
-class UartInterface:
-    def __init__(self):
-        self.stop_flag = False
-        self.start_flag = False
-        self.queue = asyncio.Queue()
-        self.listener = threading.Thread(target=self.listener_routine, args=[1,])
-        self.port = pyftdi.serialext.serial_for_url('ftdi://ftdi:2232:1/2', baudrate=3000000, bytesize=8, parity='N', stopbits=1, timeout=0.001)
+async def main(url: str = 'ftdi://ftdi:2232:1/2'):
+    u = UartInterface(url=url)
+    await u.start_listener()
+    monitor = RiscvMonitor(u)
+    loop = asyncio.get_running_loop()
 
-    def listener_routine(self, name):
-        data = None
-        while not self.stop_flag:
-            data = self.port.read()
-            if data != b'':
-                print(int.from_bytes(data))
-            time.sleep(0.01)
+    op = 0
+    while op != 10:
+        print("0, 1, 10")
+        op = int(await loop.run_in_executor(None, input))
+        if op == 0:
+            await monitor.reset()
+        elif op == 1:
+            print(await monitor.clock())
+    u.stop_listener()
 
 
-    def start_listener(self):
-        self.stop_flag = False
-        self.start_flag = True
-        self.port.reset_input_buffer()
-        self.port.reset_output_buffer()
-        time.sleep(0.005)
-        self.listener.start()
-
-    def stop_listener(self):
-        self.stop_flag = True
-
-    def send_data(self, data):
-        self.port.write(data)
-
-u = UartInterface()
-u.start_listener()
-
-op=0
-while op != 10:
-    print("0, 1, 10")
-    op = int(input())
-    if op == 0:
-        u.send_data(int.to_bytes(0))
-    elif op == 1:
-        u.send_data(int.to_bytes(1))
-        #time.sleep(5.0)
-u.stop_listener()
-
-'''
\ No newline at end of file
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:2]))
@@ -0,0 +1,145 @@
+import io
+import csv
+import json
+import time
+
+
+class LatencyHistogram:
+    # bucket i holds samples in [2**(i-1), 2**i) us; bucket 0 is < 1 us
+    def __init__(self, n_buckets: int = 24):
+        self.buckets = [0] * n_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds: float):
+        us = seconds * 1e6
+        i = min(len(self.buckets) - 1, max(0, int(us).bit_length()))
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += us
+        self.min = us if self.min is None else min(self.min, us)
+        self.max = us if self.max is None else max(self.max, us)
+
+    def percentile(self, p: float) -> float:
+        # upper edge of the bucket holding the p-th percentile
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100.0
+        acc = 0
+        for i, c in enumerate(self.buckets):
+            acc += c
+            if acc >= target:
+                return float(2 ** i)
+        return float(2 ** (len(self.buckets) - 1))
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'min_us': self.min or 0.0,
+            'mean_us': self.total / self.count if self.count else 0.0,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'max_us': self.max or 0.0,
+            'buckets_us': {str(2 ** i): c for i, c in enumerate(self.buckets) if c},
+        }
+
+
+class LinkTelemetry:
+    '''
+        Counters for one monitor link. Each command keeps a round trip
+        histogram plus the bytes it moved, so the time the wire needs
+        (10 bits per byte) can be told apart from host and USB overhead.
+    '''
+
+    def __init__(self, baudrate: int = 3000000):
+        self.baudrate = baudrate
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_received = 0
+        self.frame_errors = 0
+        self.retransmits = 0
+        self.histograms = {}
+        self.wire_bytes = {}
+
+    def on_send(self, n: int):
+        self.bytes_sent += n
+
+    def on_receive(self, n: int):
+        self.bytes_received += n
+
+    def on_frame(self):
+        self.frames_received += 1
+
+    def on_frame_error(self):
+        self.frame_errors += 1
+
+    def on_retransmit(self, n: int = 1):
+        self.retransmits += n
+
+    def record(self, command: str, seconds: float, wire_bytes: int = 0):
+        if command not in self.histograms:
+            self.histograms[command] = LatencyHistogram()
+            self.wire_bytes[command] = 0
+        self.histograms[command].add(seconds)
+        self.wire_bytes[command] += wire_bytes
+
+    def snapshot(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        commands = {}
+        for name, h in self.histograms.items():
+            d = h.to_dict()
+            wire_us = self.wire_bytes[name] * 10 / self.baudrate * 1e6 / h.count if self.baudrate else 0.0
+            d['wire_us'] = wire_us
+            # share of the round trip spent on the wire at this baudrate
+            # (None: no round trip to compare with)
+            d['wire_share'] = wire_us / d['mean_us'] if d['mean_us'] else None
+            commands[name] = d
+        return {
+            'elapsed_s': elapsed,
+            'baudrate': self.baudrate,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'frames_received': self.frames_received,
+            'frame_errors': self.frame_errors,
+            'retransmits': self.retransmits,
+            'tx_bytes_per_s': self.bytes_sent / elapsed if elapsed else 0.0,
+            'rx_bytes_per_s': self.bytes_received / elapsed if elapsed else 0.0,
+            'frames_per_s': self.frames_received / elapsed if elapsed else 0.0,
+            'link_utilization': (self.bytes_sent + self.bytes_received) * 10 / self.baudrate / elapsed
+            if elapsed and self.baudrate else 0.0,
+            'commands': commands,
+        }
+
+    def to_json(self, path: str = None) -> str:
+        s = json.dumps(self.snapshot(), indent=2)
+        if path:
+            with open(path, 'w') as fp:
+                fp.write(s)
+        return s
+
+    def to_csv(self, path: str = None) -> str:
+        snap = self.snapshot()
+        n_buckets = max([len(h.buckets) for h in self.histograms.values()] + [0])
+        fields = ['command', 'count', 'min_us', 'mean_us', 'p50_us', 'p90_us',
+                  'p99_us', 'max_us', 'wire_us', 'wire_share']
+        out = io.StringIO()
+        w = csv.writer(out)
+        w.writerow(fields + ['lt_%dus' % (2 ** i) for i in range(n_buckets)])
+        for name, d in snap['commands'].items():
+            h = self.histograms[name]
+            w.writerow([name] + [d[f] for f in fields[1:]] + h.buckets)
+        for f in ['bytes_sent', 'bytes_received', 'frames_received', 'frame_errors', 'retransmits',
+                  'frames_per_s', 'link_utilization']:
+            w.writerow(['#' + f, snap[f]])
+        s = out.getvalue()
+        if path:
+            with open(path, 'w') as fp:
+                fp.write(s)
+        return s
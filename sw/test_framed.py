@@ -0,0 +1,67 @@
+import random
+import asyncio
+
+import protocol as _p
+from riscv_model import RiscvModel
+from board_emulator import BoardEmulator
+from transport import LoopbackTransport
+from uart_interface import UartInterface
+from monitor import RiscvMonitor
+
+# addi x1, x1, 1; beq x0, x0, -4
+PROGRAM = [0x00108093, 0xfe000ee3]
+
+
+async def pipelined_clocks(seed: int, n: int = 300, error_rate: float = 0.01, delta: bool = False):
+    model = RiscvModel()
+    model.load_program(PROGRAM)
+    emulator = BoardEmulator(model, error_rate=error_rate)
+    emulator.random = random.Random(seed)
+    u = UartInterface(transport=LoopbackTransport(emulator))
+    await u.start_listener()
+    monitor = RiscvMonitor(u, framed=True)
+    try:
+        if delta:
+            await monitor.set_dump_mode(delta=True)
+        # as clock_many, without giving up on the first lost reply
+        futs = [await monitor.submit('clock', bytes([_p.PROT_PC_B_CLOCK]), decode=monitor.dump_decoder())
+                for _ in range(n)]
+        clocks = await asyncio.gather(*futs, return_exceptions=True)
+        try:
+            regs = await monitor.dump(timeout=5.0)
+        except ConnectionError as e:
+            regs = e
+    finally:
+        monitor.close()
+        u.stop_listener()
+    return emulator, clocks, regs
+
+
+def lost_reply(e) -> bool:
+    return isinstance(e, ConnectionError) and 'reply was lost' in str(e)
+
+
+def test_go_back_under_errors():
+    for seed in range(8):
+        emulator, clocks, regs = asyncio.run(pipelined_clocks(seed))
+        # every clock ran exactly once, however often its frame went out
+        assert emulator.counters['cycles'] == len(clocks), seed
+        # a command the board ran is never resent until it runs out of tries
+        assert all(isinstance(c, list) or lost_reply(c) for c in clocks), (seed, clocks)
+        assert lost_reply(regs) or regs == [r & 0xff for r in emulator.model.regs], (seed, regs)
+
+
+def test_delta_mirror_after_lost_dumps():
+    for seed in range(8):
+        emulator, clocks, regs = asyncio.run(pipelined_clocks(seed, delta=True))
+        assert emulator.counters['cycles'] == len(clocks), seed
+        # lost deltas are made up for by a resync, and a lost dump runs again
+        assert regs == [r & 0xff for r in emulator.model.regs], (seed, regs)
+
+
+def test_nak_after_reply_has_tam():
+    emulator = BoardEmulator(RiscvModel())
+    assert emulator.feed(_p.pack_frame(0, bytes([_p.PROT_PC_B_DUMP])))[3] == _p.MONITOR_TAM
+    # out of seq: nothing runs, the nak still ends with tam 0
+    nak = emulator.feed(_p.pack_frame(5, bytes([_p.PROT_PC_B_DUMP])))
+    assert nak == bytes([_p.FRAME_SYNC, 1, _p.FRAME_NAK_SEQ, 0, _p.crc8(nak[:4])])
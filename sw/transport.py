@@ -0,0 +1,225 @@
+import os
+import tty
+import time
+import socket
+import select
+import threading
+
+
+class Transport:
+    '''
+        Byte pipe to a board. read_into() blocks until at least one byte is
+        available (or the timeout expires) and fills as much of the buffer
+        as the backend has pending, write_many() sends a batch in as few
+        backend writes as write_chunk allows.
+    '''
+
+    def __init__(self, timeout: float = 0.1, write_chunk: int = 4096):
+        self.timeout = timeout
+        self.write_chunk = write_chunk
+
+    def read_into(self, view: memoryview) -> int:
+        raise NotImplementedError()
+
+    def write(self, data):
+        raise NotImplementedError()
+
+    def write_many(self, chunks):
+        data = memoryview(b''.join(chunks))
+        for i in range(0, len(data), self.write_chunk):
+            self.write(data[i:i + self.write_chunk])
+
+    def reset_buffers(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FtdiTransport(Transport):
+    def __init__(self,
+                 url: str = 'ftdi://ftdi:2232:1/2',
+                 baudrate: int = 3000000,
+                 latency_timer: int = 1,
+                 read_chunk: int = 4096,
+                 write_chunk: int = 4096,
+                 timeout: float = 0.1):
+        super().__init__(timeout, write_chunk)
+        import pyftdi.serialext
+        self.port = pyftdi.serialext.serial_for_url(
+            url, baudrate=baudrate, bytesize=8, parity='N', stopbits=1, timeout=timeout)
+        self.udev = self.port.udev
+        self.udev.set_latency_timer(latency_timer)
+        self.udev.read_data_set_chunksize(read_chunk)
+        self.udev.write_data_set_chunksize(write_chunk)
+
+    def read_into(self, view: memoryview) -> int:
+        # Serial.read() sleeps 10 ms between empty USB reads; read_data()
+        # returns as soon as a USB packet with payload comes in
+        data = self.udev.read_data(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        self.udev.write_data(data)
+
+    def reset_buffers(self):
+        self.port.reset_input_buffer()
+        self.port.reset_output_buffer()
+
+    def close(self):
+        self.port.close()
+
+
+class SerialTransport(Transport):
+    def __init__(self,
+                 url: str,
+                 baudrate: int = 3000000,
+                 low_latency: bool = True,
+                 write_chunk: int = 4096,
+                 timeout: float = 0.1):
+        super().__init__(timeout, write_chunk)
+        import serial
+        self.port = serial.serial_for_url(
+            url, baudrate=baudrate, bytesize=8, parity='N', stopbits=1, timeout=timeout)
+        if low_latency and hasattr(self.port, 'set_low_latency_mode'):
+            try:
+                self.port.set_low_latency_mode(True)
+            except (OSError, ValueError):
+                pass
+
+    def read_into(self, view: memoryview) -> int:
+        return self.port.readinto(view[:max(1, self.port.in_waiting)])
+
+    def write(self, data):
+        self.port.write(data)
+
+    def reset_buffers(self):
+        self.port.reset_input_buffer()
+        self.port.reset_output_buffer()
+
+    def close(self):
+        self.port.close()
+
+
+class PtyTransport(Transport):
+    def __init__(self,
+                 path: str,
+                 write_chunk: int = 4096,
+                 timeout: float = 0.1):
+        super().__init__(timeout, write_chunk)
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+
+    def read_into(self, view: memoryview) -> int:
+        if not select.select([self.fd], [], [], self.timeout)[0]:
+            return 0
+        return os.readv(self.fd, [view])
+
+    def write(self, data):
+        data = memoryview(data)
+        while len(data):
+            data = data[os.write(self.fd, data):]
+
+    def reset_buffers(self):
+        while select.select([self.fd], [], [], 0)[0]:
+            os.read(self.fd, 4096)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TcpTransport(Transport):
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 nodelay: bool = True,
+                 write_chunk: int = 65536,
+                 timeout: float = 0.1):
+        super().__init__(timeout, write_chunk)
+        self.sock = socket.create_connection((host, port))
+        if nodelay:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+
+    def read_into(self, view: memoryview) -> int:
+        try:
+            n = self.sock.recv_into(view)
+        except socket.timeout:
+            return 0
+        if n == 0:
+            raise ConnectionError('connection closed by the monitor server')
+        return n
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+class LoopbackTransport(Transport):
+    '''
+        In-process board: writes go straight into a BoardEmulator and its
+        replies come back on the read side. baudrate > 0 paces the replies
+        like the real wire would.
+    '''
+
+    def __init__(self,
+                 emulator=None,
+                 baudrate: int = 0,
+                 write_chunk: int = 65536,
+                 timeout: float = 0.1):
+        super().__init__(timeout, write_chunk)
+        if emulator is None:
+            from riscv_model import RiscvModel
+            from board_emulator import BoardEmulator
+            emulator = BoardEmulator(RiscvModel())
+        self.emulator = emulator
+        self.baudrate = baudrate
+        self.rx = bytearray()
+        self.lock = threading.Condition()
+
+    def read_into(self, view: memoryview) -> int:
+        with self.lock:
+            if not self.rx:
+                self.lock.wait(self.timeout)
+            n = min(len(view), len(self.rx))
+            view[:n] = self.rx[:n]
+            del self.rx[:n]
+            return n
+
+    def write(self, data):
+        reply = self.emulator.feed(bytes(data))
+        if reply:
+            if self.baudrate:
+                time.sleep(len(reply) * 10 / self.baudrate)
+            with self.lock:
+                self.rx += reply
+                self.lock.notify()
+
+    def reset_buffers(self):
+        with self.lock:
+            self.rx.clear()
+
+
+def open_transport(url: str = 'ftdi://ftdi:2232:1/2', baudrate: int = 3000000, **kwargs) -> Transport:
+    '''
+        ftdi://...          pyftdi
+        tcp://host:port     monitor server / socket bridge
+        loop://             in-process board emulator
+        pty:///dev/pts/N    local pseudo terminal (also any /dev/pts/ path)
+        anything else       pyserial (/dev/ttyUSB1, COM3, rfc2217://...)
+    '''
+    if url.startswith('ftdi://'):
+        return FtdiTransport(url, baudrate, **kwargs)
+    if url.startswith('tcp://'):
+        host, port = url[len('tcp://'):].rsplit(':', 1)
+        return TcpTransport(host, int(port), **kwargs)
+    if url.startswith('loop://'):
+        return LoopbackTransport(**kwargs)
+    if url.startswith('pty://'):
+        return PtyTransport(url[len('pty://'):], **kwargs)
+    if url.startswith('/dev/pts/'):
+        return PtyTransport(url, **kwargs)
+    return SerialTransport(url, baudrate, **kwargs)
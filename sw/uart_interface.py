@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import protocol as _p
+from transport import Transport, open_transport
+from telemetry import LinkTelemetry
+
+
+class RxRingBuffer:
+    def __init__(self, size_bits: int = 16):
+        self.size = 1 << size_bits
+        self.mask = self.size - 1
+        self.data = bytearray(self.size)
+        self.view = memoryview(self.data)
+        # head/tail only grow; the mask maps them into the buffer
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def write_view(self) -> memoryview:
+        # largest contiguous free region, so a driver can fill it in one call
+        if len(self) == self.size:
+            self.grow()
+        start = self.tail & self.mask
+        end = min(self.size, start + self.size - len(self))
+        return self.view[start:end]
+
+    def produced(self, n: int):
+        self.tail += n
+
+    def grow(self):
+        # frames are parsed on the thread that fills the ring, so waiting for
+        # room would never end: a full ring doubles, the unread bytes first
+        unread = self.peek_bytes(len(self))
+        self.size <<= 1
+        self.mask = self.size - 1
+        self.data = bytearray(self.size)
+        self.view = memoryview(self.data)
+        self.data[:len(unread)] = unread
+        self.head = 0
+        self.tail = len(unread)
+
+    def peek(self, offset: int = 0) -> int:
+        return self.data[(self.head + offset) & self.mask]
+
+    def peek_bytes(self, n: int) -> bytes:
+        start = self.head & self.mask
+        end = start + n
+        if end <= self.size:
+            return bytes(self.view[start:end])
+        return bytes(self.view[start:]) + bytes(self.view[:end - self.size])
+
+    def skip(self, n: int):
+        self.head += n
+
+    def read(self, n: int) -> bytes:
+        start = self.head & self.mask
+        end = start + n
+        self.head += n
+        if end <= self.size:
+            return bytes(self.view[start:end])
+        return bytes(self.view[start:]) + bytes(self.view[:end - self.size])
+
+
+class UartInterface:
+    def __init__(self,
+                 url: str = 'ftdi://ftdi:2232:1/2',
+                 baudrate: int = 3000000,
+                 rx_buffer_bits: int = 16,
+                 framed: bool = True,
+                 transport: Transport = None,
+                 **transport_args):
+        self.stop_flag = False
+        self.start_flag = False
+        self.loop = None
+        self.queue = asyncio.Queue()
+        self.rx_buffer = RxRingBuffer(rx_buffer_bits)
+        # framed=False hands raw chunks to the queue (lesson designs that
+        # answer with bare bytes)
+        self.framed = framed
+        # crc_frames: replies are FRAME_SYNC frames (set by a framed
+        # RiscvMonitor); frames that fail the crc are dropped
+        self.crc_frames = False
+        self.listener = threading.Thread(
+            target=self.listener_routine, args=[1,], daemon=True)
+        if transport is None:
+            transport = open_transport(url, baudrate, **transport_args)
+        self.transport = transport
+        self.telemetry = LinkTelemetry(baudrate)
+
+    def listener_routine(self, name):
+        # read_into() blocks inside the backend until bytes arrive (or its
+        # timeout expires), so there is no polling interval to wait on.
+        # Every call drains whatever is pending straight into the ring buffer.
+        # The telemetry is only touched from the loop thread, which also
+        # takes the snapshots.
+        rx = self.rx_buffer
+        telemetry = self.telemetry
+        while not self.stop_flag:
+            n = self.transport.read_into(rx.write_view())
+            if n:
+                self.loop.call_soon_threadsafe(telemetry.on_receive, n)
+                rx.produced(n)
+                frames = self.parse_frames()
+                if frames:
+                    self.loop.call_soon_threadsafe(self.on_frames, frames)
+
+    def parse_frames(self) -> list:
+        # Replies are framed as monitor_tam + monitor_tam bytes. Only the
+        # payload of a complete frame is copied out of the ring.
+        rx = self.rx_buffer
+        if not self.framed:
+            return [rx.read(len(rx))]
+        if self.crc_frames:
+            return self.parse_crc_frames()
+        frames = []
+        while len(rx) and len(rx) > rx.peek(0):
+            size = rx.peek(0)
+            rx.skip(1)
+            frames.append(rx.read(size))
+        return frames
+
+    def parse_crc_frames(self) -> list:
+        # [sync][seq][status][tam][tam bytes][crc] -> [seq][status][tam][tam bytes].
+        # A bad crc only drops the sync byte, the next one is searched from there
+        rx = self.rx_buffer
+        frames = []
+        while len(rx) >= 5:
+            if rx.peek(0) != _p.FRAME_SYNC:
+                rx.skip(1)
+                continue
+            size = rx.peek(3) + 5
+            if len(rx) < size:
+                break
+            frame = rx.peek_bytes(size)
+            if _p.crc8(frame):
+                self.loop.call_soon_threadsafe(self.telemetry.on_frame_error)
+                rx.skip(1)
+                continue
+            rx.skip(size)
+            frames.append(frame[1:-1])
+        return frames
+
+    def on_frames(self, frames: list):
+        for frame in frames:
+            self.telemetry.on_frame()
+            self.queue.put_nowait(frame)
+
+    async def start_listener(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_flag = False
+        self.start_flag = True
+        self.transport.reset_buffers()
+        await asyncio.sleep(0.005)
+        self.listener.start()
+
+    def stop_listener(self):
+        self.stop_flag = True
+        if self.start_flag:
+            self.listener.join()
+        self.transport.close()
+
+    def send_data(self, data):
+        self.telemetry.on_send(len(data))
+        self.transport.write(data)
+
+    def send_many(self, chunks):
+        self.telemetry.on_send(sum(len(c) for c in chunks))
+        self.transport.write_many(chunks)
+
+    async def get_frame(self, timeout: float = None) -> bytes:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def get_frames_nowait(self) -> list:
+        # the frames already in, without waiting for more
+        frames = []
+        while not self.queue.empty():
+            frames.append(self.queue.get_nowait())
+        return frames